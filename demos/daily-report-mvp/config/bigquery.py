@@ -6,13 +6,20 @@ import os
 from google.cloud import bigquery
 from dotenv import load_dotenv
 
+from .cost_guard import BytesBudgetExceeded, QueryCostTracker, job_label
+from .profiling import record_query
+from .query_cache import QueryCache, CachedQueryResult
+
 load_dotenv()
 
+# 預設快取目錄：專案根目錄下的 .cache/bigquery
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'bigquery')
+
 
 class BigQueryConfig:
     """BigQuery 連線設定（支援多客戶）"""
     
-    def __init__(self, project_id=None, dataset_id=None, ga4_dataset=None):
+    def __init__(self, project_id=None, dataset_id=None, ga4_dataset=None, client=None, cost_tracker=None):
         """
         初始化 BigQuery 配置
         
@@ -20,11 +27,19 @@ class BigQueryConfig:
             project_id: Google Cloud 專案 ID（預設從環境變數讀取）
             dataset_id: E-com 資料集 ID（預設從環境變數讀取）
             ga4_dataset: GA4 資料集 ID（預設從環境變數讀取）
+            client: 既有的 BigQuery 客戶端（同專案的多個客戶共用，可選）
+            cost_tracker: 查詢成本記錄器（預設依 BQ_CLIENT_BYTES_BUDGET 建立，可選）
         """
         self.project_id = project_id or os.getenv('GOOGLE_CLOUD_PROJECT', 'datalake360-saintpaul')
         self.dataset_id = dataset_id or os.getenv('BIGQUERY_DATASET', 'datalake_stpl')
         self.ga4_dataset = ga4_dataset or os.getenv('GA4_DATASET', 'analytics_304437305')
-        self.client = None
+        self.client = client
+        
+        # 查詢結果本機快取（BQ_CACHE_ENABLED=0 可停用）
+        self.cache = QueryCache.from_env(self.project_id, DEFAULT_CACHE_DIR)
+        
+        # 查詢成本記錄與掃描量預算（BQ_DRY_RUN、BQ_CLIENT_BYTES_BUDGET，詳見 config/cost_guard.py）
+        self.cost_tracker = cost_tracker or QueryCostTracker.from_env('BQ_CLIENT_BYTES_BUDGET', '客戶')
         
         # 設定 quota project 環境變數（解決 ProjectId must be non-empty 錯誤）
         if 'GOOGLE_CLOUD_QUOTA_PROJECT' not in os.environ:
@@ -39,23 +54,135 @@ class BigQueryConfig:
             self.client = bigquery.Client(project=self.project_id)
         return self.client
     
-    def query(self, query_string, location=None, **kwargs):
+    def query(self, query_string, location=None, use_cache=True, query_parameters=None, label='query', **kwargs):
         """
         執行查詢的輔助方法
         
+        啟用快取時，唯讀查詢會先查本機快取；未命中則執行查詢並寫入快取
+        啟用成本守門時（BQ_DRY_RUN 或設定掃描量預算），執行前先 dry run 取得預估掃描量，
+        超出預算時改用過期的快取結果，沒有快取則拋出 BytesBudgetExceeded
+        
         Args:
             query_string: SQL 查詢字串
             location: 查詢位置（可選，預設讓 BigQuery 自動偵測）
+            use_cache: 是否使用本機快取（DDL / DML 等非唯讀查詢一律不快取）
+            query_parameters: 查詢參數（bigquery.ScalarQueryParameter / ArrayQueryParameter 清單，
+                              通常由 QueryParams.to_bigquery() 產生；參數納入快取鍵）
+            label: 查詢標籤（成本記錄依此彙總，並設為作業標籤 report_query 供帳單匯出分組）
             **kwargs: 其他查詢參數
             
         Returns:
-            QueryJob: 查詢作業物件
+            QueryJob 或 CachedQueryResult: 皆可呼叫 to_dataframe() 取得結果
         """
         client = self.get_client()
-        job_config = bigquery.QueryJobConfig()
+        job_config = bigquery.QueryJobConfig(labels={'report_query': job_label(label)})
+        if query_parameters:
+            job_config.query_parameters = list(query_parameters)
         if location:
-            job_config.location = location
-        return client.query(query_string, job_config=job_config, **kwargs)
+            # 位置是查詢作業的參數（QueryJobConfig 沒有 location 屬性）
+            kwargs['location'] = location
+        
+        cacheable = use_cache and self.cache is not None and self.cache.is_cacheable(query_string)
+        if cacheable:
+            table = self.cache.get(query_string, query_parameters)
+            if table is not None:
+                self.cost_tracker.record_cache_hit(label)
+                record_query(cache_hit=True, rows=table.num_rows)
+                return CachedQueryResult(table, cache_hit=True)
+        
+        record = None
+        if self.cost_tracker.checks_before_run:
+            estimated_bytes = self.estimate_bytes(query_string, query_parameters, **kwargs)
+            if estimated_bytes is not None:
+                try:
+                    record = self.cost_tracker.check(label, estimated_bytes)
+                except BytesBudgetExceeded as e:
+                    # 上方讀取快取時已計為未命中，再次讀取過期結果不重複計入命中統計
+                    table = (
+                        self.cache.get(query_string, query_parameters, allow_expired=True, count=False)
+                        if cacheable else None
+                    )
+                    if table is None:
+                        raise
+                    print(f"⚠️  {str(e)}，改用過期的本機快取結果")
+                    self.cost_tracker.record_cache_hit(label, e.record)
+                    record_query(cache_hit=True, rows=table.num_rows)
+                    return CachedQueryResult(table, cache_hit=True)
+        
+        job = client.query(query_string, job_config=job_config, **kwargs)
+        if not cacheable:
+            # 非快取查詢由呼叫端等待結果，完成後再記錄實際掃描量
+            job.add_done_callback(lambda done: self.cost_tracker.record_job(label, done, record))
+            record_query(job_id=job.job_id)
+            return job
+        
+        table = job.to_arrow()
+        self.cost_tracker.record_job(label, job, record)
+        record_query(job_id=job.job_id, rows=table.num_rows, bytes_processed=job.total_bytes_processed)
+        try:
+            self.cache.put(query_string, table, query_parameters)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  寫入查詢快取失敗: {str(e)}")
+        return CachedQueryResult(table, cache_hit=False, job=job)
+    
+    def query_rows(self, query_string, query_parameters=None, label='query', **kwargs):
+        """
+        執行查詢並以資料列清單取回結果（不建立 DataFrame）
+        
+        適合彙總查詢等只有少數列的結果：直接由 Arrow 表格（或 QueryJob 的結果迭代器）轉為 dict，
+        省去 pandas 的建構成本；快取、成本守門與計時記錄與 query() 相同
+        
+        Args:
+            query_string: SQL 查詢字串
+            query_parameters: 查詢參數（可選）
+            label: 查詢標籤
+            **kwargs: 其他 query() 參數（例如 location、use_cache）
+            
+        Returns:
+            list: [{欄位: 值}]
+        """
+        result = self.query(query_string, query_parameters=query_parameters, label=label, **kwargs)
+        if isinstance(result, CachedQueryResult):
+            return result.to_rows()
+        return [dict(row.items()) for row in result.result()]
+    
+    def query_one(self, query_string, query_parameters=None, label='query', **kwargs):
+        """
+        執行只返回單列的查詢（例如整段期間的 SUM / COUNT）
+        
+        Args:
+            query_string: SQL 查詢字串
+            query_parameters: 查詢參數（可選）
+            label: 查詢標籤
+            **kwargs: 其他 query() 參數
+            
+        Returns:
+            dict: 第一列資料，沒有結果時返回 None
+        """
+        rows = self.query_rows(query_string, query_parameters=query_parameters, label=label, **kwargs)
+        return rows[0] if rows else None
+    
+    def estimate_bytes(self, query_string, query_parameters=None, **kwargs):
+        """
+        以 dry run 取得查詢的預估掃描量（不執行查詢、不計費）
+        
+        Args:
+            query_string: SQL 查詢字串
+            query_parameters: 查詢參數（可選）
+            **kwargs: 其他查詢參數（例如 location）
+        
+        Returns:
+            int: 預估掃描位元組數；無法預估時（例如腳本引用尚未建立的資料表）返回 None
+        """
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        if query_parameters:
+            job_config.query_parameters = list(query_parameters)
+        try:
+            job = self.get_client().query(query_string, job_config=job_config, **kwargs)
+        except Exception as e:
+            print(f"⚠️  無法預估查詢掃描量，略過預算檢查: {str(e)}")
+            return None
+        return job.total_bytes_processed or 0
     
     def get_table_ref(self, table_name, dataset=None):
         """
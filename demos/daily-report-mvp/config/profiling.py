@@ -0,0 +1,221 @@
+"""
+執行階段計時
+以 span() context manager（或 @profiled 裝飾器）包住各階段：fetch_*、generate_*_chart、build_report、send，
+每個 span 結束時產生一筆 JSON 計時記錄，包含耗時、BigQuery 作業 ID、快取命中與取回的資料列數
+
+- 記錄一律保留在記憶體中，--profile 時於執行結束輸出摘要表
+- 設定 PROFILE_LOG（或 --profile-log）時，每筆記錄以 JSON Lines 寫入該檔案
+- span 以 contextvars 記錄目前所在的階段，BigQueryConfig.query 完成時把查詢統計掛到目前的 span；
+  在執行緒池中執行的工作需以 contextvars.copy_context().run 送出，才能延續所屬的 span
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+_current_span = contextvars.ContextVar('profiling_span', default=None)
+
+
+class Span:
+    """一個計時階段"""
+
+    def __init__(self, name, parent=None, attrs=None):
+        self.name = name
+        self.parent = parent
+        # 建立 span 時指定的欄位（例如 client_id）會帶到所有子階段
+        self.context = dict(parent.context) if parent is not None else {}
+        self.context.update(attrs or {})
+        self.attrs = {}
+        self.queries = []
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def set(self, **attrs):
+        """補充記錄欄位（例如資料列數、推播結果）"""
+        self.attrs.update(attrs)
+
+    def add_query(self, job_id=None, cache_hit=False, rows=None, bytes_processed=None):
+        """登記此階段內執行的 BigQuery 查詢"""
+        with self._lock:
+            self.queries.append({
+                'job_id': job_id,
+                'cache_hit': cache_hit,
+                'rows': rows,
+                'bytes_processed': bytes_processed,
+            })
+
+    def elapsed_ms(self):
+        """自階段開始經過的毫秒數"""
+        return (time.perf_counter() - self._start) * 1000
+
+    def to_record(self, duration_ms, error=None):
+        """
+        轉換為 JSON 計時記錄
+
+        Returns:
+            dict: 計時記錄
+        """
+        record = {
+            'span': self.name,
+            'parent': self.parent.name if self.parent is not None else None,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round(duration_ms, 1),
+            'thread': threading.current_thread().name,
+            'status': 'error' if error is not None else 'ok',
+            'queries': len(self.queries),
+            'cache_hits': sum(1 for q in self.queries if q['cache_hit']),
+            'rows': sum(q['rows'] or 0 for q in self.queries),
+            'job_ids': [q['job_id'] for q in self.queries if q['job_id']],
+        }
+        if error is not None:
+            record['error'] = f"{type(error).__name__}: {error}"
+        record.update(self.context)
+        record.update(self.attrs)
+        return record
+
+
+class Profiler:
+    """計時記錄收集器（執行緒安全）"""
+
+    def __init__(self, log_path=None):
+        """
+        Args:
+            log_path: JSON Lines 記錄檔路徑（可選）
+        """
+        self.records = []
+        self.log_path = log_path
+        self._lock = threading.Lock()
+
+    def configure(self, log_path=None):
+        """設定 JSON Lines 記錄檔（None 時只保留在記憶體中）"""
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+        self.log_path = log_path
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        計時一個階段
+
+        Args:
+            name: 階段名稱（例如 fetch_traffic_analysis、build_report）
+            **attrs: 附加到此階段與所有子階段記錄的欄位（例如 client_id）
+
+        Yields:
+            Span: 可在階段內以 set() 補充欄位
+        """
+        current = Span(name, parent=_current_span.get(), attrs=attrs)
+        token = _current_span.set(current)
+        error = None
+        try:
+            yield current
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            self._emit(current.to_record(current.elapsed_ms(), error))
+
+    def _emit(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.log_path:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def summary(self):
+        """
+        依階段名稱彙總計時記錄
+
+        Returns:
+            list: [{'span', 'calls', 'errors', 'total_ms', 'avg_ms', 'max_ms', 'queries', 'cache_hits', 'rows'}]，
+                  依總耗時由大到小排序
+        """
+        with self._lock:
+            records = list(self.records)
+        totals = {}
+        for record in records:
+            total = totals.setdefault(record['span'], {
+                'span': record['span'],
+                'calls': 0,
+                'errors': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'queries': 0,
+                'cache_hits': 0,
+                'rows': 0,
+            })
+            total['calls'] += 1
+            total['errors'] += int(record['status'] == 'error')
+            total['total_ms'] += record['duration_ms']
+            total['max_ms'] = max(total['max_ms'], record['duration_ms'])
+            total['queries'] += record['queries']
+            total['cache_hits'] += record['cache_hits']
+            total['rows'] += record['rows']
+        for total in totals.values():
+            total['avg_ms'] = total['total_ms'] / total['calls']
+        return sorted(totals.values(), key=lambda t: t['total_ms'], reverse=True)
+
+    def print_summary(self):
+        """輸出各階段的耗時摘要表"""
+        rows = self.summary()
+        if not rows:
+            return
+        width = max(len('span'), *(len(row['span']) for row in rows))
+        print(f"⏱️  執行階段耗時：")
+        print(f"   {'span':<{width}}  {'calls':>5}  {'total_ms':>10}  {'avg_ms':>9}  {'max_ms':>9}  "
+              f"{'queries':>7}  {'cached':>6}  {'rows':>8}")
+        for row in rows:
+            errors = f"  ❌ {row['errors']}" if row['errors'] else ''
+            print(f"   {row['span']:<{width}}  {row['calls']:>5}  {row['total_ms']:>10.1f}  {row['avg_ms']:>9.1f}  "
+                  f"{row['max_ms']:>9.1f}  {row['queries']:>7}  {row['cache_hits']:>6}  {row['rows']:>8}{errors}")
+        if self.log_path:
+            print(f"   📝 計時記錄：{self.log_path}")
+
+
+# 整個程序共用的收集器
+profiler = Profiler(os.getenv('PROFILE_LOG') or None)
+
+
+def span(name, **attrs):
+    """以共用收集器計時一個階段（見 Profiler.span）"""
+    return profiler.span(name, **attrs)
+
+
+def profiled(name=None):
+    """
+    以 span 包住整個函式的裝飾器
+
+    Args:
+        name: 階段名稱（預設使用函式名稱）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_query(job_id=None, cache_hit=False, rows=None, bytes_processed=None):
+    """將查詢統計登記到目前的 span（不在任何 span 內時略過）"""
+    current = _current_span.get()
+    if current is not None:
+        current.add_query(job_id=job_id, cache_hit=cache_hit, rows=rows, bytes_processed=bytes_processed)
+
+
+def submit(executor, func, *args, **kwargs):
+    """
+    將工作送入執行緒池，並延續目前的 span（子查詢的統計才會記到呼叫端的階段）
+
+    Returns:
+        Future: executor.submit 的結果
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
@@ -6,37 +6,91 @@
 3. 查詢 BigQuery 資料
 4. 生成單行 JSON 資料
 5. 推播通知（Google Chat、LINE）
+
+支援單一客戶（--client）與多客戶批次（--clients / --all-clients）執行：
+批次模式只載入一次設定檔，同一個 project_id 的客戶共用 BigQuery 客戶端，
+以有限數量的工作執行緒並行查詢與推播，最後輸出各客戶的成功 / 失敗摘要
 """
 import argparse
+import json
 import os
 import sys
-from datetime import date
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from config.bigquery import BigQueryConfig
+from config.cost_guard import QueryCostTracker, budget_from_env
+from config.profiling import profiler, span
 from src.config.client_config import ClientConfig
 from src.config.target_config import TargetConfig
 from src.data.validator import GA4DataValidator
 from src.data.fetcher import DataFetcher
+from src.data.daily_metrics_store import DailyMetricsStore
+from src.data.rollup_store import RollupStore
 from src.generator.daily_aggregation import DailyAggregationGenerator
 from src.notification.google_chat import GoogleChatNotifier
 from src.notification.line_notify import LineNotifier
 from src.utils.date_utils import get_yesterday
 
 
-def main():
-    """主程式入口"""
+def parse_args() -> argparse.Namespace:
+    """解析命令列參數"""
     parser = argparse.ArgumentParser(description='每日數據彙整日報 - MVP v1.1')
-    parser.add_argument(
+    client_group = parser.add_mutually_exclusive_group(required=True)
+    client_group.add_argument(
         '--client',
         type=str,
-        required=True,
         help='客戶 ID（必須在 config/clients.yaml 中設定）'
     )
+    client_group.add_argument(
+        '--clients',
+        type=str,
+        help='多個客戶 ID，以逗號分隔（例如 client_A,client_B）'
+    )
+    client_group.add_argument(
+        '--all-clients',
+        action='store_true',
+        help='執行 config/clients.yaml 中的所有客戶'
+    )
     parser.add_argument(
         '--date',
         type=str,
         default=None,
         help='要彙整的日期（YYYY-MM-DD），預設為昨日（T-1）'
     )
+    parser.add_argument(
+        '--from',
+        dest='from_date',
+        type=str,
+        default=None,
+        help='回補起始日期（YYYY-MM-DD），需搭配 --to'
+    )
+    parser.add_argument(
+        '--to',
+        dest='to_date',
+        type=str,
+        default=None,
+        help='回補結束日期（YYYY-MM-DD，含當日）'
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='回補模式的 JSON Lines 輸出路徑（預設 output/backfill_<from>_<to>.jsonl）'
+    )
+    parser.add_argument(
+        '--cache',
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help='是否使用本機查詢快取（BQ_CACHE_ENABLED）。每日模式預設使用；回補模式預設不使用（--no-cache），'
+             '已結束的日期會永久快取，GA4 重新同步後重跑回補需重新查詢；--cache 會重用先前的快取結果'
+    )
+    parser.add_argument(
+        '--notify',
+        action='store_true',
+        help='回補模式也發送推播（預設不發送）'
+    )
     parser.add_argument(
         '--skip-validation',
         action='store_true',
@@ -47,19 +101,325 @@ def main():
         action='store_true',
         help='乾跑模式：只生成資料，不發送推播'
     )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='執行結束時輸出各階段（查詢、驗證、彙總、推播）的耗時摘要表'
+    )
+    parser.add_argument(
+        '--profile-log',
+        type=str,
+        default=os.environ.get('PROFILE_LOG'),
+        help='將每個階段的 JSON 計時記錄寫入指定檔案（JSON Lines，預設讀取 PROFILE_LOG）'
+    )
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=int(os.environ.get('DAILY_REPORT_MAX_WORKERS', '4')),
+        help='批次模式同時處理的客戶數上限（預設 4）'
+    )
+    return parser.parse_args()
+
+
+def load_target_config() -> Optional[TargetConfig]:
+    """
+    讀取目標設定檔（動態月份目標）
+    
+    Returns:
+        TargetConfig: 目標設定，讀取失敗時返回 None（改用客戶設定檔的預設值）
+    """
+    try:
+        return TargetConfig()
+    except Exception as e:
+        print(f"⚠️  警告：無法載入目標設定檔 - {str(e)}")
+        return None
+
+
+def resolve_monthly_target(
+    client: Dict[str, Any],
+    report_date: date,
+    target_config: Optional[TargetConfig]
+) -> int:
+    """
+    取得客戶當月營收目標（優先使用目標檔，找不到時使用客戶設定檔的預設值）
     
-    args = parser.parse_args()
+    Args:
+        client: 客戶設定
+        report_date: 報告日期（用於判斷月份）
+        target_config: 目標設定（可為 None）
     
-    # 解析日期
-    if args.date:
+    Returns:
+        int: 當月營收目標
+    
+    Raises:
+        ValueError: 目標檔與客戶設定檔都沒有目標時
+    """
+    default = client.get('monthly_target_revenue')
+    if target_config is None:
+        monthly_target = default
+    else:
+        monthly_target = target_config.get_monthly_target(report_date, default=default)
+    
+    if monthly_target is None:
+        raise ValueError(
+            f"找不到 {report_date.strftime('%Y-%m')} 的目標設定，"
+            f"請在 config/targets.yaml 或 config/clients.yaml 中設定 monthly_target_revenue"
+        )
+    return monthly_target
+
+
+def build_bigquery_configs(clients: Dict[str, Dict[str, Any]]) -> Dict[str, BigQueryConfig]:
+    """
+    為每個客戶建立 BigQuery 配置，同一個 project_id 的客戶共用同一個 BigQuery 客戶端
+    
+    每個客戶套用各自的 BQ_CLIENT_BYTES_BUDGET 掃描量預算，並共用整次執行的 BQ_REPORT_BYTES_BUDGET
+    
+    Args:
+        clients: {client_id: 客戶設定}
+    
+    Returns:
+        dict: {client_id: BigQueryConfig}
+    """
+    shared_clients = {}
+    bq_configs = {}
+    report_budget = budget_from_env('BQ_REPORT_BYTES_BUDGET', '本次執行')
+    shared_budgets = [report_budget] if report_budget is not None else []
+    for client_id, client in clients.items():
+        settings = client['bigquery']
+        project_id = settings['project_id']
+        bq = BigQueryConfig(
+            project_id=project_id,
+            dataset_id=settings['dataset_id'],
+            ga4_dataset=settings['ga4_dataset'],
+            client=shared_clients.get(project_id),
+            cost_tracker=QueryCostTracker.from_env(
+                'BQ_CLIENT_BYTES_BUDGET', f'客戶 {client_id} ', shared_budgets=shared_budgets
+            ),
+        )
+        shared_clients[project_id] = bq.get_client()
+        bq_configs[client_id] = bq
+    return bq_configs
+
+
+def generate_client_report(
+    client_id: str,
+    client: Dict[str, Any],
+    bq: BigQueryConfig,
+    report_date: date,
+    monthly_target: int,
+    skip_validation: bool = False,
+    log: Callable[[str], None] = print,
+    metrics_store: Optional[DailyMetricsStore] = None,
+    data_fetcher: Optional[DataFetcher] = None,
+    use_cache: bool = True
+) -> Dict[str, Any]:
+    """
+    執行 GA4 驗證並生成單一客戶的每日彙總資料
+    
+    Args:
+        client_id: 客戶 ID
+        client: 客戶設定（用於廣告 / sessions 手動資料）
+        bq: BigQuery 配置
+        report_date: 報告日期
+        monthly_target: 當月營收目標
+        skip_validation: 是否跳過 GA4 驗證
+        log: 輸出訊息的函式
+        metrics_store: 跨客戶共用的 DailyMetricsStore（可選，批次 / 回補模式使用）
+        data_fetcher: 已載入資料的 DataFetcher（可選，回補模式逐日重用；未指定時建立新的查詢器）
+        use_cache: 是否使用本機查詢快取（未指定 data_fetcher 時套用於新建的查詢器）
+    
+    Returns:
+        dict: 每日彙總單行 JSON 資料
+    """
+    with span('client_report', client_id=client_id, report_date=report_date.isoformat()):
+        fetcher = data_fetcher or DataFetcher(bq, metrics_store=metrics_store, use_cache=use_cache)
+        generator = DailyAggregationGenerator(fetcher)
+        
+        # 一次查詢載入當日與上週同期的 daily_metrics，供驗證與彙總共用
         try:
-            report_date = date.fromisoformat(args.date)
-        except ValueError:
-            print(f"❌ 錯誤：日期格式不正確，應為 YYYY-MM-DD")
-            sys.exit(1)
+            generator.prefetch(report_date)
+        except Exception as e:
+            log(f"⚠️  批次載入 daily_metrics 失敗，將逐項查詢 - {str(e)}")
+        
+        ga4_warning_note: str | None = None
+        if not skip_validation:
+            log(f"🔍 執行 GA4 數據驗證...")
+            validator = GA4DataValidator(bq, data_fetcher=fetcher)
+            status, message = validator.validate_ga4_data(report_date)
+            
+            if status == "ok":
+                log(f"✅ {message}")
+            elif status == "warning":
+                log(f"⚠️ {message}")
+                ga4_warning_note = message
+            else:
+                log(f"⚠️ GA4 數據驗證失敗：{message}")
+                ga4_warning_note = message
+        else:
+            log(f"⚠️  跳過 GA4 數據驗證（--skip-validation）")
+        
+        log(f"📊 查詢 BigQuery 資料...")
+        # 生成單行 JSON 資料（傳入客戶設定以取得廣告資料）
+        daily_data = generator.generate(
+            client_id=client_id,
+            report_date=report_date,
+            monthly_target_revenue=monthly_target,
+            client_config=client
+        )
+        
+        brand_name = client.get("brand_name")
+        if brand_name:
+            daily_data["brand_name"] = brand_name
+        
+        if ga4_warning_note:
+            daily_data['ga4_warning'] = ga4_warning_note
+        
+        log(f"✅ 資料生成成功")
+        log(f"   - 營收：${daily_data['revenue']:,}")
+        log(f"   - 訂單：{daily_data['orders']:,} 筆")
+        log(f"   - CVR：{daily_data['cvr']*100:.2f}%")
+        log(f"   - Sessions：{daily_data['sessions']:,}")
+        log(f"   - 目標達成率：{daily_data['mtd_achievement_rate']*100:.1f}%")
+        
+        return daily_data
+
+
+def update_rollups(
+    rollup_store: Optional[RollupStore],
+    bq: BigQueryConfig,
+    start_date: date,
+    end_date: date,
+    log: Callable[[str], None] = print,
+    use_cache: bool = True
+) -> None:
+    """
+    將訂單的每日彙總寫入本機 rollup 儲存（ROLLUP_DB_PATH），週報直接加總已存的每日資料
+    
+    Args:
+        rollup_store: 每日彙總儲存（未設定 ROLLUP_DB_PATH 時為 None，不寫入）
+        bq: BigQuery 配置
+        start_date: 開始日期
+        end_date: 結束日期
+        log: 輸出訊息的函式
+        use_cache: 是否使用本機查詢快取
+    """
+    if rollup_store is None:
+        return
+    
+    try:
+        days = rollup_store.refresh(bq, start_date, end_date, use_cache=use_cache)
+        log(f"🗄️  已寫入每日彙總：{days} 天（{rollup_store.path}）")
+    except Exception as e:
+        # 每日彙總只是週報的加速用途，失敗不影響日報
+        log(f"⚠️  寫入每日彙總失敗 - {str(e)}")
+
+
+def send_notifications(
+    client: Dict[str, Any],
+    daily_data: Dict[str, Any],
+    log: Callable[[str], None] = print
+) -> List[Tuple[str, bool, str]]:
+    """
+    發送 Google Chat 與 LINE 推播
+    
+    Args:
+        client: 客戶設定（包含 google_chat_webhook）
+        daily_data: 每日彙總資料
+        log: 輸出訊息的函式
+    
+    Returns:
+        list: [(通道名稱, 是否成功, 訊息)]
+    """
+    results = []
+    
+    # Google Chat
+    log(f"📤 發送 Google Chat 推播...")
+    try:
+        notifier = GoogleChatNotifier(client['google_chat_webhook'])
+        success, message = notifier.send(daily_data)
+        if success:
+            log(f"✅ Google Chat：{message}")
+        else:
+            log(f"❌ Google Chat：{message}")
+        results.append(("Google Chat", success, message))
+    except Exception as e:
+        log(f"❌ Google Chat 推播失敗 - {str(e)}")
+        traceback.print_exc()
+        results.append(("Google Chat", False, str(e)))
+    
+    # LINE 推播（若環境變數設定）
+    line_token = os.environ.get("LINE_CHANNEL_ACCESS_TOKEN")
+    line_targets_env = os.environ.get("LINE_TARGET_IDS")
+    line_targets = [t.strip() for t in line_targets_env.split(",")] if line_targets_env else []
+    if line_token and line_targets:
+        log(f"📤 發送 LINE 推播...")
+        try:
+            line_notifier = LineNotifier(
+                access_token=line_token,
+                target_ids=line_targets,
+                dashboard_url=os.environ.get("LINE_DASHBOARD_URL"),
+                brand_name=client.get("brand_name"),
+            )
+            line_success, line_message = line_notifier.send(daily_data)
+            if line_success:
+                log(f"✅ LINE：{line_message}")
+            else:
+                log(f"❌ LINE：{line_message}")
+            results.append(("LINE", line_success, line_message))
+        except Exception as e:
+            log(f"❌ LINE 推播失敗 - {str(e)}")
+            traceback.print_exc()
+            results.append(("LINE", False, str(e)))
     else:
-        report_date = get_yesterday()
+        log("ℹ️  LINE 推播未啟用（缺少 LINE_CHANNEL_ACCESS_TOKEN 或 LINE_TARGET_IDS）")
     
+    return results
+
+
+def print_cache_stats(bq_configs: List[BigQueryConfig]) -> None:
+    """輸出查詢快取命中統計（加總所有 BigQuery 配置）"""
+    caches = [bq.cache for bq in bq_configs if bq.cache is not None]
+    if caches:
+        hits = sum(cache.stats()['hits'] for cache in caches)
+        misses = sum(cache.stats()['misses'] for cache in caches)
+        print(f"🗄️  查詢快取：命中 {hits} 次，未命中 {misses} 次")
+
+
+def print_cost_summary(bq_configs: Dict[str, BigQueryConfig]) -> None:
+    """輸出各客戶的 BigQuery 查詢成本（預估 / 實際掃描量與 slot 時間）"""
+    for client_id, bq in bq_configs.items():
+        bq.cost_tracker.print_summary(f"BigQuery 查詢成本（{client_id}）")
+
+
+def resolve_clients(args: argparse.Namespace, client_config: ClientConfig) -> Dict[str, Dict[str, Any]]:
+    """
+    依命令列參數（--client / --clients / --all-clients）取得要執行的客戶設定
+    
+    Args:
+        args: 命令列參數
+        client_config: 客戶設定
+    
+    Returns:
+        dict: {client_id: 客戶設定}（找不到客戶時結束程式）
+    """
+    if args.all_clients:
+        client_ids = client_config.list_clients()
+    elif args.clients:
+        client_ids = [c.strip() for c in args.clients.split(',') if c.strip()]
+    else:
+        client_ids = [args.client]
+    
+    unknown = [c for c in client_ids if client_config.get_client(c) is None]
+    if unknown:
+        print(f"❌ 錯誤：找不到客戶 {', '.join(unknown)}")
+        print(f"💡 可用的客戶：{', '.join(client_config.list_clients())}")
+        sys.exit(1)
+    
+    return {c: client_config.get_client(c) for c in client_ids}
+
+
+def run_single_client(args: argparse.Namespace, report_date: date) -> None:
+    """執行單一客戶（--client）"""
     print(f"🚀 開始執行每日數據彙整日報")
     print(f"📅 報告日期：{report_date}")
     print(f"👤 客戶 ID：{args.client}")
@@ -77,154 +437,322 @@ def main():
         
         print(f"✅ 客戶設定載入成功")
         
-        # 提取設定
-        bq_config = client['bigquery']
-        webhook_url = client['google_chat_webhook']
-        client_config = client  # 保存完整客戶設定，供廣告資料查詢使用
-        
         # 步驟 1.5: 讀取目標設定（動態月份目標）
         try:
-            target_config = TargetConfig()
-            # 根據報告日期取得當月目標（優先使用目標檔）
-            monthly_target = target_config.get_monthly_target(
-                report_date,
-                default=client.get('monthly_target_revenue')  # 如果找不到，使用客戶設定檔的預設值
-            )
-            
-            if monthly_target is None:
-                print(f"⚠️  警告：找不到 {report_date.strftime('%Y-%m')} 的目標設定，且客戶設定檔中沒有預設值")
-                print(f"💡 請在 config/targets.yaml 中設定，或在 config/clients.yaml 中設定 monthly_target_revenue")
-                sys.exit(1)
-            
-            print(f"✅ 目標設定載入成功：{report_date.strftime('%Y-%m')} 目標 ${monthly_target:,}")
-            
-        except Exception as e:
-            print(f"⚠️  警告：無法載入目標設定檔 - {str(e)}")
-            # 如果目標檔讀取失敗，使用客戶設定檔的預設值
-            monthly_target = client.get('monthly_target_revenue')
-            if monthly_target is None:
-                print(f"❌ 錯誤：找不到目標設定，請在 config/targets.yaml 或 config/clients.yaml 中設定")
-                sys.exit(1)
-            print(f"✅ 使用客戶設定檔的預設目標：${monthly_target:,}")
-        
+            monthly_target = resolve_monthly_target(client, report_date, load_target_config())
+        except ValueError as e:
+            print(f"❌ 錯誤：{str(e)}")
+            sys.exit(1)
+        print(f"✅ 目標設定載入成功：{report_date.strftime('%Y-%m')} 目標 ${monthly_target:,}")
+    
     except Exception as e:
         print(f"❌ 錯誤：無法載入客戶設定 - {str(e)}")
         sys.exit(1)
     
     # 步驟 2: 初始化 BigQuery 配置
     try:
-        bq = BigQueryConfig(
-            project_id=bq_config['project_id'],
-            dataset_id=bq_config['dataset_id'],
-            ga4_dataset=bq_config['ga4_dataset']
-        )
+        bq = build_bigquery_configs({args.client: client})[args.client]
         print(f"✅ BigQuery 連線成功")
     except Exception as e:
         print(f"❌ 錯誤：BigQuery 連線失敗 - {str(e)}")
         sys.exit(1)
     
-    ga4_warning_note: str | None = None
-    # 步驟 3: GA4 數據驗證（前置檢查）
-    if not args.skip_validation:
-        print(f"🔍 執行 GA4 數據驗證...")
-        validator = GA4DataValidator(bq)
-        status, message = validator.validate_ga4_data(report_date)
-
-        if status == "ok":
-            print(f"✅ {message}")
-        elif status == "warning":
-            print(f"⚠️ {message}")
-            ga4_warning_note = message
-        else:
-            print(f"⚠️ GA4 數據驗證失敗：{message}")
-            ga4_warning_note = message
-    else:
-        print(f"⚠️  跳過 GA4 數據驗證（--skip-validation）")
-    
-    # 步驟 4: 查詢 BigQuery 資料
-    print(f"📊 查詢 BigQuery 資料...")
+    # 步驟 3-4: GA4 數據驗證（前置檢查）與查詢 BigQuery 資料
     try:
-        fetcher = DataFetcher(bq)
-        generator = DailyAggregationGenerator(fetcher)
-        
-        # 生成單行 JSON 資料（傳入客戶設定以取得廣告資料）
-        daily_data = generator.generate(
-            client_id=args.client,
-            report_date=report_date,
-            monthly_target_revenue=monthly_target,
-            client_config=client_config  # 傳入客戶設定
+        daily_data = generate_client_report(
+            args.client, client, bq, report_date, monthly_target,
+            skip_validation=args.skip_validation,
+            use_cache=args.cache is not False,
         )
-
-        brand_name = client.get("brand_name")
-        if brand_name:
-            daily_data["brand_name"] = brand_name
-
-        if ga4_warning_note:
-            daily_data['ga4_warning'] = ga4_warning_note
-        
-        print(f"✅ 資料生成成功")
-        print(f"   - 營收：${daily_data['revenue']:,}")
-        print(f"   - 訂單：{daily_data['orders']:,} 筆")
-        print(f"   - CVR：{daily_data['cvr']*100:.2f}%")
-        print(f"   - Sessions：{daily_data['sessions']:,}")
-        print(f"   - 目標達成率：{daily_data['mtd_achievement_rate']*100:.1f}%")
-        
     except Exception as e:
         print(f"❌ 錯誤：資料查詢失敗 - {str(e)}")
-        import traceback
         traceback.print_exc()
         sys.exit(1)
     
+    update_rollups(RollupStore.from_env(), bq, report_date, report_date, use_cache=args.cache is not False)
+    
     # 步驟 5: 推播到 Google Chat / LINE
     if args.dry_run:
         print(f"⚠️  乾跑模式：不發送推播")
         print(f"📋 生成的資料（JSON）：")
-        import json
         print(json.dumps(daily_data, indent=2, ensure_ascii=False))
     else:
-        # Google Chat
-        print(f"📤 發送 Google Chat 推播...")
-        try:
-            notifier = GoogleChatNotifier(webhook_url)
-            success, message = notifier.send(daily_data)
-            if success:
-                print(f"✅ Google Chat：{message}")
-            else:
-                print(f"❌ Google Chat：{message}")
-        except Exception as e:
-            print(f"❌ Google Chat 推播失敗 - {str(e)}")
-            import traceback
-            traceback.print_exc()
-        
-        # LINE 推播（若環境變數設定）
-        line_token = os.environ.get("LINE_CHANNEL_ACCESS_TOKEN")
-        line_targets_env = os.environ.get("LINE_TARGET_IDS")
-        line_targets = [t.strip() for t in line_targets_env.split(",")] if line_targets_env else []
-        if line_token and line_targets:
-            print(f"📤 發送 LINE 推播...")
+        send_notifications(client, daily_data)
+    
+    print_cache_stats([bq])
+    print_cost_summary({args.client: bq})
+    
+    print("-" * 50)
+    print(f"🎉 執行完成！")
+
+
+def run_batch(args: argparse.Namespace, report_date: date) -> None:
+    """執行多個客戶（--clients / --all-clients）"""
+    try:
+        client_config = ClientConfig()
+    except Exception as e:
+        print(f"❌ 錯誤：無法載入客戶設定 - {str(e)}")
+        sys.exit(1)
+    
+    clients = resolve_clients(args, client_config)
+    client_ids = list(clients)
+    max_workers = max(1, args.max_workers)
+    
+    print(f"🚀 開始執行每日數據彙整日報（批次模式）")
+    print(f"📅 報告日期：{report_date}")
+    print(f"👥 客戶數：{len(clients)}（同時處理 {max_workers} 個）")
+    print("-" * 50)
+    
+    target_config = load_target_config()
+    
+    # 每個客戶的執行結果：{'data': ..., 'error': ..., 'notifications': [...]}
+    results = {c: {'data': None, 'error': None, 'notifications': []} for c in client_ids}
+    
+    try:
+        bq_configs = build_bigquery_configs(clients)
+    except Exception as e:
+        print(f"❌ 錯誤：BigQuery 連線失敗 - {str(e)}")
+        sys.exit(1)
+    projects = sorted({bq.project_id for bq in bq_configs.values()})
+    print(f"✅ BigQuery 連線成功（{len(projects)} 個專案：{', '.join(projects)}）")
+    
+    # 先登記所有客戶需要的 daily_metrics 日期，同專案的客戶合併為一次查詢
+    metrics_store = DailyMetricsStore()
+    use_cache = args.cache is not False
+    for client_id in client_ids:
+        metrics_store.request(
+            bq_configs[client_id], DailyAggregationGenerator.required_dates(report_date), use_cache=use_cache
+        )
+    rollup_store = RollupStore.from_env()
+
+    def make_logger(client_id: str) -> Callable[[str], None]:
+        return lambda message: print(f"[{client_id}] {message}")
+
+    def process(client_id: str) -> Dict[str, Any]:
+        client = clients[client_id]
+        monthly_target = resolve_monthly_target(client, report_date, target_config)
+        daily_data = generate_client_report(
+            client_id, client, bq_configs[client_id], report_date, monthly_target,
+            skip_validation=args.skip_validation,
+            log=make_logger(client_id),
+            metrics_store=metrics_store,
+            use_cache=use_cache,
+        )
+        update_rollups(
+            rollup_store, bq_configs[client_id], report_date, report_date,
+            log=make_logger(client_id), use_cache=use_cache,
+        )
+        return daily_data
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # 步驟 1: 並行查詢各客戶資料
+        futures = {c: executor.submit(process, c) for c in client_ids}
+        for client_id, future in futures.items():
             try:
-                line_notifier = LineNotifier(
-                    access_token=line_token,
-                    target_ids=line_targets,
-                    dashboard_url=os.environ.get("LINE_DASHBOARD_URL"),
-                    brand_name=brand_name,
-                )
-                line_success, line_message = line_notifier.send(daily_data)
-                if line_success:
-                    print(f"✅ LINE：{line_message}")
-                else:
-                    print(f"❌ LINE：{line_message}")
+                results[client_id]['data'] = future.result()
             except Exception as e:
-                print(f"❌ LINE 推播失敗 - {str(e)}")
-                import traceback
-                traceback.print_exc()
+                print(f"[{client_id}] ❌ 錯誤：資料查詢失敗 - {str(e)}")
+                results[client_id]['error'] = str(e)
+        
+        # 步驟 2: 並行推播
+        succeeded = [c for c in client_ids if results[c]['data'] is not None]
+        if args.dry_run:
+            print(f"⚠️  乾跑模式：不發送推播")
+            for client_id in succeeded:
+                print(f"📋 [{client_id}] 生成的資料（JSON）：")
+                print(json.dumps(results[client_id]['data'], indent=2, ensure_ascii=False))
         else:
-            print("ℹ️  LINE 推播未啟用（缺少 LINE_CHANNEL_ACCESS_TOKEN 或 LINE_TARGET_IDS）")
+            notify_futures = {
+                c: executor.submit(send_notifications, clients[c], results[c]['data'], make_logger(c))
+                for c in succeeded
+            }
+            for client_id, future in notify_futures.items():
+                try:
+                    results[client_id]['notifications'] = future.result()
+                except Exception as e:
+                    results[client_id]['notifications'] = [("推播", False, str(e))]
+    
+    print(f"📦 daily_metrics 查詢：{metrics_store.queries} 次（{len(client_ids)} 個客戶）")
+    print_cache_stats(list(bq_configs.values()))
+    print_cost_summary(bq_configs)
     
+    # 執行摘要
     print("-" * 50)
-    print(f"🎉 執行完成！")
+    print(f"📋 執行摘要：")
+    failed = 0
+    for client_id in client_ids:
+        result = results[client_id]
+        notify_failed = [name for name, success, _ in result['notifications'] if not success]
+        if result['error']:
+            failed += 1
+            print(f"   ❌ {client_id}：資料查詢失敗 - {result['error']}")
+        elif notify_failed:
+            failed += 1
+            print(f"   ⚠️  {client_id}：資料生成成功，推播失敗（{', '.join(notify_failed)}）")
+        else:
+            sent = ', '.join(name for name, _, _ in result['notifications']) or '未推播'
+            print(f"   ✅ {client_id}：營收 ${result['data']['revenue']:,}（{sent}）")
+    
+    print("-" * 50)
+    print(f"🎉 執行完成！成功 {len(client_ids) - failed} / {len(client_ids)}")
+    if failed:
+        sys.exit(1)
+
+
+def run_backfill(args: argparse.Namespace, start_date: date, end_date: date) -> None:
+    """
+    回補模式（--from / --to）：一次查詢載入整個區間（含前 7 日供週比較）的 daily_metrics，
+    在記憶體中逐日生成每日彙總資料並寫入 JSON Lines 檔案
+    """
+    try:
+        client_config = ClientConfig()
+    except Exception as e:
+        print(f"❌ 錯誤：無法載入客戶設定 - {str(e)}")
+        sys.exit(1)
+    
+    clients = resolve_clients(args, client_config)
+    client_ids = list(clients)
+    report_dates = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    # 週比較需要每一天的上週同期，因此多載入區間前 7 日
+    load_dates = [start_date - timedelta(days=i) for i in range(7, 0, -1)] + report_dates
+    output_path = args.output or os.path.join('output', f'backfill_{start_date}_{end_date}.jsonl')
+    # 回補通常是 GA4 重新同步後重跑，已結束的日期在本機快取中永久有效，預設重新查詢
+    use_cache = bool(args.cache)
+    
+    print(f"🚀 開始執行每日數據彙整日報（回補模式）")
+    print(f"📅 回補區間：{start_date} ~ {end_date}（{len(report_dates)} 天）")
+    print(f"👥 客戶：{', '.join(client_ids)}")
+    print(f"💾 輸出檔案：{output_path}")
+    if use_cache:
+        print(f"⚠️  使用本機查詢快取（--cache）：已快取的日期不會重新查詢，GA4 重新同步後請改用 --no-cache")
+    else:
+        print(f"🔄 不使用本機查詢快取，重新查詢 BigQuery（需要時加上 --cache 重用快取）")
+    print("-" * 50)
+    
+    target_config = load_target_config()
+    
+    try:
+        bq_configs = build_bigquery_configs(clients)
+    except Exception as e:
+        print(f"❌ 錯誤：BigQuery 連線失敗 - {str(e)}")
+        sys.exit(1)
+    
+    metrics_store = DailyMetricsStore()
+    for client_id in client_ids:
+        metrics_store.request(bq_configs[client_id], load_dates, use_cache=use_cache)
+    rollup_store = RollupStore.from_env()
+
+    def backfill_client(client_id: str) -> List[Dict[str, Any]]:
+        client = clients[client_id]
+        fetcher = DataFetcher(bq_configs[client_id], metrics_store=metrics_store, use_cache=use_cache)
+        fetcher.prefetch(load_dates)
+        
+        records = []
+        for report_date in report_dates:
+            monthly_target = resolve_monthly_target(client, report_date, target_config)
+            # 每日資料都已在記憶體中，generate 與驗證不會再查詢 daily_metrics
+            records.append(generate_client_report(
+                client_id, client, bq_configs[client_id], report_date, monthly_target,
+                skip_validation=args.skip_validation,
+                log=lambda message: None,
+                metrics_store=metrics_store,
+                data_fetcher=fetcher,
+            ))
+            print(f"[{client_id}] ✅ {report_date}：營收 ${records[-1]['revenue']:,}")
+        
+        # 整個區間以一次按日彙總查詢寫入
+        update_rollups(
+            rollup_store, bq_configs[client_id], start_date, end_date,
+            log=lambda message: print(f"[{client_id}] {message}"),
+            use_cache=use_cache,
+        )
+        return records
+    
+    results = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, args.max_workers)) as executor:
+        futures = {c: executor.submit(backfill_client, c) for c in client_ids}
+        for client_id, future in futures.items():
+            try:
+                results[client_id] = future.result()
+            except Exception as e:
+                print(f"[{client_id}] ❌ 錯誤：回補失敗 - {str(e)}")
+                errors[client_id] = str(e)
+    
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for client_id in client_ids:
+            for record in results.get(client_id, []):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    
+    total_records = sum(len(records) for records in results.values())
+    print(f"✅ 已寫入 {total_records} 筆資料：{output_path}")
+    
+    if args.notify:
+        for client_id, records in results.items():
+            for record in records:
+                send_notifications(clients[client_id], record, log=lambda m, c=client_id: print(f"[{c}] {m}"))
+    else:
+        print(f"ℹ️  回補模式預設不發送推播（需要時加上 --notify）")
+    
+    print(f"📦 daily_metrics 查詢：{metrics_store.queries} 次（{len(client_ids)} 個客戶）")
+    print_cache_stats(list(bq_configs.values()))
+    print_cost_summary(bq_configs)
+    
+    print("-" * 50)
+    print(f"🎉 回補完成！成功 {len(results)} / {len(client_ids)} 個客戶")
+    if errors:
+        sys.exit(1)
+
+
+def main():
+    """主程式入口"""
+    args = parse_args()
+    profiler.configure(args.profile_log)
+    
+    try:
+        run(args)
+    finally:
+        # 失敗結束（sys.exit）時也輸出已完成階段的耗時
+        if args.profile:
+            print("-" * 50)
+            profiler.print_summary()
+
+
+def run(args: argparse.Namespace) -> None:
+    """依命令列參數執行單一客戶、批次或回補模式"""
+    # 回補模式
+    if args.from_date or args.to_date:
+        if not (args.from_date and args.to_date):
+            print(f"❌ 錯誤：--from 與 --to 必須同時指定")
+            sys.exit(1)
+        try:
+            start_date = date.fromisoformat(args.from_date)
+            end_date = date.fromisoformat(args.to_date)
+        except ValueError:
+            print(f"❌ 錯誤：日期格式不正確，應為 YYYY-MM-DD")
+            sys.exit(1)
+        if start_date > end_date:
+            print(f"❌ 錯誤：--from 不可晚於 --to")
+            sys.exit(1)
+        run_backfill(args, start_date, end_date)
+        return
+    
+    # 解析日期
+    if args.date:
+        try:
+            report_date = date.fromisoformat(args.date)
+        except ValueError:
+            print(f"❌ 錯誤：日期格式不正確，應為 YYYY-MM-DD")
+            sys.exit(1)
+    else:
+        report_date = get_yesterday()
+    
+    if args.client:
+        run_single_client(args, report_date)
+    else:
+        run_batch(args, report_date)
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,88 @@
+"""
+跨客戶共用的 daily_metrics 資料列儲存
+多個客戶指向同一個 BigQuery 專案時，將所有待查的 (專案, 日期) 合併為每個專案一次查詢，
+再把資料列分送給各客戶的 DataFetcher
+"""
+import threading
+from datetime import date
+from typing import Dict, Iterable, Optional
+from config.bigquery import BigQueryConfig
+from config.profiling import profiled
+
+
+class DailyMetricsStore:
+    """daily_metrics 資料列儲存（以專案 ID + 日期為鍵，執行緒安全）"""
+    
+    def __init__(self):
+        # 已載入的資料列（key: (專案 ID, 日期)，value: 資料列 dict；None 表示 view 中沒有該日資料）
+        self._rows: Dict[tuple, Optional[dict]] = {}
+        # 尚未查詢的日期（key: 專案 ID）
+        self._pending: Dict[str, set] = {}
+        # 每個專案用來執行查詢的 BigQuery 配置
+        self._bq_configs: Dict[str, BigQueryConfig] = {}
+        # 不使用本機查詢快取的專案（任一客戶以 use_cache=False 登記時，整個專案的合併查詢都重新查詢）
+        self._no_cache: set = set()
+        self._lock = threading.Lock()
+        self._project_locks: Dict[str, threading.Lock] = {}
+        self.queries = 0
+    
+    def request(self, bq_config: BigQueryConfig, dates: Iterable[date], use_cache: bool = True) -> None:
+        """
+        登記待查日期（不立即查詢，等到第一次 load 時與同專案其他客戶的日期一起查詢）
+        
+        Args:
+            bq_config: 客戶的 BigQuery 配置
+            dates: 要載入的日期
+            use_cache: 是否使用本機查詢快取（回補模式預設為 False，避免讀到 GA4 重新同步前的結果）
+        """
+        project_id = bq_config.project_id
+        with self._lock:
+            self._bq_configs.setdefault(project_id, bq_config)
+            if not use_cache:
+                self._no_cache.add(project_id)
+            self._project_locks.setdefault(project_id, threading.Lock())
+            pending = self._pending.setdefault(project_id, set())
+            pending.update(d for d in dates if (project_id, d) not in self._rows)
+    
+    @profiled('load_daily_metrics')
+    def load(self, bq_config: BigQueryConfig, dates: Iterable[date], use_cache: bool = True) -> Dict[date, Optional[dict]]:
+        """
+        取得多個日期的資料列；尚未載入時，連同同專案所有已登記的日期以單一查詢載入
+        
+        Args:
+            bq_config: 客戶的 BigQuery 配置
+            dates: 要取得的日期
+            use_cache: 是否使用本機查詢快取（見 request）
+            
+        Returns:
+            dict: {日期: 資料列}，view 中沒有資料的日期為 None
+        """
+        from src.data.fetcher import query_daily_metrics_rows
+        
+        dates = list(dates)
+        project_id = bq_config.project_id
+        self.request(bq_config, dates, use_cache=use_cache)
+        
+        # 同一專案同時間只有一個執行緒查詢，其他執行緒等待後直接使用結果
+        with self._project_locks[project_id]:
+            with self._lock:
+                pending = self._pending.pop(project_id, set())
+                pending = {d for d in pending if (project_id, d) not in self._rows}
+                query_config = self._bq_configs[project_id]
+                project_use_cache = project_id not in self._no_cache
+            
+            if pending:
+                try:
+                    rows = query_daily_metrics_rows(query_config, pending, use_cache=project_use_cache)
+                except Exception:
+                    # 查詢失敗時放回待查清單，讓下一次 load 重試
+                    with self._lock:
+                        self._pending.setdefault(project_id, set()).update(pending)
+                    raise
+                with self._lock:
+                    self.queries += 1
+                    for d, row in rows.items():
+                        self._rows[(project_id, d)] = row
+        
+        with self._lock:
+            return {d: self._rows[(project_id, d)] for d in dates}
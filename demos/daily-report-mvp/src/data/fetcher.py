@@ -2,23 +2,127 @@
 BigQuery 資料查詢模組
 負責從 BigQuery 查詢 E-com 和 GA4 資料
 """
-from datetime import date
+from datetime import date, datetime
+from typing import Iterable, Optional
 from config.bigquery import BigQueryConfig, TABLES
-from src.utils.date_utils import format_date_for_sql, format_date_for_ga4, get_last_week_same_day
+from config.query_builder import QueryParams, date_in, date_range, table_suffix_range
+from config.profiling import profiled
+from src.utils.date_utils import get_last_week_same_day
+
+
+# daily_metrics view 需要的欄位（一次取回，供所有查詢方法重用同一列）
+DAILY_METRICS_COLUMNS = """
+            date,
+            total_revenue as revenue,
+            total_orders as orders,
+            avg_order_value as aov,
+            conversion_rate_pct,
+            total_sessions as sessions,
+            google_ads_cost_usd,
+            meta_ads_spend,
+            mtd_revenue,
+            mtd_total_revenue"""
+
+
+def _as_date(value) -> date:
+    """將查詢結果中的日期欄位（date / Timestamp / 字串）轉為 date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def query_daily_metrics_rows(bq_config: BigQueryConfig, dates: Iterable[date], use_cache: bool = True) -> dict[date, Optional[dict]]:
+    """
+    以單一查詢取得多個日期的 daily_metrics 資料列
+    
+    Args:
+        bq_config: BigQuery 配置物件
+        dates: 要查詢的日期
+        use_cache: 是否使用本機查詢快取（已結束的過去區間會永久快取，GA4 回補同步後需設為 False 重新查詢）
+        
+    Returns:
+        dict: {日期: 資料列}，view 中沒有資料的日期為 None
+    """
+    dates = sorted(set(dates))
+    daily_metrics_view = f"{bq_config.project_id}.datalake_looker.daily_metrics"
+    params = QueryParams()
+    if len(dates) > 2 and (dates[-1] - dates[0]).days == len(dates) - 1:
+        # 連續區間（回補模式）以範圍條件查詢
+        date_filter = date_range(params, 'date', dates[0], dates[-1])
+    else:
+        date_filter = date_in(params, 'date', dates)
+    
+    query = f"""
+    SELECT{DAILY_METRICS_COLUMNS}
+    FROM `{daily_metrics_view}`
+    WHERE {date_filter}
+    """
+    
+    result = bq_config.query_rows(
+        query, query_parameters=params.to_bigquery(), label='daily_metrics', use_cache=use_cache
+    )
+    
+    rows = {d: None for d in dates}
+    for row in result:
+        rows[_as_date(row['date'])] = row
+    return rows
 
 
 class DataFetcher:
     """資料查詢器"""
     
-    def __init__(self, bq_config: BigQueryConfig):
+    def __init__(self, bq_config: BigQueryConfig, metrics_store=None, use_cache: bool = True):
         """
         初始化資料查詢器
         
         Args:
             bq_config: BigQuery 配置物件
+            metrics_store: 跨客戶共用的 DailyMetricsStore（可選，批次執行時使用）
+            use_cache: 是否使用本機查詢快取（--no-cache 時為 False）
         """
         self.bq_config = bq_config
+        self.metrics_store = metrics_store
+        self.use_cache = use_cache
+        # daily_metrics 每日資料列快取（key: 日期，value: 資料列 dict；None 表示 view 中沒有該日資料）
+        self._daily_rows: dict[date, Optional[dict]] = {}
+    
+    @profiled()
+    def prefetch(self, dates: Iterable[date]) -> None:
+        """
+        以單一查詢批次載入多個日期的 daily_metrics 資料列
+        
+        已載入的日期會略過；view 中沒有資料的日期也會記錄，避免重複查詢。
+        設定 metrics_store 時改由共用儲存載入（同專案的客戶合併為一次查詢）
+        
+        Args:
+            dates: 要載入的日期
+        """
+        pending = sorted({d for d in dates if d not in self._daily_rows})
+        if not pending:
+            return
+        
+        if self.metrics_store is not None:
+            self._daily_rows.update(self.metrics_store.load(self.bq_config, pending, use_cache=self.use_cache))
+        else:
+            self._daily_rows.update(query_daily_metrics_rows(self.bq_config, pending, use_cache=self.use_cache))
     
+    def get_daily_row(self, report_date: date) -> Optional[dict]:
+        """
+        取得指定日期的 daily_metrics 資料列（未載入時查詢一次並快取）
+        
+        Args:
+            report_date: 要查詢的日期
+            
+        Returns:
+            dict: 資料列，view 中沒有該日資料時返回 None
+        """
+        if report_date not in self._daily_rows:
+            self.prefetch([report_date])
+        return self._daily_rows[report_date]
+    
+    @profiled()
     def fetch_daily_metrics(self, report_date: date) -> dict:
         """
         查詢指定日期的關鍵指標（使用 datalake_looker.daily_metrics view）
@@ -29,27 +133,9 @@ class DataFetcher:
         Returns:
             dict: 包含 revenue, orders, aov, cvr 等指標
         """
-        # 使用 datalake_looker.daily_metrics view
-        date_str = format_date_for_sql(report_date)
-        daily_metrics_view = f"{self.bq_config.project_id}.datalake_looker.daily_metrics"
+        row = self.get_daily_row(report_date)
         
-        query = f"""
-        SELECT
-            total_revenue as revenue,
-            total_orders as orders,
-            avg_order_value as aov,
-            conversion_rate_pct,
-            total_sessions as sessions,
-            google_ads_cost_usd,
-            meta_ads_spend
-        FROM `{daily_metrics_view}`
-        WHERE date = DATE('{date_str}')
-        LIMIT 1
-        """
-        
-        result = self.bq_config.query(query).to_dataframe()
-        
-        if result.empty or result.iloc[0].get('revenue') is None:
+        if row is None or row.get('revenue') is None:
             return {
                 'revenue': 0,
                 'orders': 0,
@@ -61,7 +147,6 @@ class DataFetcher:
                 'total_ad_spend': None,
             }
         
-        row = result.iloc[0]
         revenue = float(row.get('revenue') or 0)
         orders = int(row.get('orders') or 0)
         aov = float(row.get('aov') or 0)
@@ -92,6 +177,7 @@ class DataFetcher:
             'total_ad_spend': total_ad_spend,
         }
     
+    @profiled()
     def fetch_ga4_sessions(self, report_date: date) -> int:
         """
         查詢指定日期的 GA4 sessions（優先使用 daily_metrics view）
@@ -113,7 +199,7 @@ class DataFetcher:
         
         # 降級方案：從 GA4 事件表查詢
         ga4_table_ref = self.bq_config.get_ga4_table_ref('events_*')
-        date_suffix = format_date_for_ga4(report_date)
+        params = QueryParams()
         
         query = f"""
         SELECT
@@ -127,17 +213,20 @@ class DataFetcher:
                 )
             )) as sessions
         FROM `{ga4_table_ref}`
-        WHERE _TABLE_SUFFIX = '{date_suffix}'
+        WHERE {table_suffix_range(params, report_date, report_date)}
             AND event_name = 'session_start'
         """
         
-        result = self.bq_config.query(query).to_dataframe()
+        row = self.bq_config.query_one(
+            query, query_parameters=params.to_bigquery(), label='fetch_ga4_sessions', use_cache=self.use_cache
+        )
         
-        if result.empty:
+        if row is None:
             return 0
         
-        return int(result.iloc[0].get('sessions', 0) or 0)
+        return int(row.get('sessions', 0) or 0)
     
+    @profiled()
     def fetch_cvr(self, report_date: date, sessions: int = None) -> float:
         """
         計算轉換率（CVR）
@@ -164,6 +253,7 @@ class DataFetcher:
         orders = daily_metrics['orders']
         return orders / sessions if sessions > 0 else 0.0
     
+    @profiled()
     def fetch_ad_spend_and_roas(self, report_date: date, client_config: dict = None) -> tuple[float, float]:
         """
         查詢廣告花費和 ROAS（優先使用 daily_metrics view）
@@ -208,6 +298,7 @@ class DataFetcher:
         # 如果都沒有，返回 None（表示沒有資料）
         return None, None
     
+    @profiled()
     def fetch_weekly_comparison(self, report_date: date, metric: str) -> float:
         """
         計算與上週同期的變化百分比
@@ -220,6 +311,8 @@ class DataFetcher:
             float: 變化百分比（-1.0 到 1.0 之間，例如 -0.15 表示下降 15%）
         """
         last_week_date = get_last_week_same_day(report_date)
+        # 兩個日期一次載入，後續查詢皆重用快取的資料列
+        self.prefetch([report_date, last_week_date])
         
         if metric == 'revenue':
             current_value = self.fetch_daily_metrics(report_date)['revenue']
@@ -237,6 +330,7 @@ class DataFetcher:
         
         return (current_value - last_week_value) / last_week_value
     
+    @profiled()
     def fetch_mtd_metrics(self, report_date: date) -> dict:
         """
         查詢月迄今（MTD）指標（使用 datalake_looker.daily_metrics view）
@@ -247,29 +341,12 @@ class DataFetcher:
         Returns:
             dict: 包含 mtd_revenue, mtd_achievement_rate, mtd_projected_revenue
         """
-        # 計算月初日期
-        month_start = date(report_date.year, report_date.month, 1)
-        date_str_start = format_date_for_sql(month_start)
-        date_str_end = format_date_for_sql(report_date)
-        
-        daily_metrics_view = f"{self.bq_config.project_id}.datalake_looker.daily_metrics"
-        
-        query = f"""
-        SELECT
-            mtd_revenue,
-            mtd_total_revenue
-        FROM `{daily_metrics_view}`
-        WHERE date = DATE('{date_str_end}')
-        LIMIT 1
-        """
-        
-        result = self.bq_config.query(query).to_dataframe()
+        row = self.get_daily_row(report_date)
         
-        if result.empty:
+        if row is None:
             mtd_revenue = 0.0
             mtd_total_revenue = 0.0
         else:
-            row = result.iloc[0]
             mtd_revenue = float(row.get('mtd_revenue', 0) or 0)
             mtd_total_revenue = float(row.get('mtd_total_revenue', 0) or 0)
         
@@ -3,21 +3,28 @@ GA4 數據驗證模組
 執行前置檢查，確認 GA4 數據是否已匯入
 """
 from datetime import date
+from typing import Optional
 from config.bigquery import BigQueryConfig
+from config.profiling import profiled
+from config.query_builder import QueryParams
+from src.data.fetcher import DataFetcher
 
 
 class GA4DataValidator:
     """GA4 數據驗證器"""
     
-    def __init__(self, bq_config: BigQueryConfig):
+    def __init__(self, bq_config: BigQueryConfig, data_fetcher: Optional[DataFetcher] = None):
         """
         初始化驗證器
         
         Args:
             bq_config: BigQuery 配置物件
+            data_fetcher: 資料查詢器（可選，提供時重用其已載入的 daily_metrics 資料列，不另外查詢）
         """
         self.bq_config = bq_config
+        self.data_fetcher = data_fetcher
     
+    @profiled()
     def validate_ga4_data(self, report_date: date):
         """
         验证指定日期的 GA4 sessions 数据是否已同步（使用 daily_metrics view）
@@ -32,22 +39,29 @@ class GA4DataValidator:
                 - "error": 發生例外錯誤
         """
         try:
-            daily_metrics_view = f"{self.bq_config.project_id}.datalake_looker.daily_metrics"
-            query = f"""
-            SELECT
-                total_sessions,
-                conversion_rate_pct
-            FROM `{daily_metrics_view}`
-            WHERE date = DATE('{report_date.isoformat()}')
-            LIMIT 1
-            """
-
-            result = self.bq_config.query(query).to_dataframe()
-
-            if result.empty:
-                return "warning", f"GA4 數據尚未同步（daily_metrics 尚無 {report_date} 資料）"
+            if self.data_fetcher is not None:
+                # 重用 DataFetcher 的資料列（fetcher 欄位別名為 sessions）
+                row = self.data_fetcher.get_daily_row(report_date)
+                sessions = row.get('sessions') if row is not None else None
+            else:
+                daily_metrics_view = f"{self.bq_config.project_id}.datalake_looker.daily_metrics"
+                params = QueryParams()
+                query = f"""
+                SELECT
+                    total_sessions,
+                    conversion_rate_pct
+                FROM `{daily_metrics_view}`
+                WHERE date = {params.add('report_date', report_date)}
+                LIMIT 1
+                """
+                
+                row = self.bq_config.query_one(
+                    query, query_parameters=params.to_bigquery(), label='validate_ga4_data'
+                )
+                sessions = row.get('total_sessions') if row is not None else None
 
-            sessions = result.iloc[0].get('total_sessions')
+            if row is None:
+                return "warning", f"GA4 數據尚未同步（daily_metrics 尚無 {report_date} 資料）"
 
             if sessions in (None, 0):
                 return "warning", f"GA4 數據尚未同步（sessions 為 {sessions or 'N/A'}）"
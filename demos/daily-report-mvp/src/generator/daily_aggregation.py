@@ -5,6 +5,7 @@
 import calendar
 from datetime import date
 from typing import Optional, Dict, Any
+from config.profiling import profiled
 from src.data.fetcher import DataFetcher
 
 
@@ -20,6 +21,34 @@ class DailyAggregationGenerator:
         """
         self.data_fetcher = data_fetcher
     
+    def prefetch(self, report_date: date) -> None:
+        """
+        以單一查詢載入 generate 需要的所有 daily_metrics 資料列（當日與上週同期）
+        
+        載入後 GA4 驗證（GA4DataValidator 傳入同一個 data_fetcher）、當日指標、
+        上週同期指標與月迄今指標都重用這兩列資料，不再各自查詢
+        
+        Args:
+            report_date: 數據所屬日期（T-1）
+        """
+        self.data_fetcher.prefetch(self.required_dates(report_date))
+    
+    @staticmethod
+    def required_dates(report_date: date) -> list[date]:
+        """
+        generate 需要的 daily_metrics 日期（當日與上週同期）
+        
+        Args:
+            report_date: 數據所屬日期（T-1）
+            
+        Returns:
+            list: 日期清單
+        """
+        from src.utils.date_utils import get_last_week_same_day
+        
+        return [report_date, get_last_week_same_day(report_date)]
+    
+    @profiled('generate_daily_aggregation')
     def generate(
         self, 
         client_id: str, 
@@ -34,6 +63,7 @@ class DailyAggregationGenerator:
         1. 重用已查詢的資料，減少重複的 BigQuery 查詢
         2. 簡化邏輯，提升可讀性
         3. 加入錯誤處理
+        4. 當日、上週同期、月迄今指標由單一 daily_metrics 查詢取得
         
         Args:
             client_id: 客戶 ID
@@ -49,6 +79,9 @@ class DailyAggregationGenerator:
         """
         from src.utils.date_utils import get_last_week_same_day
         
+        # 0. 批次載入當日與上週同期的 daily_metrics（已載入時不會重複查詢）
+        self.prefetch(report_date)
+        
         # 1. 查詢當日指標（只查一次，現在已包含 sessions 和 cvr）
         daily_metrics = self.data_fetcher.fetch_daily_metrics(report_date)
         if not daily_metrics:
@@ -5,6 +5,8 @@ Google Chat Webhook 推播模組
 import requests
 from typing import Dict, Any
 
+from config.profiling import profiled
+
 
 class GoogleChatNotifier:
     """Google Chat 推播器"""
@@ -292,6 +294,7 @@ class GoogleChatNotifier:
         
         return remaining_target / days_remaining
     
+    @profiled('send_google_chat')
     def send(self, data: Dict[str, Any]) -> tuple[bool, str]:
         """
         發送 Google Chat 訊息
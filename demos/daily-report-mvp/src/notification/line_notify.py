@@ -8,6 +8,8 @@ from typing import Dict, Any, List, Tuple
 
 import requests
 
+from config.profiling import profiled
+
 
 LINE_PUSH_ENDPOINT = "https://api.line.me/v2/bot/message/push"
 
@@ -295,6 +297,7 @@ class LineNotifier:
     # ------------------------------------------------------------------
     # Public API
     # ------------------------------------------------------------------
+    @profiled('send_line')
     def send(self, data: Dict[str, Any]) -> Tuple[bool, str]:
         """
         發送 LINE 推播
@@ -4,6 +4,8 @@ PyEcharts 圖表樣式設定
 """
 from pyecharts.globals import ThemeType
 
+from .traffic_rules import traffic_source_colors
+
 
 # 圖表主題設定
 CHART_THEME = ThemeType.MACARONS  # 可選：MACARONS, WONDERLAND, ROMANTIC 等
@@ -18,17 +20,8 @@ COLOR_PALETTE = {
     'gray': '#8C8C8C',         # 灰色
 }
 
-# 流量來源顏色對應（對應 data.html 的 8 種分類）
-TRAFFIC_SOURCE_COLORS = {
-    '直接流量': '#4A90E2',
-    '付費廣告': '#F5222D',
-    '會員經營': '#52C41A',
-    'AI 來源': '#722ED1',
-    '自然搜尋': '#13C2C2',
-    '社群經營': '#FA8C16',
-    '參照連結': '#1890FF',
-    '其他': '#8C8C8C',
-}
+# 流量來源顏色對應（由 config/traffic_rules.py 的 8 種分類產生）
+TRAFFIC_SOURCE_COLORS = traffic_source_colors()
 
 # 圖表通用設定
 CHART_CONFIG = {
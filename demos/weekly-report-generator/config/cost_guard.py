@@ -0,0 +1,314 @@
+"""
+BigQuery 查詢成本守門
+每個查詢執行前先 dry run 取得預估掃描量，依查詢標籤（fetch 方法）記錄，並套用掃描量預算；
+執行完成後記錄實際的 total_bytes_processed、total_bytes_billed 與 slot 毫秒數
+
+環境變數：
+- BQ_DRY_RUN：1 時即使沒有設定預算也先 dry run 並記錄預估掃描量
+- BQ_REPORT_BYTES_BUDGET：單份報告（一次執行）的掃描量上限，可用 KB / MB / GB / TB 單位
+- BQ_CLIENT_BYTES_BUDGET：單一客戶的掃描量上限（daily-report-mvp 批次模式）
+- BQ_BUDGET_ACTION：超出預算時的處理方式
+    - abort（預設）：改用過期的本機快取結果，沒有快取時拋出 BytesBudgetExceeded
+    - warn：只顯示警告，照常執行
+"""
+import os
+import re
+import threading
+
+
+_UNITS = {'': 1, 'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+_SIZE_PATTERN = re.compile(r"^\s*([\d.]+)\s*([KMGT]?B?)\s*$", re.IGNORECASE)
+
+# BigQuery 作業標籤只接受小寫英數字、底線與連字號
+_LABEL_PATTERN = re.compile(r"[^a-z0-9_-]")
+
+
+class BytesBudgetExceeded(RuntimeError):
+    """查詢的預估掃描量超出預算"""
+
+    def __init__(self, message, record=None):
+        """
+        Args:
+            message: 錯誤訊息
+            record: 被拒絕查詢的成本記錄（改用快取結果時以 record_cache_hit 標記）
+        """
+        super().__init__(message)
+        self.record = record
+
+
+def parse_bytes(value):
+    """
+    解析掃描量設定（例如 500MB、2GB、1073741824）
+
+    Args:
+        value: 設定值字串
+
+    Returns:
+        int: 位元組數，未設定時返回 None
+    """
+    if not value:
+        return None
+    match = _SIZE_PATTERN.match(value)
+    if match is None:
+        raise ValueError(f"無法解析掃描量設定：{value}")
+    number, unit = match.groups()
+    unit = unit.upper()
+    if unit and not unit.endswith('B'):
+        unit += 'B'
+    return int(float(number) * _UNITS[unit])
+
+
+def format_bytes(num_bytes):
+    """將位元組數轉為易讀格式（例如 1.25 GB）"""
+    if num_bytes is None:
+        return 'N/A'
+    size = float(num_bytes)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.2f} {unit}"
+        size /= 1024
+    return f"{size:.2f} TB"
+
+
+def job_label(label):
+    """將查詢標籤轉為 BigQuery 作業標籤值（帳單匯出可依此分組）"""
+    return _LABEL_PATTERN.sub('_', label.lower())[:63]
+
+
+class BytesBudget:
+    """掃描量預算（執行緒安全，可由多個 BigQueryConfig 共用）"""
+
+    def __init__(self, name, limit):
+        """
+        Args:
+            name: 預算名稱（顯示用，例如「報告」、「客戶 client_A」）
+            limit: 掃描量上限（位元組）
+        """
+        self.name = name
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        with self._lock:
+            return self.limit - self.used
+
+    def reserve(self, num_bytes):
+        """
+        預留掃描量
+
+        Returns:
+            bool: 預留成功為 True；超出預算時不預留並返回 False
+        """
+        with self._lock:
+            if self.used + num_bytes > self.limit:
+                return False
+            self.used += num_bytes
+            return True
+
+    def adjust(self, delta):
+        """以實際掃描量修正預留量"""
+        with self._lock:
+            self.used += delta
+
+
+def budget_from_env(env_name, name):
+    """
+    依環境變數建立掃描量預算
+
+    Args:
+        env_name: 環境變數名稱
+        name: 預算名稱（顯示用）
+
+    Returns:
+        BytesBudget: 未設定時返回 None
+    """
+    limit = parse_bytes(os.getenv(env_name))
+    return BytesBudget(name, limit) if limit is not None else None
+
+
+class QueryCostTracker:
+    """查詢成本記錄與預算檢查"""
+
+    def __init__(self, budgets=(), action='abort', dry_run=False):
+        """
+        Args:
+            budgets: 套用的 BytesBudget 清單（任一超出即視為超出預算）
+            action: 超出預算時的處理方式（abort / warn）
+            dry_run: 沒有預算時是否仍先 dry run
+        """
+        if action not in ('abort', 'warn'):
+            raise ValueError(f"不支援的 BQ_BUDGET_ACTION：{action}（可用：abort、warn）")
+        self.budgets = list(budgets)
+        self.action = action
+        self.dry_run = dry_run
+        self.records = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, budget_env='BQ_REPORT_BYTES_BUDGET', budget_name='報告', shared_budgets=()):
+        """
+        依環境變數建立記錄器
+
+        Args:
+            budget_env: 此設定專屬預算的環境變數
+            budget_name: 專屬預算的顯示名稱
+            shared_budgets: 與其他設定共用的 BytesBudget（例如整批執行的報告預算）
+
+        Returns:
+            QueryCostTracker: 記錄器（未啟用 dry run 也未設定預算時，只記錄實際掃描量）
+        """
+        budgets = list(shared_budgets)
+        budget = budget_from_env(budget_env, budget_name)
+        if budget is not None:
+            budgets.append(budget)
+
+        return cls(
+            budgets=budgets,
+            action=os.getenv('BQ_BUDGET_ACTION', 'abort').strip().lower(),
+            dry_run=os.getenv('BQ_DRY_RUN', '0').lower() in ('1', 'true', 'yes'),
+        )
+
+    @property
+    def checks_before_run(self):
+        """執行前是否需要 dry run"""
+        return self.dry_run or bool(self.budgets)
+
+    def check(self, label, estimated_bytes):
+        """
+        記錄預估掃描量並檢查預算
+
+        Args:
+            label: 查詢標籤
+            estimated_bytes: dry run 的預估掃描量
+
+        Returns:
+            dict: 此查詢的記錄（執行後以 record_job 補上實際數值）
+
+        Raises:
+            BytesBudgetExceeded: 超出預算且 action 為 abort
+        """
+        record = {
+            'label': label,
+            'estimated_bytes': estimated_bytes,
+            'actual_bytes': None,
+            'billed_bytes': None,
+            'slot_ms': None,
+            'job_id': None,
+            'cache_hit': False,
+            'reserved': [],
+        }
+        with self._lock:
+            self.records.append(record)
+
+        print(f"💰 [{label}] 預估掃描 {format_bytes(estimated_bytes)}")
+
+        for budget in self.budgets:
+            if budget.reserve(estimated_bytes):
+                record['reserved'].append(budget)
+                continue
+
+            message = (
+                f"[{label}] 預估掃描 {format_bytes(estimated_bytes)} 超出{budget.name}預算"
+                f"（剩餘 {format_bytes(max(budget.remaining(), 0))} / 上限 {format_bytes(budget.limit)}）"
+            )
+            if self.action == 'warn':
+                print(f"⚠️  {message}，仍繼續執行")
+                budget.adjust(estimated_bytes)
+                record['reserved'].append(budget)
+                continue
+
+            for reserved in record['reserved']:
+                reserved.adjust(-estimated_bytes)
+            record['reserved'] = []
+            raise BytesBudgetExceeded(message, record)
+
+        return record
+
+    def record_cache_hit(self, label, record=None):
+        """
+        記錄命中本機快取的查詢（不掃描資料）
+
+        Args:
+            label: 查詢標籤
+            record: 超出預算被拒絕、改用快取結果的查詢記錄（BytesBudgetExceeded.record）；
+                    傳入時標記該記錄而不另外新增，同一查詢只計算一次
+        """
+        with self._lock:
+            if record is not None:
+                record.update({'actual_bytes': 0, 'billed_bytes': 0, 'slot_ms': 0, 'cache_hit': True})
+                return
+            self.records.append({
+                'label': label,
+                'estimated_bytes': 0,
+                'actual_bytes': 0,
+                'billed_bytes': 0,
+                'slot_ms': 0,
+                'job_id': None,
+                'cache_hit': True,
+                'reserved': [],
+            })
+
+    def record_job(self, label, job, record=None):
+        """
+        記錄已完成作業的實際掃描量與 slot 毫秒數，並以實際值修正預算
+
+        Args:
+            label: 查詢標籤
+            job: 已完成的 QueryJob
+            record: check 返回的記錄（未 dry run 時為 None）
+        """
+        if record is None:
+            record = {'label': label, 'estimated_bytes': None, 'cache_hit': False, 'reserved': []}
+            with self._lock:
+                self.records.append(record)
+
+        record['job_id'] = job.job_id
+        record['actual_bytes'] = job.total_bytes_processed or 0
+        record['billed_bytes'] = job.total_bytes_billed or 0
+        record['slot_ms'] = job.slot_millis or 0
+
+        estimated = record['estimated_bytes'] or 0
+        for budget in record['reserved']:
+            budget.adjust(record['actual_bytes'] - estimated)
+
+    def summary(self):
+        """
+        依查詢標籤彙總成本
+
+        Returns:
+            list: [{'label', 'queries', 'cache_hits', 'estimated_bytes', 'actual_bytes', 'billed_bytes', 'slot_ms'}]
+        """
+        totals = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            total = totals.setdefault(record['label'], {
+                'label': record['label'],
+                'queries': 0,
+                'cache_hits': 0,
+                'estimated_bytes': 0,
+                'actual_bytes': 0,
+                'billed_bytes': 0,
+                'slot_ms': 0,
+            })
+            total['queries'] += 1
+            total['cache_hits'] += int(record['cache_hit'])
+            for key in ('estimated_bytes', 'actual_bytes', 'billed_bytes', 'slot_ms'):
+                total[key] += record.get(key) or 0
+        return list(totals.values())
+
+    def print_summary(self, title='BigQuery 查詢成本'):
+        """輸出各查詢標籤的預估 / 實際掃描量與 slot 時間"""
+        rows = self.summary()
+        if not rows:
+            return
+        print(f"💰 {title}：")
+        for row in rows:
+            print(
+                f"   - {row['label']}：{row['queries']} 次（快取 {row['cache_hits']}），"
+                f"預估 {format_bytes(row['estimated_bytes'])}，實際 {format_bytes(row['actual_bytes'])}，"
+                f"計費 {format_bytes(row['billed_bytes'])}，slot {row['slot_ms'] / 1000:.1f} 秒"
+            )
+        for budget in self.budgets:
+            print(f"   📊 {budget.name}預算：已用 {format_bytes(budget.used)} / {format_bytes(budget.limit)}")
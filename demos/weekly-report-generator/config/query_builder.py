@@ -0,0 +1,193 @@
+"""
+查詢條件建構器
+產生可修剪分區的日期條件，日期一律以具名查詢參數傳入（不再以 f-string 內插日期字串），
+相同 SQL 文字可重用 BigQuery 的查詢結果快取與本機快取
+
+- partition_date_range：直接比較分區欄位 dt（不包 DATE()），BigQuery 只掃描區間內的分區
+- date_range / date_in：DATE 欄位（view 的 date、物化表的 event_date）
+- table_suffix_range：GA4 萬用字元表的 _TABLE_SUFFIX BETWEEN（只讀取區間內的 events_YYYYMMDD 分片）
+"""
+import os
+import re
+from datetime import date, datetime
+
+from google.cloud import bigquery
+
+
+# 訂單表分區欄位 dt 的型別（TIMESTAMP / DATETIME / DATE），決定日期參數轉換成哪種型別後比較
+PARTITION_COLUMN_TYPE = os.getenv('BIGQUERY_DT_TYPE', 'TIMESTAMP').upper()
+
+_PARAM_PATTERN = re.compile(r"@(\w+)")
+
+
+def _infer_type(value):
+    """依 Python 值推斷 BigQuery 參數型別"""
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, int):
+        return 'INT64'
+    if isinstance(value, float):
+        return 'FLOAT64'
+    if isinstance(value, datetime):
+        return 'TIMESTAMP'
+    if isinstance(value, date):
+        return 'DATE'
+    if isinstance(value, (bytes, bytearray)):
+        return 'BYTES'
+    if isinstance(value, (list, tuple)):
+        if not value:
+            raise ValueError("空陣列參數需要指定型別")
+        return f"ARRAY<{_infer_type(value[0])}>"
+    return 'STRING'
+
+
+def _literal(value, type_):
+    """將參數值轉為 SQL 字面值（供不支援查詢參數的 DDL 使用）"""
+    if type_.startswith('ARRAY<'):
+        inner = type_[len('ARRAY<'):-1]
+        return '[' + ', '.join(_literal(v, inner) for v in value) + ']'
+    if value is None:
+        return f"CAST(NULL AS {type_})"
+    if type_ in ('DATE', 'DATETIME', 'TIMESTAMP'):
+        return f"{type_} '{value.isoformat()}'"
+    if type_ in ('INT64', 'FLOAT64'):
+        return str(value)
+    if type_ == 'BOOL':
+        return 'TRUE' if value else 'FALSE'
+    if type_ == 'BYTES':
+        return f"FROM_HEX('{bytes(value).hex()}')"
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+class QueryParams:
+    """具名查詢參數集合（同一次查詢的子查詢共用，名稱相同時值必須一致）"""
+
+    def __init__(self):
+        # {名稱: (型別, 值)}
+        self._values = {}
+
+    def add(self, name, value, type_=None):
+        """
+        登記參數並取得 SQL 佔位符
+
+        Args:
+            name: 參數名稱
+            value: 參數值
+            type_: BigQuery 型別（預設依值推斷；陣列為 ARRAY<型別>）
+
+        Returns:
+            str: 佔位符（@名稱）
+        """
+        type_ = type_ or _infer_type(value)
+        if isinstance(value, tuple):
+            value = list(value)
+        existing = self._values.get(name)
+        if existing is not None and existing != (type_, value):
+            raise ValueError(f"查詢參數 @{name} 已設定為不同的值")
+        self._values[name] = (type_, value)
+        return f"@{name}"
+
+    def items(self):
+        """
+        取得所有參數
+
+        Returns:
+            list: [(名稱, 型別, 值)]，依名稱排序
+        """
+        return [(name, type_, value) for name, (type_, value) in sorted(self._values.items())]
+
+    def to_bigquery(self):
+        """
+        轉換為 QueryJobConfig.query_parameters
+
+        Returns:
+            list: bigquery.ScalarQueryParameter / ArrayQueryParameter
+        """
+        parameters = []
+        for name, type_, value in self.items():
+            if type_.startswith('ARRAY<'):
+                parameters.append(bigquery.ArrayQueryParameter(name, type_[len('ARRAY<'):-1], value))
+            else:
+                parameters.append(bigquery.ScalarQueryParameter(name, type_, value))
+        return parameters
+
+    def inline(self, query_string):
+        """
+        將 SQL 中的佔位符替換為字面值（CREATE TABLE AS 等 DDL 不接受查詢參數）
+
+        Args:
+            query_string: 含 @名稱 佔位符的 SQL
+
+        Returns:
+            str: 替換後的 SQL
+        """
+        def replace(match):
+            name = match.group(1)
+            if name not in self._values:
+                return match.group(0)
+            type_, value = self._values[name]
+            return _literal(value, type_)
+
+        return _PARAM_PATTERN.sub(replace, query_string)
+
+
+def partition_date_range(params, start_date, end_date, column='dt',
+                         start_name='start_date', end_name='end_date', column_type=None):
+    """
+    產生可修剪分區的日期區間條件（含首尾兩日）
+
+    等同 DATE(dt) BETWEEN 開始 AND 結束，但直接比較分區欄位，BigQuery 才能只掃描區間內的分區
+
+    Args:
+        params: QueryParams
+        start_date: 開始日期（datetime.date）
+        end_date: 結束日期（datetime.date）
+        column: 分區欄位
+        start_name: 開始日期的參數名稱
+        end_name: 結束日期的參數名稱
+        column_type: 分區欄位型別（預設 PARTITION_COLUMN_TYPE）
+
+    Returns:
+        str: SQL 條件
+    """
+    column_type = column_type or PARTITION_COLUMN_TYPE
+    start = params.add(start_name, start_date)
+    end = params.add(end_name, end_date)
+    return f"{column} >= {column_type}({start}) AND {column} < {column_type}(DATE_ADD({end}, INTERVAL 1 DAY))"
+
+
+def date_range(params, column, start_date, end_date, start_name='start_date', end_name='end_date'):
+    """
+    產生 DATE 欄位的日期區間條件（含首尾兩日）
+
+    Returns:
+        str: SQL 條件
+    """
+    start = params.add(start_name, start_date)
+    end = params.add(end_name, end_date)
+    return f"{column} BETWEEN {start} AND {end}"
+
+
+def date_in(params, column, dates, name='dates'):
+    """
+    產生 DATE 欄位的日期清單條件
+
+    Returns:
+        str: SQL 條件
+    """
+    placeholder = params.add(name, sorted(dates), 'ARRAY<DATE>')
+    return f"{column} IN UNNEST({placeholder})"
+
+
+def table_suffix_range(params, start_date, end_date, start_name='start_suffix', end_name='end_suffix'):
+    """
+    產生 GA4 萬用字元表（events_*）的分片條件（含首尾兩日）
+
+    YYYYMMDD 字串依字典序比較，intraday_ 開頭的分片不會落在區間內
+
+    Returns:
+        str: SQL 條件
+    """
+    start = params.add(start_name, start_date.strftime('%Y%m%d'))
+    end = params.add(end_name, end_date.strftime('%Y%m%d'))
+    return f"_TABLE_SUFFIX BETWEEN {start} AND {end}"
@@ -0,0 +1,305 @@
+"""
+BigQuery 查詢結果本機快取
+以「專案 ID + 正規化 SQL + 查詢參數」的雜湊值為鍵，將查詢結果以 Parquet 檔存放於快取目錄
+
+TTL 規則（依 SQL 與查詢參數中出現的日期判斷資料時間窗）：
+- 時間窗最晚日期早於昨日（已完全結束的過去區間）：資料不再變動，永久有效
+- 時間窗包含昨日或今日、或 SQL 中找不到日期：短期有效（預設 15 分鐘）
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# 比對 SQL 中的日期字面值：YYYY-MM-DD（訂單表）與 YYYYMMDD（GA4 _TABLE_SUFFIX）
+_DATE_PATTERN = re.compile(r"(?<!\d)(\d{4})-?(\d{2})-?(\d{2})(?!\d)")
+
+# 只快取唯讀查詢（DDL / DML / 多語句腳本不快取）
+_CACHEABLE_PREFIXES = ('SELECT', 'WITH')
+
+
+class QueryCache:
+    """BigQuery 查詢結果快取"""
+
+    def __init__(self, cache_dir, project_id, recent_ttl_seconds=900):
+        """
+        初始化快取
+
+        Args:
+            cache_dir: 快取目錄
+            project_id: Google Cloud 專案 ID（納入快取鍵，避免不同專案互相覆蓋）
+            recent_ttl_seconds: 含昨日 / 今日資料的查詢結果有效秒數
+        """
+        self.cache_dir = cache_dir
+        self.project_id = project_id
+        self.recent_ttl_seconds = recent_ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, project_id, default_dir):
+        """
+        依環境變數建立快取（BQ_CACHE_ENABLED=0 時停用）
+
+        Args:
+            project_id: Google Cloud 專案 ID
+            default_dir: 未設定 BQ_CACHE_DIR 時使用的快取目錄
+
+        Returns:
+            QueryCache: 快取實例，停用時返回 None
+        """
+        if os.getenv('BQ_CACHE_ENABLED', '1').lower() in ('0', 'false', 'no'):
+            return None
+
+        return cls(
+            cache_dir=os.getenv('BQ_CACHE_DIR', default_dir),
+            project_id=project_id,
+            recent_ttl_seconds=int(os.getenv('BQ_CACHE_RECENT_TTL', '900')),
+        )
+
+    @staticmethod
+    def normalize_sql(query_string):
+        """將 SQL 的空白字元正規化（縮排、換行不影響快取鍵）"""
+        return ' '.join(query_string.split())
+
+    @staticmethod
+    def is_cacheable(query_string):
+        """判斷查詢是否可快取（僅限 SELECT / WITH 開頭的唯讀查詢）"""
+        return QueryCache.normalize_sql(query_string).upper().startswith(_CACHEABLE_PREFIXES)
+
+    @staticmethod
+    def describe_parameters(parameters):
+        """
+        將查詢參數轉為可序列化的描述（納入快取鍵）
+
+        Args:
+            parameters: bigquery.ScalarQueryParameter / ArrayQueryParameter 清單
+
+        Returns:
+            list: [[名稱, 型別, 值字串]]，依名稱排序
+        """
+        described = []
+        for parameter in parameters or []:
+            if hasattr(parameter, 'array_type'):
+                described.append([parameter.name, f"ARRAY<{parameter.array_type}>", [str(v) for v in parameter.values]])
+            else:
+                described.append([parameter.name, parameter.type_, str(parameter.value)])
+        return sorted(described, key=lambda item: item[0] or '')
+
+    def make_key(self, query_string, parameters=None):
+        """
+        產生快取鍵
+
+        Args:
+            query_string: SQL 查詢字串
+            parameters: 查詢參數（可選）
+
+        Returns:
+            str: SHA-256 雜湊值
+        """
+        payload = f"{self.project_id}\n{self.normalize_sql(query_string)}"
+        if parameters:
+            payload += "\n" + json.dumps(self.describe_parameters(parameters), ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def extract_date_window(cls, query_string, parameters=None):
+        """
+        從 SQL 與日期 / 字串型別的查詢參數中擷取日期時間窗
+
+        Args:
+            query_string: SQL 查詢字串
+            parameters: 查詢參數（可選）
+
+        Returns:
+            tuple: (最早日期, 最晚日期)，找不到日期時返回 (None, None)
+        """
+        texts = [query_string]
+        for _, type_, value in cls.describe_parameters(parameters):
+            if any(t in type_ for t in ('DATE', 'TIMESTAMP', 'STRING')):
+                texts.extend(value if isinstance(value, list) else [value])
+
+        dates = []
+        for year, month, day in _DATE_PATTERN.findall('\n'.join(texts)):
+            try:
+                dates.append(date(int(year), int(month), int(day)))
+            except ValueError:
+                continue
+
+        if not dates:
+            return None, None
+        return min(dates), max(dates)
+
+    def ttl_for(self, query_string, parameters=None):
+        """
+        計算查詢結果的有效秒數
+
+        Args:
+            query_string: SQL 查詢字串
+            parameters: 查詢參數（可選）
+
+        Returns:
+            int: 有效秒數，None 表示永久有效（已結束的過去區間）
+        """
+        _, window_end = self.extract_date_window(query_string, parameters)
+        yesterday = date.today() - timedelta(days=1)
+
+        if window_end is not None and window_end < yesterday:
+            return None
+        return self.recent_ttl_seconds
+
+    def _paths(self, key):
+        return (
+            os.path.join(self.cache_dir, f'{key}.parquet'),
+            os.path.join(self.cache_dir, f'{key}.json'),
+        )
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, query_string, parameters=None, allow_expired=False, count=True):
+        """
+        讀取快取
+
+        Args:
+            query_string: SQL 查詢字串
+            parameters: 查詢參數（可選）
+            allow_expired: 是否接受已過期的結果（超出掃描量預算時的備援）
+            count: 是否計入命中統計（同一查詢再次讀取過期結果時傳入 False，避免重複計算）
+
+        Returns:
+            pyarrow.Table: 快取的查詢結果，未命中或已過期時返回 None
+        """
+        data_path, meta_path = self._paths(self.make_key(query_string, parameters))
+
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+
+            expires_at = meta.get('expires_at')
+            if expires_at is not None and time.time() > expires_at and not allow_expired:
+                if count:
+                    self._count(hit=False)
+                return None
+
+            table = pq.read_table(data_path)
+        except (OSError, ValueError):
+            if count:
+                self._count(hit=False)
+            return None
+
+        if count:
+            self._count(hit=True)
+        return table
+
+    def put(self, query_string, table, parameters=None):
+        """
+        寫入快取（先寫暫存檔再替換，避免並行查詢讀到寫一半的檔案）
+
+        Args:
+            query_string: SQL 查詢字串
+            table: 查詢結果（pyarrow.Table）
+            parameters: 查詢參數（可選）
+        """
+        key = self.make_key(query_string, parameters)
+        data_path, meta_path = self._paths(key)
+
+        ttl = self.ttl_for(query_string, parameters)
+        window_start, window_end = self.extract_date_window(query_string, parameters)
+        now = time.time()
+        meta = {
+            'project_id': self.project_id,
+            'created_at': now,
+            'expires_at': None if ttl is None else now + ttl,
+            'date_window': [
+                window_start.isoformat() if window_start else None,
+                window_end.isoformat() if window_end else None,
+            ],
+            'rows': table.num_rows,
+        }
+
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        pq.write_table(table, data_path + suffix)
+        os.replace(data_path + suffix, data_path)
+        with open(meta_path + suffix, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_path + suffix, meta_path)
+
+    def stats(self):
+        """
+        取得快取命中統計
+
+        Returns:
+            dict: 包含 hits、misses
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+class CachedQueryResult:
+    """
+    查詢結果包裝
+    提供與 QueryJob 相同的 to_dataframe()，讓呼叫端不需區分是否命中快取；
+    只需要少數列的查詢可改用 to_rows() 直接取得 dict，省去建立 DataFrame；
+    另可指定 categorical 欄位與可為空的整數型別，降低大型結果的記憶體用量
+    """
+
+    def __init__(self, table, cache_hit, job=None):
+        """
+        Args:
+            table: 查詢結果（pyarrow.Table）
+            cache_hit: 是否命中快取
+            job: 實際執行的 QueryJob（命中快取時為 None）
+        """
+        self.table = table
+        self.cache_hit = cache_hit
+        self.job = job
+
+    @property
+    def job_id(self):
+        return self.job.job_id if self.job is not None else None
+
+    def to_arrow(self):
+        return self.table
+
+    def to_rows(self):
+        """
+        轉換為資料列清單（不經過 pandas，適合只有少數列的彙總查詢）
+
+        Returns:
+            list: [{欄位: 值}]，DATE / TIMESTAMP 為 date / datetime，NUMERIC 為 Decimal
+        """
+        return self.table.to_pylist()
+
+    def to_dataframe(self, categories=(), nullable_ints=False):
+        """
+        轉換為 DataFrame
+
+        Args:
+            categories: 轉為 pandas categorical 的欄位（重複值多的字串欄位，例如 traffic_category）；
+                        結果中不存在的欄位略過
+            nullable_ints: 整數欄位是否使用可為空的 Int64（預設 NULL 會讓整欄轉為 float64）
+
+        Returns:
+            DataFrame: 查詢結果
+        """
+        categories = [name for name in categories if name in self.table.column_names]
+        types_mapper = None
+        if nullable_ints:
+            import pandas as pd
+            types_mapper = lambda type_: pd.Int64Dtype() if pa.types.is_integer(type_) else None
+        return self.table.to_pandas(categories=categories or None, types_mapper=types_mapper)
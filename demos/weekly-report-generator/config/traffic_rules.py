@@ -0,0 +1,87 @@
+"""
+流量來源分類規則表
+8 種流量分類的唯一定義來源：Python 分類器、BigQuery SQL CASE 語句與圖表顏色都由此表產生
+
+規則依序比對，第一個符合的規則即為分類結果：
+- source / medium_in：source 完全相等且 medium 在清單中（直接流量）
+- pattern：對 "source / medium" 字串做正規表達式搜尋（不分大小寫，語法需同時相容 Python re 與 BigQuery RE2）
+- channels：對應的 last_touch_channel 值（DataProcessor.categorize_traffic_source 使用）
+- 沒有任何條件的規則為預設分類
+"""
+
+TRAFFIC_RULES = [
+    {
+        'label': '1. 直接流量',
+        'color': '#4A90E2',
+        'source': '(direct)',
+        'medium_in': ('(none)', '(not set)'),
+        'channels': ('Direct', 'direct'),
+    },
+    {
+        'label': '2. 自然搜尋',
+        'color': '#13C2C2',
+        'pattern': r'/ organic$|.*search.*',
+        'channels': ('Organic Search', 'organic', 'organic_search'),
+    },
+    {
+        'label': '3. 付費廣告',
+        'color': '#F5222D',
+        'pattern': r'/ (ads|cpc|paid|ppc|cpm|pmax|ad|fb-SiteLink)$',
+        'channels': ('Paid Search', 'Paid Social', 'Display', 'paid_search', 'cpc'),
+    },
+    {
+        'label': '4. 會員經營',
+        'color': '#52C41A',
+        'pattern': r'(edm|line|push|sms|cdp|crm)',
+        'channels': ('Email', 'email', 'mail'),
+    },
+    {
+        'label': '5. AI 助理',
+        'color': '#722ED1',
+        'pattern': r'^(chatgpt|perplexity|copilot|bard|gemini)',
+        'channels': ('AI', 'ai'),
+    },
+    {
+        'label': '6. 社群媒體',
+        'color': '#FA8C16',
+        'pattern': r'(facebook|threads|instagram|t\.co|line|linktr\.ee|pinterest|linkedin)',
+        'channels': ('Social', 'social', 'facebook', 'instagram', 'line'),
+    },
+    {
+        'label': '7. 參照連結',
+        'color': '#1890FF',
+        'pattern': r'/ referral$',
+        'channels': ('Referral', 'referral'),
+    },
+    {
+        'label': '8. 其他',
+        'color': '#8C8C8C',
+    },
+]
+
+# 預設分類（規則表最後一筆）
+DEFAULT_TRAFFIC_LABEL = TRAFFIC_RULES[-1]['label']
+
+
+def traffic_source_colors():
+    """
+    產生流量分類對應的圖表顏色
+
+    Returns:
+        dict: {分類: 顏色}
+    """
+    return {rule['label']: rule['color'] for rule in TRAFFIC_RULES}
+
+
+def traffic_channel_mapping():
+    """
+    產生 last_touch_channel 對應的流量分類
+
+    Returns:
+        dict: {last_touch_channel: 分類}
+    """
+    return {
+        channel: rule['label']
+        for rule in TRAFFIC_RULES
+        for channel in rule.get('channels', ())
+    }
@@ -0,0 +1,118 @@
+"""
+圖表產生效能比較
+以合成的週報資料比較逐一產生、render_all（執行緒池）與 render_batch（程序池，多品牌批次）的執行時間，
+以及圖表片段快取未命中 / 命中時的 render_all 耗時
+
+使用方式：
+    python scripts/benchmark_chart_render.py --brands 24
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.traffic_rules import traffic_source_colors
+from src.charts import ChartGenerator, render_batch
+from src.charts.cache import ChartCache
+
+
+def make_report_data(seed=0):
+    """
+    產生一份合成週報資料（欄位同 DataFetcher.fetch_report_data）
+
+    Args:
+        seed: 讓不同品牌的數值略有差異
+
+    Returns:
+        dict: weekly_comparison、traffic_df、aov_analysis、funnel_data
+    """
+    sources = list(traffic_source_colors())
+    traffic_df = pd.DataFrame({
+        'traffic_source': sources,
+        'sessions': [1000 * (i + 1) + seed for i in range(len(sources))],
+        'revenue': [50000.0 * (i + 1) + seed for i in range(len(sources))],
+        'cvr': [1.5 + i * 0.1 for i in range(len(sources))],
+        'aov': [1200.0 + i * 10 for i in range(len(sources))],
+    })
+    return {
+        'weekly_comparison': {
+            'this_week': {'net_revenue': 1_000_000 + seed, 'completed_orders': 800},
+            'last_week': {'net_revenue': 950_000, 'completed_orders': 780},
+            'changes': {'revenue': 5.26, 'orders': 2.56},
+        },
+        'traffic_df': traffic_df,
+        'aov_analysis': {
+            'item_distribution': [
+                {'item_count': label, 'order_count': 100 - i * 20 + seed, 'avg_amount': 800.0 + i * 400}
+                for i, label in enumerate(['1件', '2件', '3件', '4件以上'])
+            ],
+            'price_band_distribution': [
+                {'price_band': label, 'order_count': 200 - i * 50, 'avg_amount': 300.0 + i * 700}
+                for i, label in enumerate(['低價帶 (<500)', '中價帶 (500-1500)', '高價帶 (≥1500)'])
+            ],
+        },
+        'funnel_data': {
+            'overall': {
+                'steps': [
+                    {'label': label, 'count': count + seed}
+                    for label, count in zip(['訪客', '商品瀏覽', '加入購物車', '開始結帳', '完成購買'], [50000, 30000, 6000, 2500, 900])
+                ]
+            },
+        },
+    }
+
+
+def timed(label, func):
+    """執行一次並回傳耗時與結果"""
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"   {label:<32} {elapsed * 1000:>10.1f} ms")
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='圖表產生效能比較')
+    parser.add_argument('--brands', type=int, default=24, help='批次產生的報告（品牌）數')
+    parser.add_argument('--workers', type=int, default=None, help='程序池大小（預設為 CPU 核心數）')
+    args = parser.parse_args()
+    # 前兩項比較實際產生圖表的耗時，停用片段快取（子程序繼承此設定）
+    os.environ['CHART_CACHE_ENABLED'] = '0'
+
+    # 1. 單份報告
+    print("\n📈 單份報告")
+    data = make_report_data()
+    ChartGenerator(max_workers=1).render_all(data)  # 預熱（載入 pyecharts 模板）
+    sequential = ChartGenerator(max_workers=1)
+    sequential_time, sequential_charts = timed('逐一產生', lambda: sequential.render_all(data))
+    threaded = ChartGenerator()
+    threaded_time, threaded_charts = timed(f'render_all（{threaded.max_workers} 個執行緒）', lambda: threaded.render_all(data))
+    assert sequential_charts.keys() == threaded_charts.keys(), "圖表項目不一致"
+    for name, elapsed_ms in threaded.render_times.items():
+        print(f"     {name:<30} {elapsed_ms:>10.1f} ms")
+    print(f"   加速 {sequential_time / threaded_time:.1f}x")
+
+    # 2. 多品牌批次
+    print(f"\n🏷️  {args.brands} 個品牌")
+    datasets = {f'brand_{i}': make_report_data(seed=i) for i in range(args.brands)}
+    loop_time, _ = timed('逐一產生', lambda: {name: sequential.render_all(d) for name, d in datasets.items()})
+    batch_time, results = timed(f'render_batch（{args.workers or os.cpu_count()} 個程序）', lambda: render_batch(datasets, args.workers))
+    assert results.keys() == datasets.keys(), "批次結果缺少品牌"
+    print(f"   加速 {loop_time / batch_time:.1f}x")
+
+    # 3. 片段快取（暫存目錄）
+    print("\n🗄️  片段快取")
+    cached = ChartGenerator(cache=ChartCache(tempfile.mkdtemp()))
+    miss_time, _ = timed('render_all（未命中）', lambda: cached.render_all(data))
+    hit_time, _ = timed('render_all（命中）', lambda: cached.render_all(data))
+    assert cached.cached_charts == set(threaded_charts), "第二次執行應全部命中快取"
+    print(f"   加速 {miss_time / hit_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
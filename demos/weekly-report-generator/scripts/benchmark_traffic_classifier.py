@@ -0,0 +1,111 @@
+"""
+流量來源分類器效能比較
+以合成的 source/medium 資料比較改版前的逐列正規表達式分類與 TrafficClassifier（預先編譯 + LRU 快取 + 批次去重）
+
+使用方式：
+    python scripts/benchmark_traffic_classifier.py --rows 2000000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.traffic_classifier import TrafficClassifier
+
+
+# GA4 常見的 source/medium 組合（實際資料的組合數通常只有數百種）
+SAMPLE_PAIRS = [
+    ('(direct)', '(none)'), ('(direct)', '(not set)'), ('google', 'organic'), ('bing', 'organic'),
+    ('yahoo', 'organic'), ('google', 'cpc'), ('facebook', 'paid'), ('meta', 'cpm'), ('google', 'pmax'),
+    ('line', 'edm'), ('crm', 'email'), ('app', 'push'), ('chatgpt.com', 'referral'),
+    ('perplexity', 'referral'), ('gemini.google.com', 'referral'), ('facebook.com', 'referral'),
+    ('instagram', 'social'), ('t.co', 'referral'), ('linktr.ee', 'referral'), ('pinterest', 'social'),
+    ('blog.example.com', 'referral'), ('news.example.com', 'referral'), ('partner', 'affiliate'),
+    (None, None), ('', ''), ('newsletter', None),
+]
+
+
+def legacy_classify_traffic_source(source, medium):
+    """改版前的實作：每次呼叫都以內嵌字串重新比對正規表達式"""
+    source_medium = f"{source} / {medium}" if source and medium else f"{source or ''} / {medium or ''}"
+    source_medium_lower = source_medium.lower()
+    if source == '(direct)' and medium in ['(none)', '(not set)']:
+        return '1. 直接流量'
+    if re.search(r'/ organic$|.*search.*', source_medium_lower):
+        return '2. 自然搜尋'
+    if re.search(r'/ (ads|cpc|paid|ppc|cpm|pmax|ad|fb-SiteLink)$', source_medium, re.IGNORECASE):
+        return '3. 付費廣告'
+    if re.search(r'(edm|line|push|sms|cdp|crm)', source_medium, re.IGNORECASE):
+        return '4. 會員經營'
+    if re.search(r'^(chatgpt|perplexity|copilot|bard|gemini)', source_medium_lower):
+        return '5. AI 助理'
+    if re.search(r'(facebook|threads|instagram|t\.co|line|linktr\.ee|pinterest|linkedin)', source_medium, re.IGNORECASE):
+        return '6. 社群媒體'
+    if re.search(r'/ referral$', source_medium, re.IGNORECASE):
+        return '7. 參照連結'
+    return '8. 其他'
+
+
+def make_pairs(rows, distinct, seed=42):
+    """
+    產生合成 source/medium 資料
+    
+    Args:
+        rows: 資料列數
+        distinct: 額外產生的長尾參照網站數
+        seed: 亂數種子
+    
+    Returns:
+        tuple: (sources, mediums)
+    """
+    rng = random.Random(seed)
+    pool = SAMPLE_PAIRS + [(f'site{i}.example.com', 'referral') for i in range(distinct)]
+    chosen = rng.choices(pool, k=rows)
+    return [s for s, _ in chosen], [m for _, m in chosen]
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"   {label:<36} {elapsed:>8.2f} s")
+    return elapsed, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流量來源分類器效能比較')
+    parser.add_argument('--rows', type=int, default=2_000_000, help='合成資料列數')
+    parser.add_argument('--distinct', type=int, default=500, help='長尾參照網站數')
+    args = parser.parse_args()
+    
+    sources, mediums = make_pairs(args.rows, args.distinct)
+    print(f"📊 合成流量資料：{args.rows:,} 列，{len(set(zip(sources, mediums))):,} 種 source/medium 組合")
+    
+    legacy_time, expected = timed(
+        '改版前（逐列 re.search）',
+        lambda: [legacy_classify_traffic_source(s, m) for s, m in zip(sources, mediums)]
+    )
+    
+    classifier = TrafficClassifier()
+    cached_time, cached = timed(
+        'TrafficClassifier.classify（逐列）',
+        lambda: [classifier.classify(s, m) for s, m in zip(sources, mediums)]
+    )
+    info = classifier.cache_info()
+    print(f"   LRU 快取：命中 {info.hits:,}，未命中 {info.misses:,}")
+    
+    bulk_time, bulk = timed(
+        'TrafficClassifier.classify_many',
+        lambda: TrafficClassifier().classify_many(sources, mediums)
+    )
+    
+    assert cached == expected and bulk == expected, "分類結果與改版前不一致"
+    print(f"\n✅ 結果一致；逐列快取加速 {legacy_time / cached_time:.1f}x，批次加速 {legacy_time / bulk_time:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+流量指標計算效能比較
+以合成的百萬列流量資料比較逐列 apply 與向量化（src/data/metrics.py）的執行時間，並確認結果一致
+
+使用方式：
+    python scripts/benchmark_traffic_metrics.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.traffic_rules import DEFAULT_TRAFFIC_LABEL
+from src.data import metrics
+from src.data.processor import DataProcessor, TRAFFIC_CHANNEL_MAPPING
+
+
+def make_traffic_frame(rows, seed=42):
+    """
+    產生合成流量資料
+    
+    Args:
+        rows: 資料列數
+        seed: 亂數種子
+    
+    Returns:
+        DataFrame: traffic_source, sessions, conversions, revenue
+    """
+    rng = np.random.default_rng(seed)
+    channels = np.array(list(TRAFFIC_CHANNEL_MAPPING) + ['(other)', 'newsletter', 'tiktok'], dtype=object)
+    sessions = rng.integers(0, 500, rows)
+    conversions = np.minimum(rng.integers(0, 20, rows), sessions)
+    return pd.DataFrame({
+        'traffic_source': channels[rng.integers(0, len(channels), rows)],
+        'sessions': sessions,
+        'conversions': conversions,
+        'revenue': conversions * rng.uniform(200, 3000, rows),
+    })
+
+
+def timed(label, func, repeat):
+    """執行 repeat 次並回傳最短時間與結果"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"   {label:<28} {best * 1000:>10.1f} ms")
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流量指標計算效能比較')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='合成資料列數')
+    parser.add_argument('--repeat', type=int, default=3, help='每種做法執行次數（取最短時間）')
+    args = parser.parse_args()
+    
+    df = make_traffic_frame(args.rows)
+    print(f"📊 合成流量資料：{len(df):,} 列")
+    
+    # 1. 流量來源分類
+    print("\n🏷️  流量來源分類")
+    apply_time, apply_categories = timed(
+        'Series.apply', lambda: df['traffic_source'].apply(DataProcessor.categorize_traffic_source), args.repeat
+    )
+    vector_time, vector_categories = timed(
+        'categorical map', lambda: metrics.map_categories(df['traffic_source'], TRAFFIC_CHANNEL_MAPPING, default=DEFAULT_TRAFFIC_LABEL),
+        args.repeat
+    )
+    assert apply_categories.equals(vector_categories), "分類結果不一致"
+    print(f"   加速 {apply_time / vector_time:.1f}x")
+    
+    # 2. 逐列 CVR / AOV（fetch_traffic_analysis 合併後的資料列數與輸入相同）
+    print("\n🧮 CVR / AOV")
+
+    def rowwise():
+        cvr = df.apply(lambda row: DataProcessor.calculate_cvr(row['sessions'], row['conversions']), axis=1)
+        aov = df.apply(lambda row: DataProcessor.calculate_aov(row['revenue'], row['conversions']), axis=1)
+        return cvr.to_numpy(), aov.to_numpy()
+
+    def vectorized():
+        return metrics.cvr(df['conversions'], df['sessions']), metrics.aov(df['revenue'], df['conversions'])
+    
+    apply_time, (apply_cvr, apply_aov) = timed('DataFrame.apply(axis=1)', rowwise, 1)
+    vector_time, (vector_cvr, vector_aov) = timed('np.divide(where=...)', vectorized, args.repeat)
+    assert np.allclose(apply_cvr, vector_cvr) and np.allclose(apply_aov, vector_aov), "CVR / AOV 結果不一致"
+    print(f"   加速 {apply_time / vector_time:.1f}x")
+    
+    # 3. 完整聚合流程
+    print("\n📦 DataProcessor.aggregate_traffic_by_category")
+    timed('aggregate_traffic_by_category', lambda: DataProcessor.aggregate_traffic_by_category(df.copy()), args.repeat)
+    
+    print("\n✅ 結果一致")
+
+
+if __name__ == '__main__':
+    main()
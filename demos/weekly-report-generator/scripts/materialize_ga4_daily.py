@@ -0,0 +1,73 @@
+"""
+GA4 每日彙總物化
+每天執行一次：將尚未物化、或在上次物化後又被 GA4 更新的 events_YYYYMMDD 分片寫入每日彙總表
+（需設定 GA4_MATERIALIZED_DATASET，資料集須與 GA4 資料集位於同一位置）
+
+使用方式：
+    python scripts/materialize_ga4_daily.py                  # 增量物化最近 30 天內的分片
+    python scripts/materialize_ga4_daily.py --since 2025-01-01
+    python scripts/materialize_ga4_daily.py --date 2025-01-15
+"""
+import argparse
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.bigquery import BigQueryConfig
+from src.data.ga4_materializer import GA4DailyMaterializer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GA4 每日彙總物化')
+    parser.add_argument('--date', type=str, default=None, help='只物化指定日期（YYYY-MM-DD）')
+    parser.add_argument('--since', type=str, default=None, help='增量檢查的起始日期（YYYY-MM-DD），預設最近 30 天')
+    parser.add_argument('--dry-run', action='store_true', help='只列出需要物化的日期，不寫入')
+    args = parser.parse_args()
+    
+    bq_config = BigQueryConfig()
+    try:
+        materializer = GA4DailyMaterializer(bq_config)
+    except ValueError as e:
+        print(f"❌ 錯誤：{str(e)}")
+        sys.exit(1)
+    
+    print("=" * 60)
+    print("GA4 每日彙總物化")
+    print("=" * 60)
+    print(f"   每日流量表：{materializer.traffic_table}")
+    print(f"   購買交易表：{materializer.purchases_table}")
+    
+    materializer.ensure_tables()
+    
+    if args.date:
+        pending = [date.fromisoformat(args.date)]
+    else:
+        since = date.fromisoformat(args.since) if args.since else None
+        pending = materializer.pending_dates(since=since)
+    
+    if not pending:
+        print("\n✅ 所有分片皆已物化，無需更新")
+        return
+    
+    print(f"\n📅 需要物化 {len(pending)} 天：{', '.join(d.isoformat() for d in pending)}")
+    if args.dry_run:
+        return
+    
+    failed = []
+    for event_date in pending:
+        try:
+            materializer.materialize(event_date)
+            print(f"   ✅ {event_date}")
+        except Exception as e:
+            print(f"   ❌ {event_date}：{str(e)}")
+            failed.append(event_date)
+    
+    print(f"\n🎉 完成：成功 {len(pending) - len(failed)} / {len(pending)} 天")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
 """
 圖表生成模組
 """
-from .generator import ChartGenerator
+from .generator import ChartGenerator, render_batch
 
-__all__ = ['ChartGenerator']
+__all__ = ['ChartGenerator', 'render_batch']
 
 
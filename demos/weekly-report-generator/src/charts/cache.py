@@ -0,0 +1,202 @@
+"""
+圖表片段本機快取
+以「圖表名稱 + 正規化的輸入資料 + 圖表設定」的雜湊值為鍵，將產生的圖表片段（選項 JSON 與尺寸）存放於快取目錄；
+資料與設定都沒變時（例如只修改報告模板後重跑週報）直接重用已產生的片段
+
+- 圖表設定包含主題、CHART_CONFIG、COLOR_PALETTE 等樣式設定、pyecharts 版本與圖表產生程式本身，任一變動即產生新的鍵
+- 超過 CHART_CACHE_MAX_AGE_DAYS 未使用的片段會被刪除；總大小超過 CHART_CACHE_MAX_MB 時由最久未使用的片段開始刪除
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+
+def _canonical(value):
+    """json.dumps 的 default：將 DataFrame、日期、numpy 純量等轉為可穩定序列化的值"""
+    if hasattr(value, 'columns') and hasattr(value, 'to_dict'):
+        # DataFrame：欄位順序與資料列順序都會影響圖表，依原順序保留
+        split = value.to_dict('split')
+        return {'columns': [str(c) for c in split['columns']], 'index': split['index'], 'data': split['data']}
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'item'):
+        # numpy 純量
+        return value.item()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+
+def canonical_json(value):
+    """
+    將圖表輸入資料轉為正規化的 JSON 字串（字典鍵排序，相同資料永遠得到相同字串）
+    
+    Args:
+        value: 圖表輸入資料（dict / list / DataFrame）
+    
+    Returns:
+        str: JSON 字串
+    """
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, default=_canonical)
+
+
+class ChartCache:
+    """圖表片段快取"""
+    
+    def __init__(self, cache_dir, max_bytes=50 * 1024 * 1024, max_age_seconds=30 * 86400):
+        """
+        初始化快取
+        
+        Args:
+            cache_dir: 快取目錄
+            max_bytes: 快取總大小上限（位元組）
+            max_age_seconds: 片段未被使用的最長保留秒數
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        
+        os.makedirs(self.cache_dir, exist_ok=True)
+    
+    @classmethod
+    def from_env(cls, default_dir):
+        """
+        依環境變數建立快取（CHART_CACHE_ENABLED=0 時停用）
+        
+        Args:
+            default_dir: 未設定 CHART_CACHE_DIR 時使用的快取目錄
+        
+        Returns:
+            ChartCache: 快取實例，停用時返回 None
+        """
+        if os.getenv('CHART_CACHE_ENABLED', '1').lower() in ('0', 'false', 'no'):
+            return None
+        
+        return cls(
+            cache_dir=os.getenv('CHART_CACHE_DIR', default_dir),
+            max_bytes=int(float(os.getenv('CHART_CACHE_MAX_MB', '50')) * 1024 * 1024),
+            max_age_seconds=int(float(os.getenv('CHART_CACHE_MAX_AGE_DAYS', '30')) * 86400),
+        )
+    
+    @staticmethod
+    def make_key(chart_name, data, settings):
+        """
+        產生快取鍵
+        
+        Args:
+            chart_name: 圖表名稱（例如 generate_traffic_source_chart）
+            data: 圖表輸入資料
+            settings: 圖表設定摘要（見 ChartGenerator 的 chart_settings_digest）
+        
+        Returns:
+            str: SHA-256 雜湊值
+        """
+        payload = f"{chart_name}\n{settings}\n{canonical_json(data)}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+    
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+    
+    def get(self, key):
+        """
+        讀取快取的片段（命中時更新最後使用時間）
+        
+        Args:
+            key: 快取鍵
+        
+        Returns:
+            str 或 dict: 圖表片段（格式同產生方法的返回值），未命中或已過期時返回 None
+        """
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age_seconds:
+                self._count(hit=False)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                fragment = json.load(f)['fragment']
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            self._count(hit=False)
+            return None
+        
+        self._count(hit=True)
+        return fragment
+    
+    def put(self, key, fragment):
+        """
+        寫入片段（先寫暫存檔再替換，避免並行產生時讀到寫一半的檔案），寫入後依大小 / 時間清理
+        
+        Args:
+            key: 快取鍵
+            fragment: 圖表片段（str 或 dict）
+        """
+        path = self._path(key)
+        suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(path + suffix, 'w', encoding='utf-8') as f:
+            json.dump({'created_at': time.time(), 'fragment': fragment}, f, ensure_ascii=False)
+        os.replace(path + suffix, path)
+        self.evict()
+    
+    def evict(self):
+        """
+        刪除過期片段，並在總大小超過上限時由最久未使用的片段開始刪除
+        
+        Returns:
+            int: 刪除的片段數
+        """
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return 0
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        # 最久未使用的排在前面
+        for mtime, size, path in sorted(entries):
+            if now - mtime <= self.max_age_seconds and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # 其他程序已刪除
+                pass
+            total -= size
+            removed += 1
+        return removed
+    
+    def stats(self):
+        """
+        取得快取命中統計
+        
+        Returns:
+            dict: 包含 hits、misses
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
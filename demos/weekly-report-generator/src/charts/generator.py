@@ -1,16 +1,27 @@
 """
 PyEcharts 圖表生成模組
-負責將資料轉換為互動式圖表 HTML
+負責將資料轉換為互動式圖表（選項 JSON，由報告統一載入 ECharts 並初始化）
 """
 import sys
 import os
+import hashlib
+import json
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
 
 # 添加專案根目錄到路徑
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import pyecharts
 from pyecharts import options as opts
 from pyecharts.charts import Bar, Line, Pie, Funnel
-from pyecharts.commons.utils import JsCode
+from pyecharts.commons.utils import JsCode, remove_key_with_none_value
+from pyecharts.datasets import FILENAMES
+from pyecharts.globals import CurrentConfig, ThemeType
+from pyecharts.options.series_options import BasicOpts
 from config.charts import (
     CHART_THEME,
     COLOR_PALETTE,
@@ -23,14 +34,212 @@ from config.charts import (
     FUNNEL_CONFIG,
     TIMESERIES_CONFIG,
 )
+from config.profiling import profiled, span, submit
+from .cache import ChartCache, canonical_json
+
+
+# 圖表片段快取目錄：專案根目錄下的 .cache/charts
+DEFAULT_CHART_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.cache', 'charts'
+)
+
+
+# JsCode 函式在選項 JSON 中以此標記包住（pyecharts 的預留位置），報告頁面載入時還原為函式
+JS_FUNCTION_MARKER = '--x_x--0_0--'
+
+# render_all 產生的圖表：(charts 鍵, 產生方法, 報告資料鍵)
+CHART_TASKS = [
+    ('weekly_comparison', 'generate_weekly_comparison_chart', 'weekly_comparison'),
+    ('traffic_source', 'generate_traffic_source_chart', 'traffic_df'),
+    ('aov_distribution', 'generate_aov_distribution_chart', 'aov_analysis'),
+    ('conversion_funnel', 'generate_conversion_funnel_chart', 'funnel_data'),
+]
+
+
+def chart_settings_digest():
+    """
+    取得圖表設定摘要（納入片段快取鍵）
+    
+    包含主題與樣式設定、pyecharts 版本，以及本模組的程式碼：調整樣式或圖表產生邏輯後，舊的片段自然不再命中
+    
+    Returns:
+        str: 正規化的設定 JSON
+    """
+    with open(__file__, 'rb') as f:
+        source_digest = hashlib.sha256(f.read()).hexdigest()
+    return canonical_json({
+        'theme': CHART_THEME,
+        'color_palette': COLOR_PALETTE,
+        'traffic_source_colors': TRAFFIC_SOURCE_COLORS,
+        'chart_config': CHART_CONFIG,
+        'title_config': TITLE_CONFIG,
+        'label_config': LABEL_CONFIG,
+        'legend_config': LEGEND_CONFIG,
+        'toolbox_config': TOOLBOX_CONFIG,
+        'funnel_config': FUNNEL_CONFIG,
+        'pyecharts': pyecharts.__version__,
+        'generator': source_digest,
+    })
+
+
+def _json_safe(value):
+    """
+    將圖表選項轉為可寫入 JSON 的格式
+    
+    NaN / Infinity 換成 None（JSON 沒有這兩個值，瀏覽器無法解析）；
+    opts.*Opts 物件展開為選項 dict（去除值為 None 的鍵，與 pyecharts 相同）
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, BasicOpts):
+        if isinstance(value.opts, (list, tuple)):
+            return [_json_safe(remove_key_with_none_value(item)) for item in value.opts]
+        return _json_safe(remove_key_with_none_value(value.opts))
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    return value
+
+
+def _json_default(value):
+    """圖表選項的 JSON 轉換：JsCode 保留以 JS_FUNCTION_MARKER 包住的原始碼（與 pyecharts 相同），日期轉為 ISO 字串"""
+    if isinstance(value, JsCode):
+        return value.replace("\\n|\\t", "").replace(r"\\n", "\n").replace(r"\\t", "\t").js_code
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"無法轉為 JSON：{type(value).__name__}")
 
 
 class ChartGenerator:
     """圖表生成器"""
     
-    def __init__(self):
+    def __init__(self, max_workers=None, cache=None):
+        """
+        初始化圖表生成器
+        
+        Args:
+            max_workers: render_all 同時產生的圖表數（預設讀取 CHART_RENDER_WORKERS，未設定為圖表數；
+                         設為 1 即為逐一產生）
+            cache: 圖表片段快取（預設依 CHART_CACHE_ENABLED / CHART_CACHE_DIR 建立，可選）
+        """
         self.theme = CHART_THEME
+        if max_workers is None:
+            max_workers = int(os.getenv('CHART_RENDER_WORKERS', str(len(CHART_TASKS))))
+        self.max_workers = max(1, int(max_workers))
+        # 最近一次 render_all 各圖表的產生耗時（毫秒），以及直接取自片段快取的圖表
+        self.render_times = {}
+        self.cached_charts = set()
+        
+        # 圖表片段快取（CHART_CACHE_ENABLED=0 可停用，詳見 src/charts/cache.py）
+        self.cache = cache or ChartCache.from_env(DEFAULT_CHART_CACHE_DIR)
+        self._settings_digest = chart_settings_digest() if self.cache is not None else None
+    
+    def render_all(self, data, keys=None, errors=None):
+        """
+        產生週報的所有圖表
+        
+        各圖表互相獨立，以執行緒池同時產生（每個圖表延續呼叫端的計時階段）；
+        輸入資料與圖表設定都沒變的圖表直接重用片段快取；多品牌批次請改用 render_batch，以程序池分散到多個核心
+        
+        Args:
+            data: 報告資料（fetch_report_data 的結果，需包含 weekly_comparison、traffic_df、aov_analysis、funnel_data）
+            keys: 只產生指定的圖表（CHART_TASKS 的 charts 鍵，預設全部），例如略過資料查詢失敗的報告區塊
+            errors: 傳入 dict 時，產生失敗的圖表記錄於此（{charts 鍵: 例外}）且不列入結果，其他圖表照常產生
+            
+        Returns:
+            dict: {'weekly_comparison', 'traffic_source', 'aov_distribution', 'conversion_funnel'}，
+                  格式同各 generate_*_chart；各圖表耗時記錄於 self.render_times，取自快取的圖表記錄於 self.cached_charts
+        """
+        tasks = [task for task in CHART_TASKS if keys is None or task[0] in keys]
+        with span('render_charts') as current:
+            results = {}
+            if self.max_workers == 1 or len(tasks) <= 1:
+                for key, method, data_key in tasks:
+                    try:
+                        results[key] = self._render_timed(method, data[data_key])
+                    except Exception as e:
+                        if errors is None:
+                            raise
+                        errors[key] = e
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tasks))) as executor:
+                    futures = {
+                        key: submit(executor, self._render_timed, method, data[data_key])
+                        for key, method, data_key in tasks
+                    }
+                    for key, future in futures.items():
+                        try:
+                            results[key] = future.result()
+                        except Exception as e:
+                            if errors is None:
+                                raise
+                            errors[key] = e
+            
+            self.render_times = {key: elapsed_ms for key, (_, elapsed_ms, _) in results.items()}
+            self.cached_charts = {key for key, (_, _, cache_hit) in results.items() if cache_hit}
+            current.set(workers=self.max_workers, cached_charts=len(self.cached_charts))
+        return {key: html for key, (html, _, _) in results.items()}
+    
+    @staticmethod
+    def _embed(chart):
+        """
+        將 pyecharts 圖表轉為報告使用的圖表片段
+        
+        不使用 render_embed()（每個圖表都是載入 ECharts、內嵌初始化程式的完整 HTML 頁面）；
+        由 ReportBuilder 統一輸出一次函式庫、所有圖表選項的 JSON 區塊，並在圖表捲入畫面時才初始化
+        
+        Args:
+            chart: pyecharts 圖表
+            
+        Returns:
+            dict: chart_id、width、height、theme、dependencies（ECharts 與主題 JS 網址）、
+                  options（選項 JSON，JsCode 函式保留為以 JS_FUNCTION_MARKER 包住的字串）
+        """
+        if chart.theme not in ThemeType.BUILTIN_THEMES:
+            chart.js_dependencies.add(chart.theme)
+        js_host = chart.js_host or CurrentConfig.ONLINE_HOST
+        dependencies = [
+            f"{js_host}{FILENAMES[name][0]}.{FILENAMES[name][1]}"
+            for name in chart.js_dependencies.items if name in FILENAMES
+        ]
+        return {
+            'chart_id': chart.chart_id,
+            'width': chart.width,
+            'height': chart.height,
+            'theme': chart.theme,
+            'dependencies': dependencies,
+            'options': json.dumps(
+                _json_safe(chart.get_options()), default=_json_default, ensure_ascii=False, allow_nan=False
+            ),
+        }
     
+    def _render_timed(self, method, chart_data):
+        """
+        產生單一圖表並計時（片段快取命中時直接返回快取內容）
+        
+        Returns:
+            tuple: (圖表片段, 耗時毫秒數, 是否命中快取)
+        """
+        start = time.perf_counter()
+        key = None
+        if self.cache is not None:
+            key = self.cache.make_key(method, chart_data, self._settings_digest)
+            html = self.cache.get(key)
+            if html is not None:
+                return html, (time.perf_counter() - start) * 1000, True
+        
+        html = getattr(self, method)(chart_data)
+        if key is not None:
+            try:
+                self.cache.put(key, html)
+            except (OSError, TypeError, ValueError) as e:
+                print(f"⚠️  寫入圖表快取失敗: {str(e)}")
+        return html, (time.perf_counter() - start) * 1000, False
+    
+    @profiled()
     def generate_weekly_comparison_chart(self, comparison_data):
         """
         生成本週關鍵摘要變化圖表
@@ -39,7 +248,7 @@ class ChartGenerator:
             comparison_data: 包含本週與上週資料的字典
             
         Returns:
-            str: 圖表的 HTML 字串
+            dict: 圖表片段（見 _embed）
         """
         this_week = comparison_data['this_week']
         last_week = comparison_data['last_week']
@@ -91,8 +300,9 @@ class ChartGenerator:
             )
         )
         
-        return bar.render_embed()
+        return self._embed(bar)
     
+    @profiled()
     def generate_traffic_source_chart(self, traffic_df):
         """
         生成流量來源分析圖表（餅圖 + 柱狀圖組合）
@@ -101,7 +311,7 @@ class ChartGenerator:
             traffic_df: 包含流量來源資料的 DataFrame
             
         Returns:
-            dict: 包含餅圖和柱狀圖的 HTML
+            dict: 包含餅圖和柱狀圖的圖表片段（沒有資料時為提示 HTML）
         """
         if traffic_df.empty:
             return {
@@ -114,17 +324,7 @@ class ChartGenerator:
         sessions = traffic_df['sessions'].tolist()
         revenue = traffic_df['revenue'].tolist()
         # 根據流量來源分類取得對應顏色
-        color_map = {
-            '1. 直接流量': TRAFFIC_SOURCE_COLORS.get('直接流量', COLOR_PALETTE['primary']),
-            '2. 自然搜尋': TRAFFIC_SOURCE_COLORS.get('自然搜尋', COLOR_PALETTE['info']),
-            '3. 付費廣告': TRAFFIC_SOURCE_COLORS.get('付費廣告', COLOR_PALETTE['danger']),
-            '4. 會員經營': TRAFFIC_SOURCE_COLORS.get('會員經營', COLOR_PALETTE['success']),
-            '5. AI 助理': TRAFFIC_SOURCE_COLORS.get('AI 來源', COLOR_PALETTE['info']),
-            '6. 社群媒體': TRAFFIC_SOURCE_COLORS.get('社群經營', COLOR_PALETTE['warning']),
-            '7. 參照連結': TRAFFIC_SOURCE_COLORS.get('參照連結', COLOR_PALETTE['info']),
-            '8. 其他': TRAFFIC_SOURCE_COLORS.get('其他', COLOR_PALETTE['gray']),
-        }
-        colors = [color_map.get(source, COLOR_PALETTE['gray']) for source in sources]
+        colors = [TRAFFIC_SOURCE_COLORS.get(source, COLOR_PALETTE['gray']) for source in sources]
         
         # 生成餅圖（按 Sessions）
         pie = (
@@ -223,10 +423,11 @@ class ChartGenerator:
         )
         
         return {
-            'pie': pie.render_embed(),
-            'bar': bar.render_embed(),
+            'pie': self._embed(pie),
+            'bar': self._embed(bar),
         }
     
+    @profiled()
     def generate_aov_distribution_chart(self, aov_data, dimension='overall'):
         """
         生成平均訂單金額分布圖表
@@ -236,7 +437,7 @@ class ChartGenerator:
             dimension: 分析維度（'overall', 'new', 'returning'）
             
         Returns:
-            dict: 包含件數分布和價格帶圖表的 HTML
+            dict: 包含件數分布和價格帶的圖表片段（沒有資料時為提示 HTML）
         """
         # 購物車件數分布（柱狀圖）
         item_data = aov_data.get('item_distribution', [])
@@ -295,7 +496,7 @@ class ChartGenerator:
                     ),
                 )
             )
-            item_html = item_chart.render_embed()
+            item_html = self._embed(item_chart)
         else:
             item_html = '<p>暫無資料</p>'
         
@@ -345,7 +546,7 @@ class ChartGenerator:
                     ),
                 )
             )
-            price_html = price_chart.render_embed()
+            price_html = self._embed(price_chart)
         else:
             price_html = '<p>暫無資料</p>'
         
@@ -354,6 +555,7 @@ class ChartGenerator:
             'price_band': price_html,
         }
     
+    @profiled()
     def generate_conversion_funnel_chart(self, funnel_data):
         """
         生成轉換漏斗圖表
@@ -362,7 +564,7 @@ class ChartGenerator:
             funnel_data: 包含漏斗階層資料的字典
             
         Returns:
-            str: 漏斗圖的 HTML 字串
+            dict: 漏斗圖的圖表片段（沒有資料時為提示 HTML）
         """
         overall = funnel_data.get('overall', {})
         steps = overall.get('steps', [])
@@ -400,7 +602,7 @@ class ChartGenerator:
                             var rates = %s;
                             var idx = params.dataIndex;
                             var conversionRate = rates[idx] || 0;
-                            return params.name + ': ' + params.value.toLocaleString() + ' (' + conversionRate.toFixed(2) + '%%')';
+                            return params.name + ': ' + params.value.toLocaleString() + ' (' + conversionRate.toFixed(2) + '%%)';
                         }
                         """ % conversion_rates
                     ),
@@ -432,5 +634,32 @@ class ChartGenerator:
             )
         )
         
-        return funnel.render_embed()
+        return self._embed(funnel)
+
+
+def render_batch(datasets, max_workers=None):
+    """
+    以程序池同時產生多份報告（例如多個品牌）的圖表
+    
+    pyecharts 組裝圖表選項是純 Python 運算，同一程序內的執行緒受 GIL 限制，
+    一次產生數十份報告時改以程序分散到多個核心；每份報告在子程序內逐一產生
+    
+    Args:
+        datasets: {報告名稱: 報告資料（同 render_all）}
+        max_workers: 程序數（預設為 CPU 核心數）
+        
+    Returns:
+        dict: {報告名稱: (charts, render_times)}
+    """
+    if not datasets:
+        return {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(_render_report_charts, data) for name, data in datasets.items()}
+        return {name: future.result() for name, future in futures.items()}
+
 
+def _render_report_charts(data):
+    """程序池工作：在子程序內產生一份報告的所有圖表"""
+    generator = ChartGenerator(max_workers=1)
+    charts = generator.render_all(data)
+    return charts, generator.render_times
@@ -0,0 +1,61 @@
+"""
+不重複計數策略
+交易會員數（user_id）與漏斗人數（user_pseudo_id）的計算方式，以 DISTINCT_COUNT_MODE 環境變數選擇：
+
+- exact：COUNT(DISTINCT)，精確但最耗資源
+- approx：APPROX_COUNT_DISTINCT（HLL++，誤差約 1%），不需要額外儲存
+- sketch：合併每日保存的 HLL++ 草稿（訂單買家存於每日彙總儲存，漏斗人數存於 GA4 每日彙總表），
+          週 / 月的不重複人數不必重新掃描明細；沒有可用的草稿時改用 approx
+
+訂單數（ord_id）在所有模式下都以 COUNT(DISTINCT) 計算：取消率與成交 / 總訂單比較都由訂單數算出，不可混用近似值
+"""
+import os
+
+
+DISTINCT_COUNT_MODES = ('exact', 'approx', 'sketch')
+
+# 報告中顯示的計算方式
+DISTINCT_COUNT_LABELS = {
+    'exact': '精確值',
+    'approx': '近似值（APPROX_COUNT_DISTINCT）',
+    'sketch': '近似值（每日 HLL++ 草稿合併）',
+}
+
+# 合併 HLL++ 草稿（草稿以 BYTES 陣列查詢參數傳入，不掃描任何資料表）
+MERGE_SKETCHES_QUERY = """
+        SELECT
+            (SELECT HLL_COUNT.MERGE(sketch) FROM UNNEST(@this_week) as sketch) as this_week,
+            (SELECT HLL_COUNT.MERGE(sketch) FROM UNNEST(@last_week) as sketch) as last_week
+        """
+
+
+def resolve_distinct_count_mode(mode=None):
+    """
+    取得不重複計數模式
+    
+    Args:
+        mode: 指定模式（預設讀取 DISTINCT_COUNT_MODE，未設定為 exact）
+    
+    Returns:
+        str: exact、approx 或 sketch
+    """
+    mode = (mode or os.getenv('DISTINCT_COUNT_MODE', 'exact')).strip().lower()
+    if mode not in DISTINCT_COUNT_MODES:
+        raise ValueError(f"不支援的不重複計數模式：{mode}（可用：{', '.join(DISTINCT_COUNT_MODES)}）")
+    return mode
+
+
+def count_distinct_sql(expression, mode):
+    """
+    產生不重複計數的 SQL 運算式（sketch 模式在沒有草稿可合併時也使用近似計數）
+    
+    Args:
+        expression: 要計數的欄位或運算式
+        mode: 不重複計數模式
+    
+    Returns:
+        str: SQL 運算式
+    """
+    if mode == 'exact':
+        return f"COUNT(DISTINCT {expression})"
+    return f"APPROX_COUNT_DISTINCT({expression})"
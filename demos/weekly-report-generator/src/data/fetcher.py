@@ -4,25 +4,158 @@ BigQuery 資料查詢模組
 根據實際資料表結構 (lv1_order_master, lv1_order 等) 調整查詢邏輯
 """
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import partial
 import sys
 import os
+import threading
+from google.cloud import bigquery
 
 # 添加專案根目錄到路徑
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.insert(0, project_root)
 
 from config.bigquery import BigQueryConfig, TABLES
+from config.cost_guard import BytesBudgetExceeded
+from config.profiling import profiled, submit
+from config.query_builder import QueryParams, partition_date_range, table_suffix_range
+from src.data import metrics
+from src.data.distinct_count import MERGE_SKETCHES_QUERY, count_distinct_sql, resolve_distinct_count_mode
+from src.data.ga4_materializer import GA4DailyMaterializer, FUNNEL_STEPS, sessions_category_sql, purchases_category_sql
+from src.data.rollup_store import RollupStore, PRICE_BANDS, ITEM_BUCKETS, rollup_scope
 from src.utils.date_utils import get_week_range, get_last_week_range, get_last_last_week_range
 
 
+# 流量分析各查詢結果的 DataFrame 型別設定（傳給 CachedQueryResult.to_dataframe）：
+# 購買交易的 traffic_category 只有十餘種值、列數可達數十萬，轉為 categorical；
+# 整數欄位使用可為空的 Int64，outer merge 產生的缺值不會讓整欄轉為 float64
+TRAFFIC_DTYPES = {
+    'sessions': {'nullable_ints': True},
+    'purchases': {'categories': ('traffic_category',)},
+    'orders': {'nullable_ints': True},
+    'traffic_agg': {'nullable_ints': True},
+}
+
+# fetch_report_data 的三組獨立查詢：報告計畫（GMV、關鍵摘要、AOV）、流量分析、轉換漏斗
+REPORT_DATA_PARTS = ('report_plan', 'traffic_df', 'funnel_data')
+
+
 class DataFetcher:
     """資料查詢器"""
     
-    def __init__(self):
+    def __init__(self, max_in_flight=None, distinct_count_mode=None):
+        """
+        初始化資料查詢器
+        
+        Args:
+            max_in_flight: 同時執行中的 BigQuery 查詢上限（預設讀取 BQ_MAX_IN_FLIGHT，未設定為 4；
+                           設為 1 即為逐一查詢）
+            distinct_count_mode: 不重複計數模式 exact / approx / sketch（預設讀取 DISTINCT_COUNT_MODE，未設定為 exact）
+        """
         self.bq_config = BigQueryConfig()
         self.client = self.bq_config.get_client()
+        
+        if max_in_flight is None:
+            max_in_flight = int(os.getenv('BQ_MAX_IN_FLIGHT', '4'))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._query_slots = threading.BoundedSemaphore(self.max_in_flight)
+        
+        # 每日彙總儲存（設定 ROLLUP_DB_PATH 時，訂單指標改由已存的每日資料加總）
+        self.rollup_store = RollupStore.from_env()
+        # 取消、退貨會在事後回寫訂單主檔：寫入時該日結束未滿 N 天的彙總，下次執行時重新彙總
+        self.rollup_settle_days = int(os.getenv('ROLLUP_SETTLE_DAYS', '7'))
+        
+        # 不重複計數模式，以及各指標實際使用的計算方式（記錄於報告 metadata）
+        self.distinct_count_mode = resolve_distinct_count_mode(distinct_count_mode)
+        self.distinct_count_sources = {}
+    
+    def _query_dataframe(self, query, params=None, label='query', **dtype_options):
+        """
+        執行查詢並取得 DataFrame（受 max_in_flight 限制）
+        
+        Args:
+            query: SQL 查詢字串
+            params: QueryParams（可選，SQL 中的 @參數）
+            label: 查詢標籤（成本記錄與預算警告依此區分 fetch 方法）
+            **dtype_options: DataFrame 型別設定（categories、nullable_ints，見 CachedQueryResult.to_dataframe）
+            
+        Returns:
+            DataFrame: 查詢結果
+        """
+        query_parameters = params.to_bigquery() if params is not None else None
+        with self._query_slots:
+            result = self.bq_config.query(query, query_parameters=query_parameters, label=label)
+            return result.to_dataframe(**dtype_options)
+    
+    def _query_rows(self, query, params=None, label='query', use_cache=True):
+        """
+        執行查詢並取得資料列清單（受 max_in_flight 限制，不建立 DataFrame）
+        
+        Args:
+            query: SQL 查詢字串
+            params: QueryParams（可選，SQL 中的 @參數）
+            label: 查詢標籤
+            use_cache: 是否使用本機查詢快取
+            
+        Returns:
+            list: [{欄位: 值}]
+        """
+        query_parameters = params.to_bigquery() if params is not None else None
+        with self._query_slots:
+            return self.bq_config.query_rows(query, query_parameters=query_parameters, label=label, use_cache=use_cache)
+    
+    @staticmethod
+    def _run_parallel(tasks, errors=None):
+        """
+        並行執行多個互相獨立的工作，全部完成後一次取回結果
+        
+        BigQuery 作業在伺服器端非同步執行，各工作送出後只在取回結果時等待，
+        因此總耗時約等於最慢的一個查詢；實際同時執行的查詢數由 _query_dataframe 限制
+        各工作延續呼叫端的計時階段（span），子查詢的作業 ID 與資料列數記在所屬的 fetch 方法下
+        
+        Args:
+            tasks: {名稱: 無參數的 callable}
+            errors: 傳入 dict 時，失敗的工作記錄於此（{名稱: 例外}）且不列入結果，其他工作照常完成
+            
+        Returns:
+            dict: {名稱: 結果}，未傳入 errors 時任一工作發生例外會在此重新拋出
+        """
+        if not tasks:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = {name: submit(executor, task) for name, task in tasks.items()}
+            if errors is None:
+                return {name: future.result() for name, future in futures.items()}
+            
+            results = {}
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = e
+            return results
+    
+    def _query_many(self, queries, params=None, label='query', dtypes=None):
+        """
+        並行執行多個互相獨立的查詢
+        
+        Args:
+            queries: {名稱: SQL 查詢字串}
+            params: 各查詢共用的 QueryParams（可選）
+            label: 查詢標籤前綴（各查詢的標籤為「前綴.名稱」）
+            dtypes: {名稱: DataFrame 型別設定}（可選）
+            
+        Returns:
+            dict: {名稱: DataFrame}
+        """
+        dtypes = dtypes or {}
+        return self._run_parallel({
+            name: partial(self._query_dataframe, query, params, f"{label}.{name}", **dtypes.get(name, {}))
+            for name, query in queries.items()
+        })
     
+    @profiled()
     def fetch_gmv_metrics(self, start_date=None, end_date=None):
         """
         查詢 GMV 基本指標
@@ -40,6 +173,11 @@ class DataFetcher:
         # 使用 lv1_order_master 表（訂單主檔）
         table_ref = self.bq_config.get_table_ref(TABLES['lv1_order_master'])
         
+        # 任意日期區間沒有可合併的每日草稿，sketch 模式也使用近似計數
+        mode = 'exact' if self.distinct_count_mode == 'exact' else 'approx'
+        self.distinct_count_sources['unique_users'] = mode
+        
+        params = QueryParams()
         query = f"""
         SELECT
             -- 成交總額：所有訂單的 ord_rev
@@ -47,7 +185,7 @@ class DataFetcher:
             -- 總營業額：排除取消訂單的 ord_rev
             SUM(CASE WHEN bhv1 <> '取消' THEN ord_rev ELSE 0 END) as gross_revenue,
             -- 交易會員數
-            COUNT(DISTINCT user_id) as unique_users,
+            {count_distinct_sql('user_id', mode)} as unique_users,
             -- 成交訂單總量：所有訂單數
             COUNT(DISTINCT ord_id) as completed_orders,
             -- 總訂單總量：排除取消的訂單數
@@ -57,13 +195,13 @@ class DataFetcher:
             -- 取消訂單總額
             SUM(CASE WHEN bhv1 = '取消' THEN ord_rev ELSE 0 END) as cancelled_revenue
         FROM `{table_ref}`
-        WHERE DATE(dt) BETWEEN DATE('{start_date}') AND DATE('{end_date}')
+        WHERE {partition_date_range(params, start_date, end_date)}
             AND touch_class = 'ec'  -- 只查詢電商通路
         """
         
-        result = self.bq_config.query(query).to_dataframe()
+        rows = self._query_rows(query, params, 'fetch_gmv_metrics')
         
-        if result.empty or result.iloc[0].get('total_orders') is None:
+        if not rows or rows[0].get('total_orders') is None:
             return {
                 'net_revenue': 0,
                 'gross_revenue': 0,
@@ -75,7 +213,19 @@ class DataFetcher:
                 'cancel_rate': 0.0,
             }
         
-        row = result.iloc[0]
+        return self._build_gmv_metrics(rows[0])
+    
+    @staticmethod
+    def _build_gmv_metrics(row):
+        """
+        將 GMV 查詢結果（單列）轉換為指標字典
+        
+        Args:
+            row: 含 net_revenue、completed_orders 等欄位的資料列（dict）
+            
+        Returns:
+            dict: 格式同 fetch_gmv_metrics
+        """
         # 注意：根據 SQL 邏輯
         # completed_orders = 所有訂單數（包含取消）
         # total_orders = 排除取消的訂單數
@@ -97,6 +247,7 @@ class DataFetcher:
             'cancel_rate': round(cancel_rate, 2),
         }
     
+    @profiled()
     def fetch_weekly_comparison(self):
         """
         查詢上週（上週一到上週日）與上上週（上上週一到上上週日）的比較資料
@@ -116,6 +267,20 @@ class DataFetcher:
         # 查詢上上週資料（對比週）
         last_week = self.fetch_gmv_metrics(last_week_monday, last_week_sunday)
         
+        return self._build_comparison(this_week, last_week)
+    
+    @staticmethod
+    def _build_comparison(this_week, last_week):
+        """
+        組合觀察週與對比週的比較結果
+        
+        Args:
+            this_week: 觀察週（上週）的 GMV 指標
+            last_week: 對比週（上上週）的 GMV 指標
+            
+        Returns:
+            dict: 格式同 fetch_weekly_comparison
+        """
         # 計算變化百分比
         def calc_change(current, previous):
             if previous == 0:
@@ -131,7 +296,318 @@ class DataFetcher:
             }
         }
     
-    def fetch_traffic_analysis(self, start_date=None, end_date=None):
+    @profiled()
+    def fetch_report_plan(self, start_date=None, end_date=None):
+        """
+        以單次 lv1_order_master 掃描查詢週報所需的訂單指標（報告計畫模式）
+        
+        一次 GROUP BY 週別的查詢同時計算觀察週與對比週的 GMV、取消統計
+        及觀察週的價格帶分布，取代 fetch_gmv_metrics、fetch_weekly_comparison
+        與 fetch_aov_analysis 價格帶查詢對訂單主檔的四次掃描
+        
+        Args:
+            start_date: 觀察週開始日期（datetime.date），如果為 None 則使用上週週一
+            end_date: 觀察週結束日期（datetime.date），如果為 None 則使用上週週日
+            
+        Returns:
+            dict: 包含 gmv_metrics、weekly_comparison、aov_analysis
+                  （格式分別同 fetch_gmv_metrics、fetch_weekly_comparison、fetch_aov_analysis）
+        """
+        if start_date is None or end_date is None:
+            start_date, end_date = get_last_week_range()
+        
+        # 對比週：觀察週往前推 7 天
+        compare_start = start_date - timedelta(days=7)
+        
+        if self.rollup_store is not None:
+            plan = self._fetch_report_plan_from_rollups(start_date, end_date)
+            if plan is not None:
+                return plan
+        
+        table_ref = self.bq_config.get_table_ref(TABLES['lv1_order_master'])
+        mode = 'exact' if self.distinct_count_mode == 'exact' else 'approx'
+        self.distinct_count_sources['unique_users'] = mode
+        
+        params = QueryParams()
+        
+        # 價格帶欄位（只計算成交訂單，ELSE 分支與 fetch_aov_analysis 的 CASE 一致）
+        price_band_columns = ",\n".join(
+            f"""            COUNTIF(bhv1 <> '取消' AND {condition}) as {alias}_orders,
+            AVG(IF(bhv1 <> '取消' AND {condition}, ord_rev, NULL)) as {alias}_avg"""
+            for _, alias, condition in PRICE_BANDS
+        )
+        
+        query = f"""
+        SELECT
+            IF(DATE(dt) >= {params.add('start_date', start_date)}, 'this_week', 'last_week') as week_tag,
+            SUM(ord_rev) as net_revenue,
+            SUM(CASE WHEN bhv1 <> '取消' THEN ord_rev ELSE 0 END) as gross_revenue,
+            {count_distinct_sql('user_id', mode)} as unique_users,
+            COUNT(DISTINCT ord_id) as completed_orders,
+            SUM(CASE WHEN bhv1 <> '取消' THEN 1 ELSE 0 END) as total_orders,
+            COUNT(DISTINCT CASE WHEN bhv1 = '取消' THEN ord_id END) as cancelled_orders,
+            SUM(CASE WHEN bhv1 = '取消' THEN ord_rev ELSE 0 END) as cancelled_revenue,
+{price_band_columns}
+        FROM `{table_ref}`
+        WHERE {partition_date_range(params, compare_start, end_date, start_name='compare_start')}
+            AND touch_class = 'ec'
+        GROUP BY week_tag
+        """
+        
+        # 訂單主檔掃描與訂單明細查詢互相獨立，同時送出
+        results = self._run_parallel({
+            'plan': partial(self._query_rows, query, params, 'fetch_report_plan'),
+            'item_distribution': partial(self._fetch_item_distribution, start_date, end_date),
+        })
+        rows = {row['week_tag']: row for row in results['plan']}
+        
+        this_week_row = rows.get('this_week', {})
+        this_week = self._build_gmv_metrics(this_week_row)
+        last_week = self._build_gmv_metrics(rows.get('last_week', {}))
+        
+        return {
+            'gmv_metrics': this_week,
+            'weekly_comparison': self._build_comparison(this_week, last_week),
+            'aov_analysis': {
+                'item_distribution': results['item_distribution'],
+                'price_band_distribution': self._build_price_band_distribution(this_week_row),
+            },
+        }
+    
+    @staticmethod
+    def _build_price_band_distribution(row):
+        """
+        將含 {alias}_orders、{alias}_avg 欄位的資料列轉換為價格帶分布
+        
+        Args:
+            row: 觀察週的資料列（dict）
+            
+        Returns:
+            list: 格式同 fetch_aov_analysis 的 price_band_distribution
+        """
+        # 只保留有訂單的價格帶（與 GROUP BY price_band 的結果一致）
+        return [
+            {
+                'price_band': label,
+                'order_count': int(row[f'{alias}_orders']),
+                'avg_amount': float(row[f'{alias}_avg'] or 0),
+            }
+            for label, alias, _ in PRICE_BANDS
+            if row.get(f'{alias}_orders')
+        ]
+    
+    def _fetch_report_plan_from_rollups(self, start_date, end_date):
+        """
+        由每日彙總儲存加總觀察週與對比週的訂單指標（報告計畫的 rollup 後端）
+        
+        營收、價格帶與購物車件數分布皆可跨日加總（平均值以合計 / 筆數重新計算），
+        儲存中缺少的日期先從 BigQuery 按日彙總補齊；不重複訂單數與交易會員數不可跨日加總，
+        另外查詢（見 _fetch_distinct_counts_from_rollups）
+        
+        Args:
+            start_date: 觀察週開始日期（datetime.date）
+            end_date: 觀察週結束日期（datetime.date）
+            
+        Returns:
+            dict: 格式同 fetch_report_plan；無法使用每日彙總時返回 None（改為直接查詢訂單主檔）
+        """
+        compare_start = start_date - timedelta(days=7)
+        compare_end = start_date - timedelta(days=1)
+        scope = rollup_scope(self.bq_config)
+        store = self.rollup_store
+        
+        try:
+            missing = store.missing_days(scope, compare_start, end_date, settle_days=self.rollup_settle_days)
+            if missing:
+                print(f"🗄️  每日彙總缺少 {len(missing)} 天，從 BigQuery 補齊（{missing[0]} ~ {missing[-1]}）")
+                # 重新彙總是為了取得事後回寫的取消與退貨，已結束的區間在本機快取中永久有效，不讀取快取
+                store.refresh(
+                    self.bq_config, missing[0], missing[-1],
+                    query=partial(self._query_rows, label='rollup_refresh', use_cache=False),
+                )
+        except Exception as e:
+            print(f"⚠️  無法使用每日彙總，改為直接查詢訂單主檔: {str(e)}")
+            return None
+        
+        counts = self._fetch_distinct_counts_from_rollups(scope, start_date, end_date)
+        
+        this_week_row = store.sum_orders(scope, start_date, end_date)
+        this_week_row.update(counts['this_week'])
+        last_week_row = store.sum_orders(scope, compare_start, compare_end)
+        last_week_row.update(counts['last_week'])
+        
+        for _, alias, _ in PRICE_BANDS:
+            amount_count = this_week_row[f'{alias}_amount_count']
+            this_week_row[f'{alias}_avg'] = this_week_row[f'{alias}_revenue'] / amount_count if amount_count else None
+        
+        items = store.sum_items(scope, start_date, end_date)
+        item_distribution = [
+            {
+                'item_count': bucket,
+                'order_count': int(items[bucket][0]),
+                'avg_amount': items[bucket][1] / items[bucket][2] if items[bucket][2] else None,
+            }
+            for bucket in ITEM_BUCKETS
+            if bucket in items
+        ]
+        
+        this_week = self._build_gmv_metrics(this_week_row)
+        last_week = self._build_gmv_metrics(last_week_row)
+        
+        return {
+            'gmv_metrics': this_week,
+            'weekly_comparison': self._build_comparison(this_week, last_week),
+            'aov_analysis': {
+                'item_distribution': item_distribution,
+                'price_band_distribution': self._build_price_band_distribution(this_week_row),
+            },
+        }
+    
+    def _fetch_distinct_counts_from_rollups(self, scope, start_date, end_date):
+        """
+        查詢 rollup 後端的觀察週與對比週不重複計數（訂單數、交易會員數）
+        
+        每日不重複訂單數不可跨日加總（同一訂單可能在多個 dt 都有資料列），訂單數一律以
+        COUNT(DISTINCT ord_id) 精確查詢訂單主檔（只讀取 ord_id、bhv1 欄位）；交易會員數在 sketch 模式
+        以 HLL_COUNT.MERGE 合併每日彙總儲存中的草稿（查詢參數傳入，不掃描資料表），與訂單數查詢同時送出，
+        其他模式或草稿不完整時，依模式以 COUNT(DISTINCT) / APPROX_COUNT_DISTINCT 在訂單數查詢中一併計算
+        
+        Args:
+            scope: 每日彙總的範圍鍵
+            start_date: 觀察週開始日期（datetime.date）
+            end_date: 觀察週結束日期（datetime.date）
+            
+        Returns:
+            dict: {'this_week': {'unique_users': 人數, 'completed_orders': 訂單數, 'cancelled_orders': 取消訂單數},
+                   'last_week': {...}}
+        """
+        compare_start = start_date - timedelta(days=7)
+        compare_end = start_date - timedelta(days=1)
+        store = self.rollup_store
+        tasks = {}
+        
+        if self.distinct_count_mode == 'sketch':
+            missing = store.missing_sketch_days(scope, compare_start, end_date)
+            if not missing:
+                parameters = [
+                    bigquery.ArrayQueryParameter('this_week', 'BYTES', store.load_sketches(scope, start_date, end_date)),
+                    bigquery.ArrayQueryParameter('last_week', 'BYTES', store.load_sketches(scope, compare_start, compare_end)),
+                ]
+                tasks['sketch'] = partial(self._merge_user_sketches, parameters)
+            else:
+                print(f"⚠️  每日彙總缺少 {len(missing)} 天的交易會員草稿，改用 APPROX_COUNT_DISTINCT")
+        
+        users_column = ''
+        if 'sketch' not in tasks:
+            mode = 'exact' if self.distinct_count_mode == 'exact' else 'approx'
+            self.distinct_count_sources['unique_users'] = mode
+            users_column = f"\n            {count_distinct_sql('user_id', mode)} as unique_users,"
+        
+        table_ref = self.bq_config.get_table_ref(TABLES['lv1_order_master'])
+        params = QueryParams()
+        counts_query = f"""
+        SELECT
+            IF(DATE(dt) >= {params.add('start_date', start_date)}, 'this_week', 'last_week') as week_tag,{users_column}
+            COUNT(DISTINCT ord_id) as completed_orders,
+            COUNT(DISTINCT CASE WHEN bhv1 = '取消' THEN ord_id END) as cancelled_orders
+        FROM `{table_ref}`
+        WHERE {partition_date_range(params, compare_start, end_date, start_name='compare_start')}
+            AND touch_class = 'ec'
+        GROUP BY week_tag
+        """
+        tasks['counts'] = partial(self._query_rows, counts_query, params, 'distinct_counts')
+        results = self._run_parallel(tasks)
+        
+        counts = {
+            week_tag: {'unique_users': 0, 'completed_orders': 0, 'cancelled_orders': 0}
+            for week_tag in ('this_week', 'last_week')
+        }
+        for row in results['counts']:
+            counts[row['week_tag']].update(
+                {column: value or 0 for column, value in row.items() if column != 'week_tag'}
+            )
+        if 'sketch' in results:
+            self.distinct_count_sources['unique_users'] = 'sketch'
+            for week_tag in counts:
+                counts[week_tag]['unique_users'] = results['sketch'][week_tag] or 0
+        return counts
+    
+    def _merge_user_sketches(self, parameters):
+        """以 HLL_COUNT.MERGE 合併觀察週與對比週的交易會員草稿（受 max_in_flight 限制）"""
+        with self._query_slots:
+            return self.bq_config.query_one(
+                MERGE_SKETCHES_QUERY, query_parameters=parameters, label='unique_users.sketch'
+            )
+    
+    @profiled()
+    def fetch_report_data(self, start_date=None, end_date=None, parts=None, errors=None):
+        """
+        並行查詢整份週報所需的資料
+        
+        報告計畫（訂單指標）、流量分析、轉換漏斗三組查詢（REPORT_DATA_PARTS）互相獨立，
+        同時送出後等待全部完成，總耗時約等於最慢的一組查詢
+        
+        Args:
+            start_date: 觀察週開始日期（datetime.date），如果為 None 則使用上週週一
+            end_date: 觀察週結束日期（datetime.date），如果為 None 則使用上週週日
+            parts: 只查詢指定的部分（REPORT_DATA_PARTS 的子集，預設全部），用於只重新查詢過期或失敗的報告區塊
+            errors: 傳入 dict 時，查詢失敗的部分記錄於此（{部分: 例外}）而不中止其他部分
+            
+        Returns:
+            dict: 包含 gmv_metrics、weekly_comparison、aov_analysis、traffic_df、funnel_data，
+                  以及 metadata（不重複計數模式與各指標實際使用的計算方式）；只包含已查詢且成功的部分
+        """
+        if start_date is None or end_date is None:
+            start_date, end_date = get_last_week_range()
+        
+        tasks = {
+            'report_plan': partial(self.fetch_report_plan, start_date, end_date),
+            'traffic_df': partial(self.fetch_traffic_analysis, start_date, end_date),
+            'funnel_data': partial(self.fetch_conversion_funnel, start_date, end_date),
+        }
+        if parts is not None:
+            tasks = {name: task for name, task in tasks.items() if name in parts}
+        results = self._run_parallel(tasks, errors)
+        
+        report_data = dict(results.get('report_plan', {}))
+        for name in ('traffic_df', 'funnel_data'):
+            if name in results:
+                report_data[name] = results[name]
+        report_data['metadata'] = {
+            'distinct_count_mode': self.distinct_count_mode,
+            'distinct_counts': dict(self.distinct_count_sources),
+        }
+        return report_data
+    
+    def _materializer_for(self, start_date, end_date):
+        """
+        取得可用於日期區間的 GA4 每日彙總物化器
+        
+        Args:
+            start_date: 開始日期（datetime.date）
+            end_date: 結束日期（datetime.date）
+            
+        Returns:
+            GA4DailyMaterializer: 未設定 GA4_MATERIALIZED_DATASET、或區間尚未完整物化時返回 None
+        """
+        if not self.bq_config.ga4_materialized_dataset:
+            return None
+        
+        try:
+            materializer = GA4DailyMaterializer(self.bq_config)
+            with self._query_slots:
+                complete = materializer.is_complete(start_date, end_date)
+        except Exception as e:
+            print(f"⚠️  無法讀取 GA4 每日彙總，改為查詢事件表: {str(e)}")
+            return None
+        
+        if not complete:
+            print(f"⚠️  GA4 每日彙總尚未涵蓋 {start_date} ~ {end_date}，改為查詢事件表")
+            return None
+        return materializer
+    
+    @profiled()
+    def fetch_traffic_analysis(self, start_date=None, end_date=None, join_mode=None):
         """
         查詢流量分析資料
         
@@ -141,22 +617,20 @@ class DataFetcher:
         Args:
             start_date: 開始日期（datetime.date），如果為 None 則使用本週週一
             end_date: 結束日期（datetime.date），如果為 None 則使用本週週日
+            join_mode: JOIN 方式（預設讀取 TRAFFIC_JOIN_MODE，未設定為 'auto'）
+                - 'auto': 先嘗試伺服器端 JOIN，失敗時改用本機 JOIN
+                - 'pushdown': 只使用伺服器端 JOIN
+                - 'local': 只使用本機 JOIN
             
         Returns:
             DataFrame: 各流量來源的 Sessions、CVR、AOV、營收
         """
-        from src.utils.traffic_classifier import classify_traffic_source_sql
-        
         if start_date is None or end_date is None:
             start_date, end_date = get_last_week_range()
         
-        # 生成日期字串列表（用於 GA4 表的分區查詢）
-        date_suffixes = []
-        current_date = start_date
-        while current_date <= end_date:
-            date_suffixes.append(current_date.strftime('%Y%m%d'))
-            current_date += timedelta(days=1)
-        date_suffix_str = "','".join(date_suffixes)
+        # sessions、購買交易、訂單三個查詢（及其組合的 JOIN 查詢）共用同一組日期參數
+        params = QueryParams()
+        suffix_filter = table_suffix_range(params, start_date, end_date)
         
         # GA4 事件表
         ga4_table_ref = self.bq_config.get_ga4_table_ref('events_*')
@@ -165,13 +639,8 @@ class DataFetcher:
         order_master_table = self.bq_config.get_table_ref(TABLES['lv1_order_master'])
         
         # 流量分類 SQL
-        # traffic_source 可以直接存取 source 和 medium
-        # session_traffic_source_last_click 需要從 manual_campaign 或 cross_channel_campaign 取得
-        traffic_classification_sessions = classify_traffic_source_sql('traffic_source.source', 'traffic_source.medium')
-        traffic_classification_purchases = classify_traffic_source_sql(
-            'COALESCE(session_traffic_source_last_click.manual_campaign.source, session_traffic_source_last_click.cross_channel_campaign.source, "(direct)")',
-            'COALESCE(session_traffic_source_last_click.manual_campaign.medium, session_traffic_source_last_click.cross_channel_campaign.medium, "(none)")'
-        )
+        traffic_classification_sessions = sessions_category_sql()
+        traffic_classification_purchases = purchases_category_sql()
         
         # 分兩步查詢，避免位置問題
         # 步驟 1: 查詢 GA4 Sessions
@@ -188,19 +657,19 @@ class DataFetcher:
                 )
             )) as sessions
         FROM `{ga4_table_ref}`
-        WHERE _TABLE_SUFFIX IN ('{date_suffix_str}')
+        WHERE {suffix_filter}
             AND event_name = 'session_start'
         GROUP BY traffic_category
         """
         
         # 步驟 2: 查詢 GA4 Purchases 和 JOIN Shopline 訂單
-        # 注意：使用 UNION ALL 來查詢不同位置的資料表，然後在 Python 中 JOIN
+        # 注意：GA4 與訂單資料表可能位於不同位置，伺服器端 JOIN 失敗時改在 Python 中 JOIN
         ga4_purchases_query = f"""
         SELECT DISTINCT
             (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'transaction_id') as transaction_id,
             {traffic_classification_purchases} as traffic_category
         FROM `{ga4_table_ref}`
-        WHERE _TABLE_SUFFIX IN ('{date_suffix_str}')
+        WHERE {suffix_filter}
             AND event_name = 'purchase'
             AND (SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'transaction_id') IS NOT NULL
         """
@@ -211,45 +680,60 @@ class DataFetcher:
             SUM(CASE WHEN bhv1 <> '取消' THEN ord_rev ELSE 0 END) as revenue,
             AVG(CASE WHEN bhv1 <> '取消' THEN ord_rev END) as aov
         FROM `{order_master_table}`
-        WHERE DATE(dt) BETWEEN DATE('{start_date}') AND DATE('{end_date}')
+        WHERE {partition_date_range(params, start_date, end_date)}
             AND touch_class = 'ec'
             AND bhv1 <> '取消'
         GROUP BY ord_id
         """
         
+        # 已物化每日彙總時，改從彙總表讀取 sessions 與購買交易（不掃描 events_* 完整事件）
+        materializer = self._materializer_for(start_date, end_date)
+        if materializer is not None:
+            ga4_sessions_query = materializer.sessions_query(start_date, end_date, params)
+            ga4_purchases_query = materializer.purchases_query(start_date, end_date, params)
+        
+        if join_mode is None:
+            join_mode = os.getenv('TRAFFIC_JOIN_MODE', 'auto')
+        
         try:
-            # 查詢 GA4 Sessions
-            sessions_df = self.bq_config.query(ga4_sessions_query).to_dataframe()
-            
-            # 查詢 GA4 Purchases
-            purchases_df = self.bq_config.query(ga4_purchases_query).to_dataframe()
-            
-            # 查詢 Shopline 訂單
-            orders_df = self.bq_config.query(shopline_orders_query).to_dataframe()
+            traffic_agg = None
             
-            # 在 Python 中 JOIN
-            if purchases_df.empty or orders_df.empty:
-                return pd.DataFrame(columns=['traffic_source', 'sessions', 'conversions', 'cvr', 'aov', 'revenue'])
+            # 伺服器端 JOIN：只取回各流量來源的彙總列
+            if join_mode in ('auto', 'pushdown'):
+                try:
+                    results = self._run_parallel({
+                        'sessions': partial(
+                            self._query_dataframe, ga4_sessions_query, params, 'fetch_traffic_analysis.sessions',
+                            **TRAFFIC_DTYPES['sessions']
+                        ),
+                        'traffic_agg': partial(
+                            self._fetch_traffic_conversions_pushdown,
+                            ga4_purchases_query, shopline_orders_query, start_date, end_date, params
+                        ),
+                    })
+                    sessions_df = results['sessions']
+                    traffic_agg = results['traffic_agg']
+                except BytesBudgetExceeded:
+                    raise
+                except Exception as e:
+                    if join_mode == 'pushdown':
+                        raise
+                    print(f"⚠️  伺服器端 JOIN 失敗，改用本機 JOIN: {str(e)}")
             
-            # JOIN purchases 和 orders
-            traffic_orders = purchases_df.merge(
-                orders_df,
-                left_on='transaction_id',
-                right_on='ord_id',
-                how='inner'
-            )
+            # 本機 JOIN（降級方案）：下載交易明細與訂單後在 Python 中 JOIN
+            if traffic_agg is None:
+                # 同時查詢 GA4 Sessions、GA4 Purchases、Shopline 訂單（三者互相獨立）
+                results = self._query_many({
+                    'sessions': ga4_sessions_query,
+                    'purchases': ga4_purchases_query,
+                    'orders': shopline_orders_query,
+                }, params, 'fetch_traffic_analysis', dtypes=TRAFFIC_DTYPES)
+                sessions_df = results['sessions']
+                traffic_agg = self._join_purchases_locally(results['purchases'], results['orders'])
             
-            if traffic_orders.empty:
+            if traffic_agg.empty:
                 return pd.DataFrame(columns=['traffic_source', 'sessions', 'conversions', 'cvr', 'aov', 'revenue'])
             
-            # 按流量來源聚合
-            traffic_agg = traffic_orders.groupby('traffic_category').agg({
-                'transaction_id': 'count',
-                'revenue': 'sum',
-                'aov': 'mean'
-            }).reset_index()
-            traffic_agg.columns = ['traffic_category', 'conversions', 'revenue', 'aov']
-            
             # 合併 Sessions 資料
             if not sessions_df.empty:
                 result_df = sessions_df.merge(
@@ -261,11 +745,8 @@ class DataFetcher:
                 result_df = traffic_agg.copy()
                 result_df['sessions'] = 0
             
-            # 計算 CVR
-            result_df['cvr'] = result_df.apply(
-                lambda row: round((row['conversions'] / row['sessions'] * 100), 2) if row['sessions'] > 0 else 0.0,
-                axis=1
-            )
+            # 計算 CVR（向量化）
+            result_df['cvr'] = metrics.cvr(result_df['conversions'], result_df['sessions'])
             
             # 重新命名並填充空值
             result_df['traffic_source'] = result_df['traffic_category'].fillna('8. 其他')
@@ -278,6 +759,9 @@ class DataFetcher:
             
             return result_df
             
+        except BytesBudgetExceeded:
+            # 超出掃描量預算時中止報告，不以空白資料繼續
+            raise
         except Exception as e:
             print(f"⚠️  查詢流量分析時發生錯誤: {str(e)}")
             # 如果查詢失敗，返回空 DataFrame
@@ -299,6 +783,124 @@ class DataFetcher:
             # 如果查詢失敗，返回空 DataFrame
             return pd.DataFrame(columns=['traffic_source', 'sessions', 'conversions', 'cvr', 'aov', 'revenue'])
     
+    def _fetch_traffic_conversions_pushdown(self, purchases_query, orders_query, start_date, end_date, params):
+        """
+        在 BigQuery 端 JOIN GA4 購買事件與 Shopline 訂單，只取回各流量來源的彙總
+        
+        GA4 與訂單資料集位置不同時（BigQuery 無法跨位置查詢），需設定兩個暫存資料集：
+        - GA4_STAGING_DATASET：與 GA4 同位置，存放購買交易暫存表
+        - BIGQUERY_STAGING_DATASET：與訂單資料集同位置，接收跨區複製的暫存表
+        未設定時假設兩者位置相同，直接以單一查詢 JOIN
+        
+        Args:
+            purchases_query: GA4 購買交易查詢（transaction_id, traffic_category）
+            orders_query: Shopline 訂單查詢（ord_id, revenue, aov）
+            start_date: 開始日期（datetime.date）
+            end_date: 結束日期（datetime.date）
+            params: 兩個查詢共用的 QueryParams
+            
+        Returns:
+            DataFrame: traffic_category, conversions, revenue, aov
+        """
+        if self.bq_config.ga4_staging_dataset and self.bq_config.staging_dataset:
+            staged_table = self._stage_purchases(params.inline(purchases_query), start_date, end_date)
+            purchases_source = f"SELECT transaction_id, traffic_category FROM `{staged_table}`"
+        else:
+            purchases_source = purchases_query
+        
+        query = f"""
+        WITH purchases AS (
+            {purchases_source}
+        ),
+        orders AS (
+            {orders_query}
+        )
+        SELECT
+            p.traffic_category,
+            COUNT(p.transaction_id) as conversions,
+            SUM(o.revenue) as revenue,
+            AVG(o.aov) as aov
+        FROM purchases p
+        INNER JOIN orders o ON p.transaction_id = o.ord_id
+        GROUP BY p.traffic_category
+        """
+        
+        return self._query_dataframe(
+            query, params, 'fetch_traffic_analysis.pushdown', **TRAFFIC_DTYPES['traffic_agg']
+        )
+    
+    def _stage_purchases(self, purchases_query, start_date, end_date):
+        """
+        將 GA4 購買交易暫存並跨區複製到訂單資料集所在位置
+        
+        1. 在 GA4 位置以 CREATE TABLE AS 建立暫存表（1 天後自動過期）
+        2. 以複製作業（支援跨區）複製到訂單資料集位置的暫存資料集
+        
+        Args:
+            purchases_query: GA4 購買交易查詢（CREATE TABLE AS 不接受查詢參數，日期需已內嵌為字面值）
+            start_date: 開始日期（datetime.date）
+            end_date: 結束日期（datetime.date）
+            
+        Returns:
+            str: 訂單資料集位置的暫存表完整路徑
+        """
+        table_name = f"traffic_purchases_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}"
+        ga4_staging_table = self.bq_config.get_table_ref(table_name, dataset=self.bq_config.ga4_staging_dataset)
+        staging_table = self.bq_config.get_table_ref(table_name, dataset=self.bq_config.staging_dataset)
+        
+        create_query = f"""
+        CREATE OR REPLACE TABLE `{ga4_staging_table}`
+        OPTIONS (expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL 1 DAY))
+        AS {purchases_query}
+        """
+        
+        with self._query_slots:
+            self.bq_config.query(
+                create_query, location=self.bq_config.ga4_location, use_cache=False,
+                label='fetch_traffic_analysis.stage_purchases'
+            ).result()
+            self.bq_config.copy_table(ga4_staging_table, staging_table, expire_after=timedelta(days=1))
+        
+        return staging_table
+    
+    @staticmethod
+    def _join_purchases_locally(purchases_df, orders_df):
+        """
+        在 Python 中 JOIN GA4 購買交易與 Shopline 訂單並按流量來源聚合
+        
+        Args:
+            purchases_df: GA4 購買交易（transaction_id, traffic_category）
+            orders_df: Shopline 訂單（ord_id, revenue, aov）
+            
+        Returns:
+            DataFrame: traffic_category, conversions, revenue, aov（無匹配時為空 DataFrame）
+        """
+        if purchases_df.empty or orders_df.empty:
+            return pd.DataFrame(columns=['traffic_category', 'conversions', 'revenue', 'aov'])
+        
+        # JOIN purchases 和 orders
+        traffic_orders = purchases_df.merge(
+            orders_df,
+            left_on='transaction_id',
+            right_on='ord_id',
+            how='inner'
+        )
+        
+        if traffic_orders.empty:
+            return pd.DataFrame(columns=['traffic_category', 'conversions', 'revenue', 'aov'])
+        
+        # 按流量來源聚合
+        traffic_agg = traffic_orders.groupby('traffic_category', observed=True).agg({
+            'transaction_id': 'count',
+            'revenue': 'sum',
+            'aov': 'mean'
+        }).reset_index()
+        traffic_agg.columns = ['traffic_category', 'conversions', 'revenue', 'aov']
+        # 彙總後只剩十餘列，還原為一般字串欄位（categorical 無法填入未出現過的「其他」分類）
+        traffic_agg['traffic_category'] = traffic_agg['traffic_category'].astype(object)
+        return traffic_agg
+    
+    @profiled()
     def fetch_aov_analysis(self, start_date=None, end_date=None, dimension='overall'):
         """
         查詢平均訂單金額分析
@@ -314,8 +916,6 @@ class DataFetcher:
         if start_date is None or end_date is None:
             start_date, end_date = get_last_week_range()
         
-        # 使用 lv1_order 表（訂單明細）計算購物車件數
-        order_table = self.bq_config.get_table_ref(TABLES['lv1_order'])
         order_master_table = self.bq_config.get_table_ref(TABLES['lv1_order_master'])
         
         # 根據維度加入條件（需要判斷新客/回購客）
@@ -326,7 +926,53 @@ class DataFetcher:
         elif dimension == 'returning':
             dimension_join = "AND o.user_id NOT IN (SELECT user_id FROM (SELECT user_id, MIN(DATE(dt)) as first_order_date FROM `{order_master_table}` GROUP BY user_id) WHERE DATE(dt) = first_order_date)"
         
-        # 查詢購物車件數分布（從訂單明細計算每個訂單的件數）
+        item_distribution = self._fetch_item_distribution(start_date, end_date)
+        
+        # 查詢價格帶結構（從訂單主檔）
+        params = QueryParams()
+        query_price = f"""
+        SELECT
+            CASE 
+                WHEN ord_rev < 500 THEN '低價帶 (<500)'
+                WHEN ord_rev < 1500 THEN '中價帶 (500-1500)'
+                ELSE '高價帶 (≥1500)'
+            END as price_band,
+            COUNT(*) as order_count,
+            AVG(ord_rev) as avg_amount
+        FROM `{order_master_table}`
+        WHERE {partition_date_range(params, start_date, end_date)}
+            AND touch_class = 'ec'
+            AND bhv1 <> '取消'  -- 只計算成交訂單
+        GROUP BY price_band
+        ORDER BY 
+            CASE price_band
+                WHEN '低價帶 (<500)' THEN 1
+                WHEN '中價帶 (500-1500)' THEN 2
+                ELSE 3
+            END
+        """
+        
+        return {
+            'item_distribution': item_distribution,
+            'price_band_distribution': self._query_rows(query_price, params, 'fetch_aov_analysis'),
+        }
+    
+    @profiled('fetch_item_distribution')
+    def _fetch_item_distribution(self, start_date, end_date):
+        """
+        查詢購物車件數分布（從訂單明細計算每個訂單的件數）
+        
+        Args:
+            start_date: 開始日期（datetime.date）
+            end_date: 結束日期（datetime.date）
+            
+        Returns:
+            list: 各件數區間的訂單數與平均金額
+        """
+        # 使用 lv1_order 表（訂單明細）計算購物車件數
+        order_table = self.bq_config.get_table_ref(TABLES['lv1_order'])
+        params = QueryParams()
+        
         query_items = f"""
         WITH order_items AS (
             SELECT
@@ -334,7 +980,7 @@ class DataFetcher:
                 COUNT(*) as item_count,
                 SUM(ord_price * ord_qty) as order_total
             FROM `{order_table}`
-            WHERE DATE(dt) BETWEEN DATE('{start_date}') AND DATE('{end_date}')
+            WHERE {partition_date_range(params, start_date, end_date)}
                 AND touch_class = 'ec'
             GROUP BY ord_id
         )
@@ -358,38 +1004,9 @@ class DataFetcher:
             END
         """
         
-        df_items = self.bq_config.query(query_items).to_dataframe()
-        
-        # 查詢價格帶結構（從訂單主檔）
-        query_price = f"""
-        SELECT
-            CASE 
-                WHEN ord_rev < 500 THEN '低價帶 (<500)'
-                WHEN ord_rev < 1500 THEN '中價帶 (500-1500)'
-                ELSE '高價帶 (≥1500)'
-            END as price_band,
-            COUNT(*) as order_count,
-            AVG(ord_rev) as avg_amount
-        FROM `{order_master_table}`
-        WHERE DATE(dt) BETWEEN DATE('{start_date}') AND DATE('{end_date}')
-            AND touch_class = 'ec'
-            AND bhv1 <> '取消'  -- 只計算成交訂單
-        GROUP BY price_band
-        ORDER BY 
-            CASE price_band
-                WHEN '低價帶 (<500)' THEN 1
-                WHEN '中價帶 (500-1500)' THEN 2
-                ELSE 3
-            END
-        """
-        
-        df_price = self.bq_config.query(query_price).to_dataframe()
-        
-        return {
-            'item_distribution': df_items.to_dict('records') if not df_items.empty else [],
-            'price_band_distribution': df_price.to_dict('records') if not df_price.empty else [],
-        }
+        return self._query_rows(query_items, params, 'fetch_item_distribution')
     
+    @profiled()
     def fetch_conversion_funnel(self, start_date=None, end_date=None):
         """
         查詢轉換漏斗資料
@@ -407,29 +1024,33 @@ class DataFetcher:
         # 查詢 GA4 事件表
         ga4_table_ref = self.bq_config.get_ga4_table_ref('events_*')
         
-        # 計算日期範圍的字串格式（用於 _TABLE_SUFFIX）
-        date_suffixes = []
-        current_date = start_date
-        while current_date <= end_date:
-            date_suffixes.append(current_date.strftime('%Y%m%d'))
-            current_date += timedelta(days=1)
+        params = QueryParams()
         
-        # 查詢 GA4 漏斗事件
-        query = f"""
+        # sketch 模式且已物化每日彙總時，改從彙總表合併每日 HLL++ 草稿；
+        # 每日精確人數無法跨日相加，exact / approx 模式一律查詢事件表
+        materializer = None
+        if self.distinct_count_mode == 'sketch':
+            materializer = self._materializer_for(start_date, end_date)
+        mode = 'sketch' if materializer is not None else (
+            'exact' if self.distinct_count_mode == 'exact' else 'approx'
+        )
+        self.distinct_count_sources['funnel'] = mode
+        
+        step_columns = ",\n".join(
+            f"            {count_distinct_sql(f'CASE WHEN event_name = {event!r} THEN user_pseudo_id END', mode)} as {name}"
+            for name, event, _ in FUNNEL_STEPS
+        )
+        query = materializer.funnel_query(start_date, end_date, params) if materializer is not None else f"""
         SELECT
-            COUNT(DISTINCT CASE WHEN event_name = 'session_start' THEN user_pseudo_id END) as visitors,
-            COUNT(DISTINCT CASE WHEN event_name = 'view_item' THEN user_pseudo_id END) as view_item,
-            COUNT(DISTINCT CASE WHEN event_name = 'add_to_cart' THEN user_pseudo_id END) as add_to_cart,
-            COUNT(DISTINCT CASE WHEN event_name = 'begin_checkout' THEN user_pseudo_id END) as begin_checkout,
-            COUNT(DISTINCT CASE WHEN event_name = 'purchase' THEN user_pseudo_id END) as purchase
+{step_columns}
         FROM `{ga4_table_ref}`
-        WHERE _TABLE_SUFFIX IN ('{"','".join(date_suffixes)}')
+        WHERE {table_suffix_range(params, start_date, end_date)}
         """
         
         try:
-            result = self.bq_config.query(query).to_dataframe()
+            rows = self._query_rows(query, params, 'fetch_conversion_funnel')
             
-            if result.empty:
+            if not rows:
                 return {
                     'overall': {
                         'steps': [
@@ -444,10 +1065,12 @@ class DataFetcher:
                     'campaigns': [],
                 }
             
-            row = result.iloc[0]
+            row = rows[0]
             
             return {
                 'overall': {
+                    # approx / sketch 模式的不重複人數為近似值
+                    'approximate': mode != 'exact',
                     'steps': [
                         {'label': '訪客', 'count': int(row['visitors'] or 0)},
                         {'label': '商品瀏覽', 'count': int(row['view_item'] or 0)},
@@ -460,6 +1083,8 @@ class DataFetcher:
                 'campaigns': [],  # TODO: 實作活動分區漏斗
             }
             
+        except BytesBudgetExceeded:
+            raise
         except Exception as e:
             print(f"⚠️  查詢 GA4 漏斗資料時發生錯誤: {str(e)}")
             return {
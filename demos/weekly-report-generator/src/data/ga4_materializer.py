@@ -0,0 +1,286 @@
+"""
+GA4 每日彙總物化模組
+每天將最新的 events_YYYYMMDD 分片彙總為精簡的每日資料表，週報改從彙總表讀取，
+不必每次重新掃描 7 天的完整事件表
+
+物化資料表（位於 GA4_MATERIALIZED_DATASET，需與 GA4 資料集同位置）：
+- ga4_daily_traffic：每日 × 流量分類的 sessions 與漏斗各步驟的 HLL 草稿
+  （單日的精確不重複人數不能跨日相加，因此不保存；週 / 月人數由草稿合併）
+- ga4_daily_purchases：每日的購買交易（transaction_id, traffic_category），供與訂單 JOIN
+"""
+from datetime import datetime, timedelta, timezone
+
+from config.query_builder import QueryParams, date_range
+from src.utils.traffic_classifier import classify_traffic_source_sql
+
+
+# 物化資料表名稱
+DAILY_TRAFFIC_TABLE = 'ga4_daily_traffic'
+DAILY_PURCHASES_TABLE = 'ga4_daily_purchases'
+
+# 漏斗步驟：(欄位前綴, GA4 事件名稱, 顯示名稱)
+FUNNEL_STEPS = [
+    ('visitors', 'session_start', '訪客'),
+    ('view_item', 'view_item', '商品瀏覽'),
+    ('add_to_cart', 'add_to_cart', '加入購物車'),
+    ('begin_checkout', 'begin_checkout', '開始結帳'),
+    ('purchase', 'purchase', '完成購買'),
+]
+
+# 工作階段 ID（user_pseudo_id + ga_session_id）
+SESSION_KEY_SQL = """CONCAT(
+                user_pseudo_id,
+                '-',
+                COALESCE(
+                    CAST((SELECT value.int_value FROM UNNEST(event_params) WHERE key = 'ga_session_id') AS STRING),
+                    CAST((SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'session_id') AS STRING),
+                    ''
+                )
+            )"""
+
+TRANSACTION_ID_SQL = "(SELECT value.string_value FROM UNNEST(event_params) WHERE key = 'transaction_id')"
+
+
+def sessions_category_sql():
+    """工作階段的流量分類（traffic_source 可以直接存取 source 和 medium）"""
+    return classify_traffic_source_sql('traffic_source.source', 'traffic_source.medium')
+
+
+def purchases_category_sql():
+    """購買交易的流量分類（session_traffic_source_last_click 需要從 manual_campaign 或 cross_channel_campaign 取得）"""
+    return classify_traffic_source_sql(
+        'COALESCE(session_traffic_source_last_click.manual_campaign.source, session_traffic_source_last_click.cross_channel_campaign.source, "(direct)")',
+        'COALESCE(session_traffic_source_last_click.manual_campaign.medium, session_traffic_source_last_click.cross_channel_campaign.medium, "(none)")'
+    )
+
+
+class GA4DailyMaterializer:
+    """GA4 每日彙總物化器"""
+
+    def __init__(self, bq_config, dataset=None):
+        """
+        初始化物化器
+        
+        Args:
+            bq_config: BigQuery 配置物件
+            dataset: 物化資料集（預設使用 bq_config.ga4_materialized_dataset）
+        """
+        self.bq_config = bq_config
+        self.dataset = dataset or bq_config.ga4_materialized_dataset
+        if not self.dataset:
+            raise ValueError("未設定物化資料集，請設定 GA4_MATERIALIZED_DATASET 環境變數")
+        
+        self.traffic_table = bq_config.get_table_ref(DAILY_TRAFFIC_TABLE, dataset=self.dataset)
+        self.purchases_table = bq_config.get_table_ref(DAILY_PURCHASES_TABLE, dataset=self.dataset)
+
+    def _execute(self, query):
+        """在 GA4 位置執行 DDL / DML（不使用本機快取）"""
+        return self.bq_config.query(
+            query, location=self.bq_config.ga4_location, use_cache=False, label='ga4_materializer'
+        ).result()
+
+    def ensure_tables(self):
+        """建立物化資料表（已存在時略過）"""
+        step_columns = ',\n'.join(f"            {name}_sketch BYTES" for name, _, _ in FUNNEL_STEPS)
+        self._execute(f"""
+        CREATE TABLE IF NOT EXISTS `{self.traffic_table}` (
+            event_date DATE NOT NULL,
+            traffic_category STRING,
+            sessions INT64,
+{step_columns},
+            updated_at TIMESTAMP
+        )
+        PARTITION BY event_date
+        CLUSTER BY traffic_category
+        """)
+        self._execute(f"""
+        CREATE TABLE IF NOT EXISTS `{self.purchases_table}` (
+            event_date DATE NOT NULL,
+            transaction_id STRING,
+            traffic_category STRING
+        )
+        PARTITION BY event_date
+        """)
+
+    def list_shards(self):
+        """
+        列出 GA4 每日分片與最後修改時間（不含 events_intraday_*）
+        
+        Returns:
+            dict: {datetime.date: 最後修改時間（UTC datetime）}
+        """
+        meta_table = self.bq_config.get_table_ref('__TABLES__', dataset=self.bq_config.ga4_dataset)
+        df = self.bq_config.query(f"""
+        SELECT table_id, last_modified_time
+        FROM `{meta_table}`
+        WHERE REGEXP_CONTAINS(table_id, r'^events_[0-9]{{8}}$')
+        """, location=self.bq_config.ga4_location, use_cache=False,
+            label='ga4_materializer.list_shards').to_dataframe()
+        
+        return {
+            datetime.strptime(row['table_id'][len('events_'):], '%Y%m%d').date():
+                datetime.fromtimestamp(int(row['last_modified_time']) / 1000, tz=timezone.utc)
+            for row in df.to_dict('records')
+        }
+
+    def materialized_dates(self, start_date=None, end_date=None):
+        """
+        查詢已物化的日期與物化時間
+        
+        Args:
+            start_date: 開始日期（可選）
+            end_date: 結束日期（可選）
+        
+        Returns:
+            dict: {datetime.date: 物化時間（UTC datetime）}
+        """
+        params = QueryParams()
+        conditions = []
+        if start_date is not None:
+            conditions.append(f"event_date >= {params.add('start_date', start_date)}")
+        if end_date is not None:
+            conditions.append(f"event_date <= {params.add('end_date', end_date)}")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        df = self.bq_config.query(f"""
+        SELECT event_date, MIN(updated_at) as updated_at
+        FROM `{self.traffic_table}`
+        {where}
+        GROUP BY event_date
+        """, location=self.bq_config.ga4_location, use_cache=False,
+            query_parameters=params.to_bigquery(), label='ga4_materializer.materialized_dates').to_dataframe()
+        
+        result = {}
+        for row in df.to_dict('records'):
+            event_date = row['event_date']
+            if hasattr(event_date, 'date'):
+                event_date = event_date.date()
+            updated_at = row['updated_at']
+            if hasattr(updated_at, 'to_pydatetime'):
+                updated_at = updated_at.to_pydatetime()
+            if updated_at is not None and updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            result[event_date] = updated_at
+        return result
+
+    def is_complete(self, start_date, end_date):
+        """
+        檢查日期區間是否都已物化
+        
+        Args:
+            start_date: 開始日期
+            end_date: 結束日期
+        
+        Returns:
+            bool: 區間內每一天都已物化時為 True
+        """
+        days = (end_date - start_date).days + 1
+        return len(self.materialized_dates(start_date, end_date)) >= days
+
+    def pending_dates(self, since=None):
+        """
+        找出需要（重新）物化的分片日期：尚未物化，或分片在上次物化後又被更新（GA4 會回補最多 72 小時）
+        
+        Args:
+            since: 只檢查此日期（含）之後的分片（預設最近 30 天）
+        
+        Returns:
+            list: 需要物化的日期（由舊到新）
+        """
+        if since is None:
+            since = datetime.now(timezone.utc).date() - timedelta(days=30)
+        
+        shards = {d: modified for d, modified in self.list_shards().items() if d >= since}
+        materialized = self.materialized_dates(start_date=since)
+        
+        return sorted(
+            d for d, modified in shards.items()
+            if d not in materialized or materialized[d] is None or modified > materialized[d]
+        )
+
+    def materialize(self, event_date):
+        """
+        物化單一日期：在同一個交易中刪除該日舊資料並重新寫入
+        
+        Args:
+            event_date: 要物化的日期（datetime.date）
+        """
+        ga4_table_ref = self.bq_config.get_ga4_table_ref('events_*')
+        suffix = event_date.strftime('%Y%m%d')
+        date_literal = f"DATE('{event_date.isoformat()}')"
+        event_names = ', '.join(f"'{event}'" for _, event, _ in FUNNEL_STEPS)
+        
+        step_columns = ',\n'.join(
+            f"            HLL_COUNT.INIT(IF(event_name = '{event}', user_pseudo_id, NULL)) as {name}_sketch"
+            for name, event, _ in FUNNEL_STEPS
+        )
+        # 指定寫入欄位：舊版建立、仍有 *_users 欄位的資料表也能寫入（該欄位留空）
+        insert_columns = ', '.join(
+            ['event_date', 'traffic_category', 'sessions']
+            + [f'{name}_sketch' for name, _, _ in FUNNEL_STEPS]
+            + ['updated_at']
+        )
+        
+        self._execute(f"""
+        BEGIN TRANSACTION;
+        
+        DELETE FROM `{self.traffic_table}` WHERE event_date = {date_literal};
+        INSERT INTO `{self.traffic_table}` ({insert_columns})
+        SELECT
+            {date_literal} as event_date,
+            {sessions_category_sql()} as traffic_category,
+            COUNT(DISTINCT IF(event_name = 'session_start', {SESSION_KEY_SQL}, NULL)) as sessions,
+{step_columns},
+            CURRENT_TIMESTAMP() as updated_at
+        FROM `{ga4_table_ref}`
+        WHERE _TABLE_SUFFIX = '{suffix}'
+            AND event_name IN ({event_names})
+        GROUP BY traffic_category;
+        
+        DELETE FROM `{self.purchases_table}` WHERE event_date = {date_literal};
+        INSERT INTO `{self.purchases_table}`
+        SELECT DISTINCT
+            {date_literal} as event_date,
+            {TRANSACTION_ID_SQL} as transaction_id,
+            {purchases_category_sql()} as traffic_category
+        FROM `{ga4_table_ref}`
+        WHERE _TABLE_SUFFIX = '{suffix}'
+            AND event_name = 'purchase'
+            AND {TRANSACTION_ID_SQL} IS NOT NULL;
+        
+        COMMIT TRANSACTION;
+        """)
+
+    def sessions_query(self, start_date, end_date, params):
+        """讀取物化資料的各流量分類 sessions（格式同 fetch_traffic_analysis 的 sessions 查詢，日期參數登記於 params）"""
+        return f"""
+        SELECT traffic_category, SUM(sessions) as sessions
+        FROM `{self.traffic_table}`
+        WHERE {date_range(params, 'event_date', start_date, end_date)}
+        GROUP BY traffic_category
+        """
+
+    def purchases_query(self, start_date, end_date, params):
+        """讀取物化資料的購買交易（格式同 fetch_traffic_analysis 的 purchases 查詢，日期參數登記於 params）"""
+        return f"""
+        SELECT DISTINCT transaction_id, traffic_category
+        FROM `{self.purchases_table}`
+        WHERE {date_range(params, 'event_date', start_date, end_date)}
+        """
+
+    def funnel_query(self, start_date, end_date, params):
+        """
+        讀取物化資料的漏斗人數（日期參數登記於 params）
+        
+        每日不重複人數不可直接相加，跨日以 HLL_COUNT.MERGE 合併草稿（近似值，誤差約 0.5%）
+        """
+        step_columns = ',\n'.join(
+            f"            HLL_COUNT.MERGE({name}_sketch) as {name}"
+            for name, _, _ in FUNNEL_STEPS
+        )
+        return f"""
+        SELECT
+{step_columns}
+        FROM `{self.traffic_table}`
+        WHERE {date_range(params, 'event_date', start_date, end_date)}
+        """
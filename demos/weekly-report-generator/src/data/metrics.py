@@ -0,0 +1,112 @@
+"""
+向量化指標計算模組
+以 NumPy / pandas 欄位運算取代逐列 apply，供 DataProcessor 與 DataFetcher 共用
+"""
+import numpy as np
+import pandas as pd
+
+
+def _as_float_array(values):
+    """轉為 float64 陣列（可為空的 Int64 / Float64 欄位中的 NA 轉為 NaN）"""
+    if isinstance(values, pd.Series):
+        return values.to_numpy(dtype='float64', na_value=np.nan)
+    return np.asarray(values, dtype='float64')
+
+
+def safe_ratio(numerator, denominator, scale=1.0, decimals=2):
+    """
+    計算比率（分母為 0、負數或空值時結果為 0）
+    
+    Args:
+        numerator: 分子（Series / array）
+        denominator: 分母（Series / array）
+        scale: 倍率（例如百分比為 100）
+        decimals: 小數位數
+    
+    Returns:
+        ndarray: 比率
+    """
+    numerator = _as_float_array(numerator)
+    denominator = _as_float_array(denominator)
+    ratio = np.divide(
+        numerator * scale,
+        denominator,
+        out=np.zeros(np.broadcast(numerator, denominator).shape, dtype='float64'),
+        where=denominator > 0,
+    )
+    return np.round(ratio, decimals)
+
+
+def cvr(conversions, sessions, decimals=2):
+    """
+    計算轉換率（百分比，與 DataProcessor.calculate_cvr 相同規則）
+    
+    Args:
+        conversions: 轉換數
+        sessions: 工作階段數
+        decimals: 小數位數
+    
+    Returns:
+        ndarray: 轉換率（百分比）
+    """
+    return safe_ratio(conversions, sessions, scale=100.0, decimals=decimals)
+
+
+def aov(revenue, orders, decimals=2):
+    """
+    計算平均訂單金額（與 DataProcessor.calculate_aov 相同規則）
+    
+    Args:
+        revenue: 總營收
+        orders: 訂單數
+    
+    Returns:
+        ndarray: 平均訂單金額
+    """
+    return safe_ratio(revenue, orders, decimals=decimals)
+
+
+def map_categories(series, mapper, default=None):
+    """
+    將欄位值對應到分類（先轉為 categorical，只對不重複的值執行對應）
+    
+    Args:
+        series: 原始欄位值
+        mapper: dict 或函式（值 -> 分類）
+        default: 對應不到或空值時使用的分類
+    
+    Returns:
+        Series: 分類結果（index 與輸入相同）
+    """
+    categorical = series.astype('category')
+    categories = categorical.cat.categories.to_series()
+    
+    mapped = categories.map(mapper)
+    if default is not None:
+        mapped = mapped.fillna(default)
+    
+    # 以 categorical 編碼查表還原成每一列的分類（編碼 -1 為空值）
+    codes = categorical.cat.codes.to_numpy()
+    values = np.full(len(codes), default, dtype=object)
+    if len(mapped):
+        valid = codes >= 0
+        values[valid] = mapped.to_numpy(dtype=object)[codes[valid]]
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+def add_rate_columns(df, sessions='sessions', conversions='conversions', revenue='revenue'):
+    """
+    為聚合後的流量資料加上 cvr、aov 欄位
+    
+    Args:
+        df: 包含 sessions、conversions、revenue 欄位的 DataFrame
+        sessions: 工作階段數欄位名稱
+        conversions: 轉換數欄位名稱
+        revenue: 營收欄位名稱
+    
+    Returns:
+        DataFrame: 原 DataFrame（已新增 cvr、aov 欄位）
+    """
+    df['cvr'] = cvr(df[conversions], df[sessions])
+    df['aov'] = aov(df[revenue], df[conversions])
+    return df
@@ -5,6 +5,13 @@
 import pandas as pd
 from datetime import datetime, timedelta
 
+from config.traffic_rules import DEFAULT_TRAFFIC_LABEL, traffic_channel_mapping
+from src.data import metrics
+
+
+# 流量來源對應規則（last_touch_channel -> 8 種分類，由 config/traffic_rules.py 產生）
+TRAFFIC_CHANNEL_MAPPING = traffic_channel_mapping()
+
 
 class DataProcessor:
     """資料處理器"""
@@ -95,46 +102,7 @@ class DataProcessor:
         Returns:
             str: 對應的分類名稱
         """
-        # 流量來源對應規則
-        mapping = {
-            # 直接流量
-            'Direct': '直接流量',
-            'direct': '直接流量',
-            
-            # 付費廣告
-            'Paid Search': '付費廣告',
-            'Paid Social': '付費廣告',
-            'Display': '付費廣告',
-            'paid_search': '付費廣告',
-            'cpc': '付費廣告',
-            
-            # 自然搜尋
-            'Organic Search': '自然搜尋',
-            'organic': '自然搜尋',
-            'organic_search': '自然搜尋',
-            
-            # 社群經營
-            'Social': '社群經營',
-            'social': '社群經營',
-            'facebook': '社群經營',
-            'instagram': '社群經營',
-            'line': '社群經營',
-            
-            # 參照連結
-            'Referral': '參照連結',
-            'referral': '參照連結',
-            
-            # 會員經營（Email）
-            'Email': '會員經營',
-            'email': '會員經營',
-            'mail': '會員經營',
-            
-            # AI 來源（需要根據實際情況調整）
-            'AI': 'AI 來源',
-            'ai': 'AI 來源',
-        }
-        
-        return mapping.get(channel, '其他')
+        return TRAFFIC_CHANNEL_MAPPING.get(channel, DEFAULT_TRAFFIC_LABEL)
     
     @staticmethod
     def aggregate_traffic_by_category(df):
@@ -150,9 +118,9 @@ class DataProcessor:
         if df.empty:
             return df
         
-        # 應用分類對應
-        df['category'] = df['traffic_source'].apply(
-            DataProcessor.categorize_traffic_source
+        # 應用分類對應（categorical 只對不重複的來源值查表）
+        df['category'] = metrics.map_categories(
+            df['traffic_source'], TRAFFIC_CHANNEL_MAPPING, default=DEFAULT_TRAFFIC_LABEL
         )
         
         # 按分類聚合
@@ -162,16 +130,8 @@ class DataProcessor:
             'revenue': 'sum',
         }).reset_index()
         
-        # 計算衍生指標
-        aggregated['cvr'] = aggregated.apply(
-            lambda row: DataProcessor.calculate_cvr(row['sessions'], row['conversions']),
-            axis=1
-        )
-        
-        aggregated['aov'] = aggregated.apply(
-            lambda row: DataProcessor.calculate_aov(row['revenue'], row['conversions']),
-            axis=1
-        )
+        # 計算衍生指標（向量化）
+        metrics.add_rate_columns(aggregated)
         
         # 重新命名欄位
         aggregated.rename(columns={'category': 'traffic_source'}, inplace=True)
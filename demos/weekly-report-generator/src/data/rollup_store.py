@@ -0,0 +1,397 @@
+"""
+每日彙總（rollup）本機儲存
+以 SQLite 檔案保存每天的訂單指標、價格帶與購物車件數分布，週報直接加總已存的每日資料，
+不必每次從訂單主檔與訂單明細重新計算
+
+每日報表（daily-report-mvp）與週報（weekly-report-generator）共用同一個檔案（ROLLUP_DB_PATH），
+兩邊各有一份相同的模組；加總只使用可跨日相加的指標。交易會員數不可跨日加總，另存每日的 HLL++ 草稿，
+週報在 DISTINCT_COUNT_MODE=sketch 時交由 BigQuery 合併（HLL_COUNT.MERGE），其他模式仍查詢訂單主檔
+
+訂單數（completed_orders、cancelled_orders）是每日的 COUNT(DISTINCT ord_id)，同一訂單在多個 dt 都有資料列時
+各日都會計入，因此只保存單日的值、不提供跨日加總；週報的訂單數一律向訂單主檔精確查詢
+"""
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+from config.bigquery import TABLES
+from config.query_builder import QueryParams, partition_date_range
+
+
+# 價格帶定義：(顯示名稱, 欄位別名, SQL 條件)
+PRICE_BANDS = [
+    ('低價帶 (<500)', 'low_band', 'ord_rev < 500'),
+    ('中價帶 (500-1500)', 'mid_band', 'ord_rev >= 500 AND ord_rev < 1500'),
+    ('高價帶 (≥1500)', 'high_band', '(ord_rev >= 1500 OR ord_rev IS NULL)'),
+]
+
+# 購物車件數分組（依顯示順序）
+ITEM_BUCKETS = ['1件', '2件', '3件', '4件以上']
+
+# 每日訂單指標欄位
+ORDER_COLUMNS = [
+    'net_revenue',
+    'gross_revenue',
+    'completed_orders',
+    'total_orders',
+    'cancelled_orders',
+    'cancelled_revenue',
+] + [
+    f'{alias}_{suffix}'
+    for _, alias, _ in PRICE_BANDS
+    for suffix in ('orders', 'revenue', 'amount_count')
+]
+
+# 每日不重複訂單數（不可跨日加總，sum_orders 不返回）
+DISTINCT_ORDER_COLUMNS = ['completed_orders', 'cancelled_orders']
+
+# 可跨日加總的訂單指標欄位
+ADDITIVE_ORDER_COLUMNS = [column for column in ORDER_COLUMNS if column not in DISTINCT_ORDER_COLUMNS]
+
+
+def rollup_scope(bq_config):
+    """
+    取得資料範圍鍵（專案 + 電商資料集），不同客戶的資料互不混用
+    
+    Args:
+        bq_config: BigQuery 配置物件
+    
+    Returns:
+        str: 範圍鍵
+    """
+    return f"{bq_config.project_id}.{bq_config.dataset_id}"
+
+
+def day_rollup_queries(order_master_table, order_table, start_date, end_date, params):
+    """
+    產生按日彙總的查詢（訂單主檔、訂單明細）
+    
+    Args:
+        order_master_table: lv1_order_master 完整路徑
+        order_table: lv1_order 完整路徑
+        start_date: 開始日期
+        end_date: 結束日期
+        params: QueryParams（日期參數登記於此）
+    
+    Returns:
+        tuple: (訂單指標查詢, 購物車件數分布查詢)
+    """
+    date_filter = partition_date_range(params, start_date, end_date)
+    band_columns = ",\n".join(
+        f"""            COUNTIF(bhv1 <> '取消' AND {condition}) as {alias}_orders,
+            SUM(IF(bhv1 <> '取消' AND {condition}, ord_rev, 0)) as {alias}_revenue,
+            COUNTIF(bhv1 <> '取消' AND {condition} AND ord_rev IS NOT NULL) as {alias}_amount_count"""
+        for _, alias, condition in PRICE_BANDS
+    )
+    
+    orders_query = f"""
+        SELECT
+            DATE(dt) as day,
+            SUM(ord_rev) as net_revenue,
+            SUM(CASE WHEN bhv1 <> '取消' THEN ord_rev ELSE 0 END) as gross_revenue,
+            COUNT(DISTINCT ord_id) as completed_orders,
+            SUM(CASE WHEN bhv1 <> '取消' THEN 1 ELSE 0 END) as total_orders,
+            COUNT(DISTINCT CASE WHEN bhv1 = '取消' THEN ord_id END) as cancelled_orders,
+            SUM(CASE WHEN bhv1 = '取消' THEN ord_rev ELSE 0 END) as cancelled_revenue,
+{band_columns},
+            HLL_COUNT.INIT(user_id) as user_sketch
+        FROM `{order_master_table}`
+        WHERE {date_filter}
+            AND touch_class = 'ec'
+        GROUP BY day
+        """
+    
+    items_query = f"""
+        WITH order_items AS (
+            SELECT
+                DATE(dt) as day,
+                ord_id,
+                COUNT(*) as item_count,
+                SUM(ord_price * ord_qty) as order_total
+            FROM `{order_table}`
+            WHERE {date_filter}
+                AND touch_class = 'ec'
+            GROUP BY day, ord_id
+        )
+        SELECT
+            day,
+            CASE
+                WHEN item_count = 1 THEN '1件'
+                WHEN item_count = 2 THEN '2件'
+                WHEN item_count = 3 THEN '3件'
+                ELSE '4件以上'
+            END as item_bucket,
+            COUNT(*) as order_count,
+            SUM(order_total) as total_amount,
+            COUNT(order_total) as amount_count
+        FROM order_items
+        GROUP BY day, item_bucket
+        """
+    
+    return orders_query, items_query
+
+
+def _as_date(value):
+    """將查詢結果中的日期欄位（date / Timestamp / 字串）轉為 date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+class RollupStore:
+    """每日彙總 SQLite 儲存（每次操作使用獨立連線，可跨執行緒使用）"""
+
+    def __init__(self, path):
+        """
+        初始化儲存
+        
+        Args:
+            path: SQLite 檔案路徑
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            order_columns = ',\n'.join(f'                {column} REAL NOT NULL DEFAULT 0' for column in ORDER_COLUMNS)
+            conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS order_days (
+                scope TEXT NOT NULL,
+                day TEXT NOT NULL,
+{order_columns},
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (scope, day)
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS item_days (
+                scope TEXT NOT NULL,
+                day TEXT NOT NULL,
+                item_bucket TEXT NOT NULL,
+                order_count REAL NOT NULL DEFAULT 0,
+                total_amount REAL NOT NULL DEFAULT 0,
+                amount_count REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (scope, day, item_bucket)
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_sketches (
+                scope TEXT NOT NULL,
+                day TEXT NOT NULL,
+                sketch BLOB NOT NULL,
+                PRIMARY KEY (scope, day)
+            )
+            """)
+
+    @classmethod
+    def from_env(cls):
+        """
+        依環境變數建立儲存（未設定 ROLLUP_DB_PATH 時停用）
+        
+        Returns:
+            RollupStore: 儲存實例，停用時返回 None
+        """
+        path = os.getenv('ROLLUP_DB_PATH')
+        if not path:
+            return None
+        return cls(path)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def refresh(self, bq_config, start_date, end_date, query=None, use_cache=True):
+        """
+        從 BigQuery 計算日期區間的每日彙總並寫入（覆寫已存在的日期）
+        
+        Args:
+            bq_config: BigQuery 配置物件（需提供 get_table_ref）
+            start_date: 開始日期
+            end_date: 結束日期
+            query: 執行查詢並返回資料列清單（[{欄位: 值}]）的函式 query(sql, params)（預設使用 bq_config.query_rows）
+            use_cache: 預設查詢是否使用本機查詢快取（回補重新彙總時設為 False）
+        
+        Returns:
+            int: 寫入的天數
+        """
+        if query is None:
+            query = lambda sql, params: bq_config.query_rows(
+                sql, query_parameters=params.to_bigquery(), label='rollup_refresh', use_cache=use_cache
+            )
+        
+        params = QueryParams()
+        orders_query, items_query = day_rollup_queries(
+            bq_config.get_table_ref(TABLES['lv1_order_master']),
+            bq_config.get_table_ref(TABLES['lv1_order']),
+            start_date,
+            end_date,
+            params,
+        )
+        order_rows = query(orders_query, params)
+        item_rows = query(items_query, params)
+        
+        # 沒有訂單的日期也寫入一列 0，表示該日已彙總
+        days = {}
+        current = start_date
+        while current <= end_date:
+            days[current] = {column: 0 for column in ORDER_COLUMNS}
+            current += timedelta(days=1)
+        sketches = {}
+        for row in order_rows:
+            day = _as_date(row['day'])
+            days[day] = {column: float(row.get(column) or 0) for column in ORDER_COLUMNS}
+            if row.get('user_sketch') is not None:
+                sketches[day] = bytes(row['user_sketch'])
+        
+        items = [
+            (
+                _as_date(row['day']).isoformat(),
+                row['item_bucket'],
+                float(row.get('order_count') or 0),
+                float(row.get('total_amount') or 0),
+                float(row.get('amount_count') or 0),
+            )
+            for row in item_rows
+        ]
+        
+        self.write(rollup_scope(bq_config), days, items, sketches)
+        return len(days)
+
+    def write(self, scope, days, items, sketches=None):
+        """
+        寫入每日彙總（同一交易中覆寫這些日期的訂單指標與件數分布）
+        
+        Args:
+            scope: 範圍鍵
+            days: {date: {欄位: 值}}
+            items: [(日期字串, 件數分組, 訂單數, 金額合計, 有金額的訂單數)]
+            sketches: {date: 交易會員 HLL++ 草稿}（可選；沒有訂單的日期沒有草稿）
+        """
+        sketches = sketches or {}
+        updated_at = datetime.now(timezone.utc).isoformat()
+        placeholders = ', '.join('?' for _ in ORDER_COLUMNS)
+        
+        with self._lock, self._connect() as conn:
+            for day, values in days.items():
+                conn.execute("DELETE FROM item_days WHERE scope = ? AND day = ?", (scope, day.isoformat()))
+                conn.execute("DELETE FROM user_sketches WHERE scope = ? AND day = ?", (scope, day.isoformat()))
+                conn.execute(
+                    f"INSERT OR REPLACE INTO order_days (scope, day, {', '.join(ORDER_COLUMNS)}, updated_at) "
+                    f"VALUES (?, ?, {placeholders}, ?)",
+                    (scope, day.isoformat(), *[values[column] for column in ORDER_COLUMNS], updated_at),
+                )
+            conn.executemany(
+                "INSERT OR REPLACE INTO item_days (scope, day, item_bucket, order_count, total_amount, amount_count) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(scope, *item) for item in items],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO user_sketches (scope, day, sketch) VALUES (?, ?, ?)",
+                [(scope, day.isoformat(), sqlite3.Binary(sketch)) for day, sketch in sketches.items()],
+            )
+
+    def available_days(self, scope, start_date, end_date, settle_days=0):
+        """
+        查詢日期區間內已彙總的日期
+        
+        Args:
+            scope: 範圍鍵
+            start_date: 開始日期
+            end_date: 結束日期
+            settle_days: 只計入在該日結束後至少幾天才寫入的資料（取消、退貨會在之後回寫訂單主檔）
+        
+        Returns:
+            set: 已彙總的日期
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT day FROM order_days WHERE scope = ? AND day BETWEEN ? AND ? "
+                "AND substr(updated_at, 1, 10) > date(day, ?)",
+                (scope, start_date.isoformat(), end_date.isoformat(), f'+{int(settle_days)} days'),
+            ).fetchall()
+        return {date.fromisoformat(day) for (day,) in rows}
+    
+    def missing_days(self, scope, start_date, end_date, settle_days=0):
+        """
+        查詢日期區間內尚未彙總（或資料尚未穩定）的日期
+        
+        Args:
+            scope: 範圍鍵
+            start_date: 開始日期
+            end_date: 結束日期
+            settle_days: 同 available_days
+        
+        Returns:
+            list: 需要重新彙總的日期（由舊到新）
+        """
+        available = self.available_days(scope, start_date, end_date, settle_days=settle_days)
+        days = []
+        current = start_date
+        while current <= end_date:
+            if current not in available:
+                days.append(current)
+            current += timedelta(days=1)
+        return days
+    
+    def sum_orders(self, scope, start_date, end_date):
+        """
+        加總日期區間的訂單指標（不含不可跨日加總的 DISTINCT_ORDER_COLUMNS）
+        
+        Returns:
+            dict: {欄位: 合計}（ADDITIVE_ORDER_COLUMNS）
+        """
+        sums = ', '.join(f'COALESCE(SUM({column}), 0)' for column in ADDITIVE_ORDER_COLUMNS)
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {sums} FROM order_days WHERE scope = ? AND day BETWEEN ? AND ?",
+                (scope, start_date.isoformat(), end_date.isoformat()),
+            ).fetchone()
+        return dict(zip(ADDITIVE_ORDER_COLUMNS, row))
+
+    def sum_items(self, scope, start_date, end_date):
+        """
+        加總日期區間的購物車件數分布
+        
+        Returns:
+            dict: {件數分組: (訂單數, 金額合計, 有金額的訂單數)}
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT item_bucket, SUM(order_count), SUM(total_amount), SUM(amount_count) "
+                "FROM item_days WHERE scope = ? AND day BETWEEN ? AND ? GROUP BY item_bucket",
+                (scope, start_date.isoformat(), end_date.isoformat()),
+            ).fetchall()
+        return {bucket: (order_count, total_amount, amount_count) for bucket, order_count, total_amount, amount_count in rows}
+    
+    def load_sketches(self, scope, start_date, end_date):
+        """
+        讀取日期區間的每日交易會員 HLL++ 草稿
+        
+        Returns:
+            list: 草稿（bytes），沒有訂單的日期不含草稿
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT sketch FROM user_sketches WHERE scope = ? AND day BETWEEN ? AND ? ORDER BY day",
+                (scope, start_date.isoformat(), end_date.isoformat()),
+            ).fetchall()
+        return [bytes(sketch) for (sketch,) in rows]
+    
+    def missing_sketch_days(self, scope, start_date, end_date):
+        """
+        查詢有訂單但沒有交易會員草稿的日期（例如在保存草稿之前寫入的舊資料）
+        
+        Returns:
+            list: 缺少草稿的日期（由舊到新）
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT o.day FROM order_days o "
+                "LEFT JOIN user_sketches s ON s.scope = o.scope AND s.day = o.day "
+                "WHERE o.scope = ? AND o.day BETWEEN ? AND ? AND o.completed_orders > 0 AND s.day IS NULL "
+                "ORDER BY o.day",
+                (scope, start_date.isoformat(), end_date.isoformat()),
+            ).fetchall()
+        return [date.fromisoformat(day) for (day,) in rows]
@@ -2,6 +2,7 @@
 週報生成器主程式
 整合所有模組，生成完整的 HTML 週報
 """
+import argparse
 import os
 import sys
 from datetime import datetime
@@ -13,12 +14,60 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from src.data import DataFetcher
 from src.charts import ChartGenerator
 from src.reports import ReportBuilder
+from src.reports.sections import REPORT_SECTIONS, SECTION_NAMES, section_parts
+from config.profiling import profiler, span
 
 load_dotenv()
 
 
+def parse_args():
+    """解析命令列參數"""
+    parser = argparse.ArgumentParser(description='電商週報生成器')
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='執行結束時輸出各階段（查詢、圖表、報告）的耗時摘要表'
+    )
+    parser.add_argument(
+        '--profile-log',
+        type=str,
+        default=os.getenv('PROFILE_LOG'),
+        help='將每個階段的 JSON 計時記錄寫入指定檔案（JSON Lines，預設讀取 PROFILE_LOG）'
+    )
+    parser.add_argument(
+        '--refresh',
+        nargs='+',
+        choices=SECTION_NAMES + ['all'],
+        default=[],
+        help='忽略區塊資料快取，重新查詢指定的報告區塊（all 為全部）'
+    )
+    return parser.parse_args()
+
+
 def main():
     """主程式入口"""
+    args = parse_args()
+    profiler.configure(args.profile_log)
+    
+    try:
+        with span('weekly_report'):
+            generate_report(refresh=args.refresh)
+    finally:
+        if args.profile:
+            print()
+            profiler.print_summary()
+
+
+def generate_report(refresh=()):
+    """
+    查詢資料、生成圖表並組合 HTML 週報
+    
+    報告的五個區塊（GMV、關鍵摘要、流量、AOV、漏斗）分別快取：重跑時只重新查詢過期或上次失敗的區塊，
+    單一區塊查詢失敗不會中止整份報告（該區塊顯示提示訊息，下次執行時重新查詢）
+    
+    Args:
+        refresh: 忽略快取、強制重新查詢的區塊（包含 'all' 時全部重新查詢）
+    """
     print("=" * 60)
     print("電商週報生成器 - 開始執行")
     print("=" * 60)
@@ -40,77 +89,104 @@ def main():
     print(f"   - 品牌名稱：{brand_name}")
     print(f"   - 查詢時間：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
+    section_titles = {section: title for section, title, _, _, _ in REPORT_SECTIONS}
+    
     # 1. 查詢資料
     print(f"\n🔍 步驟 1/4：查詢 BigQuery 資料...")
     
-    try:
-        # GMV 基本指標（上週週一到週日）
-        print("   - 查詢 GMV 基本指標...")
-        gmv_metrics = fetcher.fetch_gmv_metrics(report_monday, report_sunday)
-        
-        # 本週關鍵摘要（上週與上上週比較）
-        print("   - 查詢上週關鍵摘要...")
-        weekly_comparison = fetcher.fetch_weekly_comparison()
-        
-        # 流量分析（上週週一到週日）
-        print("   - 查詢流量分析...")
-        traffic_df = fetcher.fetch_traffic_analysis(report_monday, report_sunday)
-        
-        # AOV 分析（上週週一到週日）
-        print("   - 查詢 AOV 分析...")
-        aov_data = fetcher.fetch_aov_analysis(report_monday, report_sunday, dimension='overall')
-        
-        # 轉換漏斗（上週週一到週日）
-        print("   - 查詢轉換漏斗...")
-        funnel_data = fetcher.fetch_conversion_funnel(report_monday, report_sunday)
+    # 區塊資料快取的範圍：同一品牌、觀察週、資料集與計數模式的資料才可重用
+    scope = {
+        'brand_name': brand_name,
+        'start_date': report_monday,
+        'end_date': report_sunday,
+        'project_id': fetcher.bq_config.project_id,
+        'dataset_id': fetcher.bq_config.dataset_id,
+        'distinct_count_mode': fetcher.distinct_count_mode,
+    }
+    cached_sections = report_builder.load_sections(scope, refresh=refresh)
+    stale_sections = [section for section in SECTION_NAMES if section not in cached_sections]
+    if cached_sections:
+        print(f"   🗄️  沿用快取的區塊資料：" + '、'.join(section_titles[section] for section in cached_sections))
+    
+    report_data = {}
+    fetch_errors = {}
+    if stale_sections:
+        # GMV、關鍵摘要、AOV 共用報告計畫查詢；流量分析、轉換漏斗各自查詢（並行）
+        parts = section_parts(stale_sections)
+        print(f"   - 並行查詢 " + '、'.join(section_titles[section] for section in stale_sections)
+              + f"（同時最多 {fetcher.max_in_flight} 個查詢）...")
+        report_data = fetcher.fetch_report_data(report_monday, report_sunday, parts=parts, errors=fetch_errors)
+        for part, error in fetch_errors.items():
+            print(f"   ❌ 資料查詢失敗（{part}）：{str(error)}")
         
-        print("   ✅ 資料查詢完成")
+        # 同一查詢涵蓋的區塊一併更新快取（例如只有 GMV 過期時，關鍵摘要與 AOV 也取得最新資料）
+        report_builder.save_sections(scope, report_data, [
+            section for section, _, _, _, part in REPORT_SECTIONS if part in parts and part not in fetch_errors
+        ])
         
-    except Exception as e:
-        print(f"   ❌ 資料查詢失敗：{str(e)}")
+        cache = fetcher.bq_config.cache
+        if cache is not None:
+            cache_stats = cache.stats()
+            print(f"   🗄️  查詢快取：命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次")
+        fetcher.bq_config.cost_tracker.print_summary()
+    
+    # 本次查詢的結果優先，其餘區塊使用快取的資料
+    distinct_counts = {}
+    for entry in cached_sections.values():
+        for key, value in entry['data'].items():
+            report_data.setdefault(key, value)
+        distinct_counts.update(entry['metadata'].get('distinct_counts', {}))
+    distinct_counts.update(report_data.get('metadata', {}).get('distinct_counts', {}))
+    report_data['metadata'] = {'distinct_count_mode': fetcher.distinct_count_mode, 'distinct_counts': distinct_counts}
+    
+    failed_sections = {
+        section for section, _, _, _, part in REPORT_SECTIONS
+        if section in stale_sections and part in fetch_errors
+    }
+    if len(failed_sections) == len(SECTION_NAMES):
+        print(f"   ❌ 所有區塊的資料查詢都失敗，停止產生報告")
         return
     
+    print(f"   ✅ 資料查詢完成" + (f"（{len(failed_sections)} 個區塊失敗，下次執行時重新查詢）" if failed_sections else ""))
+    print(f"   🔢 不重複計數模式：{fetcher.distinct_count_mode}（"
+          + '、'.join(f"{name}={mode}" for name, mode in distinct_counts.items()) + "）")
+    
     # 2. 生成圖表
     print(f"\n📈 步驟 2/4：生成 PyEcharts 圖表...")
     
-    charts = {}
+    # 關鍵摘要、流量來源、AOV 分布、轉換漏斗圖表互相獨立，同時產生（略過沒有資料的區塊）
+    chart_keys = [
+        chart_key for section, _, _, chart_key, _ in REPORT_SECTIONS
+        if chart_key is not None and section not in failed_sections
+    ]
+    print(f"   - 生成關鍵摘要、流量來源、AOV 分布、轉換漏斗圖表（同時最多 {chart_gen.max_workers} 個）...")
+    chart_errors = {}
+    charts = chart_gen.render_all(report_data, keys=chart_keys, errors=chart_errors)
+    for name, elapsed_ms in chart_gen.render_times.items():
+        cached = '（快取）' if name in chart_gen.cached_charts else ''
+        print(f"     ⏱️  {name}: {elapsed_ms:.0f} ms{cached}")
+    for name, error in chart_errors.items():
+        print(f"   ❌ 圖表生成失敗（{name}）：{str(error)}")
+    failed_sections.update(
+        section for section, _, _, chart_key, _ in REPORT_SECTIONS if chart_key in chart_errors
+    )
     
-    try:
-        # 本週關鍵摘要圖表
-        print("   - 生成本週關鍵摘要圖表...")
-        charts['weekly_comparison'] = chart_gen.generate_weekly_comparison_chart(weekly_comparison)
-        
-        # 流量來源圖表
-        print("   - 生成流量來源圖表...")
-        charts['traffic_source'] = chart_gen.generate_traffic_source_chart(traffic_df)
-        
-        # AOV 分布圖表
-        print("   - 生成 AOV 分布圖表...")
-        charts['aov_distribution'] = chart_gen.generate_aov_distribution_chart(aov_data)
-        
-        # 轉換漏斗圖表
-        print("   - 生成轉換漏斗圖表...")
-        charts['conversion_funnel'] = chart_gen.generate_conversion_funnel_chart(funnel_data)
-        
-        print("   ✅ 圖表生成完成")
-        
-    except Exception as e:
-        print(f"   ❌ 圖表生成失敗：{str(e)}")
-        return
+    print("   ✅ 圖表生成完成")
     
     # 3. 組合資料字典
     print(f"\n📦 步驟 3/4：組合資料...")
     
     data_dict = {
-        'gmv_metrics': gmv_metrics,
-        'weekly_comparison': weekly_comparison,
-        'traffic_analysis': traffic_df.to_dict('records') if not traffic_df.empty else [],
-        'aov_analysis': aov_data,
-        'funnel_data': funnel_data,
-        'report_period': {
-            'start_date': report_monday.strftime('%Y-%m-%d'),
-            'end_date': report_sunday.strftime('%Y-%m-%d'),
-        }
+        key: report_data[key]
+        for key in ('gmv_metrics', 'weekly_comparison', 'aov_analysis', 'funnel_data', 'metadata')
+        if key in report_data
+    }
+    traffic_df = report_data.get('traffic_df')
+    if traffic_df is not None:
+        data_dict['traffic_analysis'] = traffic_df.to_dict('records') if not traffic_df.empty else []
+    data_dict['report_period'] = {
+        'start_date': report_monday.strftime('%Y-%m-%d'),
+        'end_date': report_sunday.strftime('%Y-%m-%d'),
     }
     
     # 4. 生成 HTML 報告
@@ -121,10 +197,19 @@ def main():
             data_dict=data_dict,
             charts_dict=charts,
             brand_name=brand_name,
+            failed_sections=failed_sections,
         )
         
         print(f"   ✅ 報告生成完成")
-        print(f"\n📁 報告檔案位置：{os.path.abspath(report_path)}")
+        if report_builder.cached_sections:
+            print(f"   🗄️  沿用快取的區塊片段：" + '、'.join(
+                section_titles[section] for section in SECTION_NAMES if section in report_builder.cached_sections
+            ))
+        if failed_sections:
+            print(f"   ⚠️  無法取得的區塊：" + '、'.join(
+                section_titles[section] for section in SECTION_NAMES if section in failed_sections
+            ))
+        print(f"\n📁 報告檔案位置：{os.path.abspath(report_path)}（{os.path.getsize(report_path) / 1024:.0f} KB）")
         
         print(f"\n" + "=" * 60)
         print("✅ 週報生成完成！")
@@ -134,7 +219,6 @@ def main():
         print(f"   ❌ 報告生成失敗：{str(e)}")
         return
 
-
 if __name__ == '__main__':
     main()
 
@@ -2,85 +2,403 @@
 HTML 報告組合模組
 將所有圖表整合成完整的 HTML 報告
 """
+import hashlib
+import json
 import os
 import sys
+import threading
+import urllib.request
 from datetime import datetime
-from jinja2 import Template
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, TemplateNotFound
 
 # 添加專案根目錄到路徑
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.charts import COLOR_PALETTE
+from config.profiling import profiled
 from src.ai.summary import generate_weekly_summary
+from src.charts.generator import JS_FUNCTION_MARKER
+from src.data.distinct_count import DISTINCT_COUNT_LABELS
+from src.reports.sections import REPORT_SECTIONS, SECTION_INPUTS, SectionCache
 from src.utils.formatters import format_number, format_percentage, format_currency
 
 
+# 離線報告內嵌的圖表 JS 資源快取目錄：專案根目錄下的 .cache/assets
+DEFAULT_ASSET_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.cache', 'assets'
+)
+
+# 報告區塊資料與 HTML 片段的快取目錄：專案根目錄下的 .cache/sections
+DEFAULT_SECTION_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.cache', 'sections'
+)
+
+# 編譯後模板的位元組碼快取目錄：專案根目錄下的 .cache/templates
+DEFAULT_TEMPLATE_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), '.cache', 'templates'
+)
+
+REPORT_TEMPLATE_NAME = 'report_template.html'
+# 各區塊的模板為 sections/<區塊>.html；資料無法取得的區塊改用 UNAVAILABLE_SECTION_TEMPLATE
+UNAVAILABLE_SECTION_TEMPLATE = 'sections/unavailable.html'
+
+# 模板中可用的數字格式（同時註冊為 filter 與全域函式，例如 {{ value|format_currency }}）
+FORMATTERS = {
+    'format_number': format_number,
+    'format_percentage': format_percentage,
+    'format_currency': format_currency,
+}
+
+# 同一程序內依（模板目錄, 自動重新載入）共用的 Environment
+_environments = {}
+_environments_lock = threading.Lock()
+
+
+def get_template_environment(template_dir, auto_reload=None):
+    """
+    取得模板目錄共用的 jinja2 Environment（多品牌批次產生時模板只編譯一次）
+    
+    - auto_reload 關閉時（預設）模板載入後不再檢查檔案是否修改；開發時設定 REPORT_TEMPLATE_AUTO_RELOAD=1
+    - 編譯結果存放於 REPORT_TEMPLATE_CACHE_DIR（預設 .cache/templates），新的程序也不必重新編譯
+    
+    Args:
+        template_dir: 模板目錄
+        auto_reload: 是否在模板修改後自動重新載入（預設讀取 REPORT_TEMPLATE_AUTO_RELOAD）
+        
+    Returns:
+        Environment: jinja2 Environment
+    """
+    if auto_reload is None:
+        auto_reload = os.getenv('REPORT_TEMPLATE_AUTO_RELOAD', '0').lower() in ('1', 'true', 'yes')
+    key = (os.path.abspath(template_dir), auto_reload)
+    
+    with _environments_lock:
+        environment = _environments.get(key)
+        if environment is None:
+            cache_dir = os.getenv('REPORT_TEMPLATE_CACHE_DIR', DEFAULT_TEMPLATE_CACHE_DIR)
+            os.makedirs(cache_dir, exist_ok=True)
+            environment = Environment(
+                loader=FileSystemLoader(template_dir, encoding='utf-8'),
+                auto_reload=auto_reload,
+                bytecode_cache=FileSystemBytecodeCache(cache_dir),
+            )
+            environment.filters.update(FORMATTERS)
+            environment.globals.update(FORMATTERS)
+            _environments[key] = environment
+        return environment
+
+
+def collect_chart_specs(charts_dict, rendered_html=None):
+    """
+    依報告中的順序取出所有圖表片段（略過「暫無資料」等純 HTML）
+    
+    Args:
+        charts_dict: ChartGenerator.render_all 的結果（可巢狀，例如 traffic_source 的 pie / bar）
+        rendered_html: 已產生的區塊 HTML（可選；指定時只保留模板中有放置容器的圖表，
+                       例如 AOV 的件數 / 價格帶圖表目前沒有模板使用，不寫入圖表選項）
+        
+    Returns:
+        list: 圖表片段（見 ChartGenerator._embed）
+    """
+    specs = []
+    for value in charts_dict.values():
+        if isinstance(value, dict) and 'chart_id' in value:
+            specs.append(value)
+        elif isinstance(value, dict):
+            specs.extend(collect_chart_specs(value))
+    if rendered_html is not None:
+        specs = [spec for spec in specs if f'id="{spec["chart_id"]}"' in rendered_html]
+    return specs
+
+
+def chart_placeholder(fragment):
+    """
+    模板中圖表位置的 HTML：圖表片段輸出為待初始化的容器，其他內容（例如「暫無資料」）原樣輸出
+    
+    Args:
+        fragment: 圖表片段或 HTML 字串
+        
+    Returns:
+        str: HTML
+    """
+    if isinstance(fragment, dict) and 'chart_id' in fragment:
+        return (
+            f'<div class="report-chart" id="{fragment["chart_id"]}" '
+            f'style="width: {fragment["width"]}; height: {fragment["height"]};"></div>'
+        )
+    return fragment or ''
+
+
 class ReportBuilder:
     """報告建構器"""
     
-    def __init__(self, template_dir=None, output_dir='./output'):
+    def __init__(self, template_dir=None, output_dir='./output', asset_mode=None, section_cache=None):
+        """
+        初始化報告建構器
+        
+        Args:
+            template_dir: 模板目錄（預設為 src/reports/templates）
+            output_dir: 報告輸出目錄
+            asset_mode: ECharts 函式庫載入方式（預設讀取 ECHARTS_ASSET_MODE）：
+                        cdn（預設，以外部連結載入一次）/ inline（內嵌一份，報告可離線開啟）
+            section_cache: 報告區塊快取（預設依 REPORT_SECTION_CACHE_ENABLED / REPORT_SECTION_CACHE_DIR 建立，可選）
+        """
         # 預設模板目錄為 src/reports/templates
         if template_dir is None:
             template_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'src', 'reports', 'templates')
         self.template_dir = template_dir
         self.output_dir = output_dir
+        self.environment = get_template_environment(template_dir)
+        self.asset_mode = (asset_mode or os.getenv('ECHARTS_ASSET_MODE', 'cdn')).lower()
+        self.asset_cache_dir = os.getenv('ECHARTS_ASSET_CACHE_DIR', DEFAULT_ASSET_CACHE_DIR)
+        
+        # 報告區塊快取（REPORT_SECTION_CACHE_ENABLED=0 可停用，詳見 src/reports/sections.py）
+        self.section_cache = section_cache or SectionCache.from_env(DEFAULT_SECTION_CACHE_DIR)
+        # 最近一次 build_report 直接取自片段快取的區塊
+        self.cached_sections = set()
         
         # 確保輸出目錄存在
         os.makedirs(self.output_dir, exist_ok=True)
     
-    def build_report(self, data_dict, charts_dict, brand_name='豆油伯'):
+    def load_sections(self, scope, refresh=()):
+        """
+        讀取仍在有效時間內的區塊資料（重跑週報時只需重新查詢其餘區塊）
+        
+        Args:
+            scope: 查詢範圍（品牌、觀察週、資料集、不重複計數模式等，dict）
+            refresh: 強制重新查詢的區塊（包含 'all' 時全部重新查詢）
+            
+        Returns:
+            dict: {區塊: {'data': {報告資料鍵: 值}, 'metadata': 查詢時的 metadata}}
+        """
+        if self.section_cache is None or 'all' in refresh:
+            return {}
+        
+        sections = {}
+        for section, _, _, _, _ in REPORT_SECTIONS:
+            if section in refresh:
+                continue
+            try:
+                entry = self.section_cache.get_data(section, scope)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"⚠️  區塊快取內容無法讀取，重新查詢 {section}: {str(e)}")
+                entry = None
+            if entry is not None:
+                sections[section] = entry
+        return sections
+    
+    def save_sections(self, scope, report_data, sections):
+        """
+        將查詢成功的區塊資料寫入快取
+        
+        Args:
+            scope: 查詢範圍（同 load_sections）
+            report_data: fetch_report_data 的結果
+            sections: 要寫入的區塊名稱
+        """
+        if self.section_cache is None:
+            return
+        
+        for section, _, data_key, _, _ in REPORT_SECTIONS:
+            if section not in sections or data_key not in report_data:
+                continue
+            try:
+                self.section_cache.put_data(
+                    section, scope, {data_key: report_data[data_key]}, report_data.get('metadata', {})
+                )
+            except (OSError, TypeError, ValueError) as e:
+                print(f"⚠️  寫入區塊快取失敗 {section}: {str(e)}")
+    
+    @profiled()
+    def build_report(self, data_dict, charts_dict, brand_name='豆油伯', failed_sections=()):
         """
         組合完整的 HTML 報告
         
+        各區塊分別產生 HTML 片段（區塊模板與輸入資料都沒變時取自片段快取），再組合為完整報告
+        
         Args:
-            data_dict: 包含所有資料的字典
-            charts_dict: 包含所有圖表 HTML 的字典
+            data_dict: 包含所有資料的字典（資料無法取得的區塊可省略）
+            charts_dict: 包含所有圖表片段的字典
             brand_name: 品牌名稱
+            failed_sections: 資料或圖表無法取得的區塊（顯示提示訊息，不寫入快取）
             
         Returns:
             str: 生成的報告檔案路徑
         """
-        # 讀取 HTML 模板
-        template_path = os.path.join(self.template_dir, 'report_template.html')
-        
-        if not os.path.exists(template_path):
+        # 取得 HTML 模板（已編譯的模板由共用的 Environment 快取）
+        try:
+            template = self.environment.get_template(REPORT_TEMPLATE_NAME)
+        except TemplateNotFound:
             # 如果模板不存在，使用預設模板
-            html_content = self._generate_default_template()
-        else:
-            with open(template_path, 'r', encoding='utf-8') as f:
-                template = Template(f.read())
-                # 生成 AI 摘要（暫時使用規則式，後續可整合 LLM）
-                ai_summary = generate_weekly_summary(data_dict, use_llm=False)
-                
-                # 取得報告時間範圍
-                report_period = data_dict.get('report_period', {})
-                start_date = report_period.get('start_date', '')
-                end_date = report_period.get('end_date', '')
-                
-                html_content = template.render(
-                    brand_name=brand_name,
-                    output_date=datetime.now().strftime('%Y-%m-%d %H:%M'),
-                    report_start_date=start_date,
-                    report_end_date=end_date,
-                    data=data_dict,
-                    charts=charts_dict,
-                    colors=COLOR_PALETTE,
-                    ai_summary=ai_summary,
-                    format_number=format_number,
-                    format_percentage=format_percentage,
-                    format_currency=format_currency,
-                )
+            template = None
         
         # 儲存報告
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'weekly_report_{timestamp}.html'
         filepath = os.path.join(self.output_dir, filename)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+        if template is None:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(self._generate_default_template())
+            return filepath
+        
+        # 生成 AI 摘要（暫時使用規則式，後續可整合 LLM）
+        ai_summary = generate_weekly_summary(data_dict, use_llm=False)
+        
+        # 取得報告時間範圍
+        report_period = data_dict.get('report_period', {})
+        start_date = report_period.get('start_date', '')
+        end_date = report_period.get('end_date', '')
+        
+        self.cached_sections = set()
+        sections = {
+            section: self._render_section(section, title, chart_key, data_dict, charts_dict, ai_summary, failed_sections)
+            for section, title, _, chart_key, _ in REPORT_SECTIONS
+        }
+        
+        chart_specs = collect_chart_specs(charts_dict, rendered_html=''.join(sections.values()))
+        
+        stream = template.stream(
+            brand_name=brand_name,
+            output_date=datetime.now().strftime('%Y-%m-%d %H:%M'),
+            report_start_date=start_date,
+            report_end_date=end_date,
+            data=data_dict,
+            sections=sections,
+            chart_assets=self._chart_assets(chart_specs),
+            chart_options=self._chart_options_json(chart_specs),
+            js_function_marker=JS_FUNCTION_MARKER,
+            colors=COLOR_PALETTE,
+            distinct_count_labels=DISTINCT_COUNT_LABELS,
+        )
+        
+        # 邊產生邊寫入暫存檔，完成後才替換，產生失敗時不會留下不完整的報告
+        temp_path = filepath + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                stream.dump(f)
+            os.replace(temp_path, filepath)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
         
         return filepath
     
+    def _render_section(self, section, title, chart_key, data_dict, charts_dict, ai_summary, failed_sections):
+        """
+        產生單一區塊的 HTML 片段（輸入都沒變時取自片段快取）
+        
+        Args:
+            section: 區塊名稱
+            title: 區塊標題（資料無法取得時顯示）
+            chart_key: 區塊圖表在 charts_dict 中的鍵（沒有圖表為 None）
+            data_dict: 報告資料
+            charts_dict: 圖表片段
+            ai_summary: 關鍵摘要文字
+            failed_sections: 資料或圖表無法取得的區塊
+            
+        Returns:
+            str: 區塊 HTML
+        """
+        if section in failed_sections:
+            return self.environment.get_template(UNAVAILABLE_SECTION_TEMPLATE).render(title=title)
+        
+        template_name = f'sections/{section}.html'
+        template = self.environment.get_template(template_name)
+        context = {
+            'data': data_dict,
+            'charts': charts_dict,
+            'chart': chart_placeholder,
+            'ai_summary': ai_summary,
+        }
+        if self.section_cache is None:
+            return template.render(**context)
+        
+        values = dict(data_dict, ai_summary=ai_summary)
+        inputs = {name: values.get(name) for name in SECTION_INPUTS[section]}
+        if chart_key is not None:
+            inputs['chart'] = charts_dict.get(chart_key)
+        template_source, _, _ = self.environment.loader.get_source(self.environment, template_name)
+        key = self.section_cache.fragment_key(section, inputs, template_source)
+        
+        html = self.section_cache.get(key)
+        if html is not None:
+            self.cached_sections.add(section)
+            return html
+        
+        html = template.render(**context)
+        try:
+            self.section_cache.put(key, html)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️  寫入區塊快取失敗 {section}: {str(e)}")
+        return html
+    
+    @staticmethod
+    def _chart_options_json(specs):
+        """
+        將所有圖表的主題與選項合併為單一 JSON 區塊（輸出於 <script type="application/json">，載入時不執行）
+        
+        Args:
+            specs: 圖表片段清單
+            
+        Returns:
+            str: {圖表 ID: {"theme": 主題, "options": 選項}} 的 JSON；沒有圖表時為空字串
+        """
+        if not specs:
+            return ''
+        entries = [
+            f'{json.dumps(spec["chart_id"])}: {{"theme": {json.dumps(spec["theme"])}, "options": {spec["options"]}}}'
+            for spec in specs
+        ]
+        # 避免字串內容中的 </script> 提前結束區塊（\/ 在 JSON 字串中等同 /）
+        return ('{' + ', '.join(entries) + '}').replace('</', '<\\/')
+    
+    def _chart_assets(self, specs):
+        """
+        整份報告需要的 ECharts 與主題 JS（依相依順序去除重複，每個只載入一次）
+        
+        Args:
+            specs: 圖表片段清單
+            
+        Returns:
+            list: [{'src': 網址}]（cdn）或 [{'inline': JS 內容}]（inline；下載失敗的資源改用網址）
+        """
+        urls = list(dict.fromkeys(url for spec in specs for url in spec['dependencies']))
+        if self.asset_mode != 'inline':
+            return [{'src': url} for url in urls]
+        
+        assets = []
+        for url in urls:
+            try:
+                assets.append({'inline': self._load_asset(url)})
+            except OSError as e:
+                print(f"⚠️  無法取得圖表函式庫，改用外部連結 {url}: {str(e)}")
+                assets.append({'src': url})
+        return assets
+    
+    def _load_asset(self, url):
+        """
+        讀取 JS 資源內容（先查本機快取，沒有時下載一次並保存，之後產生的報告不再下載）
+        
+        Args:
+            url: 資源網址
+            
+        Returns:
+            str: 可直接放入 <script> 的 JS 內容
+        """
+        name = f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]}-{os.path.basename(url)}"
+        path = os.path.join(self.asset_cache_dir, name)
+        if not os.path.exists(path):
+            os.makedirs(self.asset_cache_dir, exist_ok=True)
+            with urllib.request.urlopen(url, timeout=30) as response:
+                content = response.read()
+            with open(path + '.tmp', 'wb') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+        
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().replace('</script', '<\\/script')
+    
     def _generate_default_template(self):
         """生成預設的 HTML 模板"""
         return """
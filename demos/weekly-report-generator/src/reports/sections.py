@@ -0,0 +1,152 @@
+"""
+報告區塊快取
+週報由 GMV、關鍵摘要、流量、AOV、漏斗五個互相獨立的區塊組成，各區塊分別快取：
+
+- 區塊資料：以「查詢範圍（品牌、觀察週、資料集、不重複計數模式）+ 區塊」為鍵，
+  REPORT_SECTION_TTL_HOURS 內重跑週報時不再查詢；查詢失敗的區塊不寫入，下次執行時重新查詢
+- 區塊 HTML 片段：以「區塊模板 + 區塊用到的資料 + 區塊圖表」的雜湊值為鍵，輸入都沒變時直接重用
+
+儲存格式與清理規則同圖表片段快取（見 src/charts/cache.py）
+"""
+import json
+import os
+import time
+
+import pandas as pd
+
+from src.charts.cache import ChartCache, canonical_json
+
+
+# 報告區塊：(區塊, 標題, 報告資料鍵, 圖表鍵, 所屬的資料查詢（DataFetcher.fetch_report_data 的 parts）)
+REPORT_SECTIONS = [
+    ('gmv', '💰 GMV 基本指標', 'gmv_metrics', None, 'report_plan'),
+    ('comparison', '📈 本週關鍵摘要', 'weekly_comparison', 'weekly_comparison', 'report_plan'),
+    ('traffic', '🌐 流量分析', 'traffic_df', 'traffic_source', 'traffic_df'),
+    ('aov', '🛒 平均訂單金額分析', 'aov_analysis', 'aov_distribution', 'report_plan'),
+    ('funnel', '🔽 轉換率漏斗分析', 'funnel_data', 'conversion_funnel', 'funnel_data'),
+]
+
+SECTION_NAMES = [section for section, _, _, _, _ in REPORT_SECTIONS]
+
+# 各區塊模板用到的資料（關鍵摘要的文字摘要由 GMV 與流量資料產生，以摘要內容作為輸入）
+SECTION_INPUTS = {
+    'gmv': ('gmv_metrics',),
+    'comparison': ('weekly_comparison', 'ai_summary'),
+    'traffic': ('traffic_analysis',),
+    'aov': ('aov_analysis',),
+    'funnel': ('funnel_data',),
+}
+
+
+def section_parts(sections):
+    """
+    取得區塊所需的資料查詢（同一查詢涵蓋多個區塊時只查詢一次）
+    
+    Args:
+        sections: 區塊名稱清單
+    
+    Returns:
+        list: fetch_report_data 的 parts（依 REPORT_SECTIONS 順序）
+    """
+    return list(dict.fromkeys(part for section, _, _, _, part in REPORT_SECTIONS if section in sections))
+
+
+def _encode(value):
+    """將區塊資料轉為可寫入 JSON 的格式（DataFrame 保留欄位順序，讀回時還原）"""
+    if isinstance(value, pd.DataFrame):
+        return {'dataframe': json.loads(canonical_json(value))}
+    return {'value': json.loads(canonical_json(value))}
+
+
+def _decode(encoded):
+    """還原 _encode 的結果"""
+    if 'dataframe' in encoded:
+        frame = encoded['dataframe']
+        return pd.DataFrame(frame['data'], columns=frame['columns'])
+    return encoded['value']
+
+
+class SectionCache(ChartCache):
+    """報告區塊快取"""
+    
+    def __init__(self, cache_dir, max_bytes=50 * 1024 * 1024, max_age_seconds=30 * 86400, data_ttl_seconds=12 * 3600):
+        """
+        初始化快取
+        
+        Args:
+            cache_dir: 快取目錄
+            max_bytes: 快取總大小上限（位元組）
+            max_age_seconds: 項目未被使用的最長保留秒數
+            data_ttl_seconds: 區塊資料的有效秒數（超過後重新查詢）
+        """
+        super().__init__(cache_dir, max_bytes=max_bytes, max_age_seconds=max_age_seconds)
+        self.data_ttl_seconds = data_ttl_seconds
+    
+    @classmethod
+    def from_env(cls, default_dir):
+        """
+        依環境變數建立快取（REPORT_SECTION_CACHE_ENABLED=0 時停用）
+        
+        Args:
+            default_dir: 未設定 REPORT_SECTION_CACHE_DIR 時使用的快取目錄
+        
+        Returns:
+            SectionCache: 快取實例，停用時返回 None
+        """
+        if os.getenv('REPORT_SECTION_CACHE_ENABLED', '1').lower() in ('0', 'false', 'no'):
+            return None
+        
+        return cls(
+            cache_dir=os.getenv('REPORT_SECTION_CACHE_DIR', default_dir),
+            max_bytes=int(float(os.getenv('REPORT_SECTION_CACHE_MAX_MB', '50')) * 1024 * 1024),
+            data_ttl_seconds=int(float(os.getenv('REPORT_SECTION_TTL_HOURS', '12')) * 3600),
+        )
+    
+    def get_data(self, section, scope):
+        """
+        讀取區塊資料
+        
+        Args:
+            section: 區塊名稱
+            scope: 查詢範圍（dict）
+        
+        Returns:
+            dict: {'data': {報告資料鍵: 值}, 'metadata': 查詢時的 metadata}，未命中或超過有效時間時返回 None
+        """
+        entry = self.get(self.make_key(f'data.{section}', scope, ''))
+        if entry is None or time.time() - entry['fetched_at'] > self.data_ttl_seconds:
+            return None
+        return {
+            'data': {key: _decode(value) for key, value in entry['data'].items()},
+            'metadata': entry['metadata'],
+        }
+    
+    def put_data(self, section, scope, data, metadata):
+        """
+        寫入區塊資料
+        
+        Args:
+            section: 區塊名稱
+            scope: 查詢範圍（dict）
+            data: {報告資料鍵: 值}
+            metadata: 查詢時的 metadata（不重複計數方式等）
+        """
+        self.put(self.make_key(f'data.{section}', scope, ''), {
+            'fetched_at': time.time(),
+            'data': {key: _encode(value) for key, value in data.items()},
+            'metadata': json.loads(canonical_json(metadata)),
+        })
+    
+    def fragment_key(self, section, inputs, template_source):
+        """
+        產生區塊 HTML 片段的快取鍵
+        
+        Args:
+            section: 區塊名稱
+            inputs: 區塊用到的資料與圖表片段
+            template_source: 區塊模板原始碼（修改模板後不再命中）
+        
+        Returns:
+            str: 快取鍵
+        """
+        return self.make_key(f'html.{section}', inputs, template_source)
@@ -3,7 +3,7 @@
 """
 from .date_utils import get_week_range, get_last_week_range, get_last_last_week_range
 from .formatters import format_number, format_percentage, format_currency
-from .traffic_classifier import classify_traffic_source, classify_traffic_source_sql
+from .traffic_classifier import TrafficClassifier, classify_traffic_source, classify_traffic_source_sql
 
 __all__ = [
     'get_week_range',
@@ -12,6 +12,7 @@ __all__ = [
     'format_number',
     'format_percentage',
     'format_currency',
+    'TrafficClassifier',
     'classify_traffic_source',
     'classify_traffic_source_sql',
 ]
@@ -1,80 +1,159 @@
 """
 流量來源分類器
 將 GA4 的 source/medium 分類為 8 種流量來源
+分類規則定義於 config/traffic_rules.py，Python 分類器與 SQL CASE 語句皆由同一份規則表產生
 """
 import re
+from functools import lru_cache
 
+from config.traffic_rules import TRAFFIC_RULES
 
-def classify_traffic_source(source, medium):
+
+def _compile_rules(rules):
     """
-    根據 source 和 medium 分類流量來源
+    將規則表編譯為 (分類, source, medium 清單, 正規表達式) 清單（預設分類除外）
     
     Args:
-        source: GA4 的 traffic_source.source
-        medium: GA4 的 traffic_source.medium
-        
+        rules: 規則表（格式同 config.traffic_rules.TRAFFIC_RULES）
+    
     Returns:
-        str: 流量來源分類（1-8）
+        list: 編譯後的規則
+    """
+    compiled = []
+    for rule in rules:
+        pattern = rule.get('pattern')
+        if 'source' not in rule and pattern is None:
+            continue
+        compiled.append((
+            rule['label'],
+            rule.get('source'),
+            tuple(rule.get('medium_in', ())),
+            re.compile(pattern, re.IGNORECASE) if pattern is not None else None,
+        ))
+    return compiled
+
+
+class TrafficClassifier:
+    """
+    流量來源分類器
+    規則只編譯一次，並以 (source, medium) 為鍵快取分類結果（GA4 的來源組合數遠少於資料列數）
     """
-    # 組合 source/medium（模擬 GA4 的格式）
-    source_medium = f"{source} / {medium}" if source and medium else f"{source or ''} / {medium or ''}"
-    source_medium_lower = source_medium.lower()
-    
-    # 1. 直接流量
-    if source == '(direct)' and medium in ['(none)', '(not set)']:
-        return '1. 直接流量'
     
-    # 2. 自然搜尋
-    if re.search(r'/ organic$|.*search.*', source_medium_lower):
-        return '2. 自然搜尋'
+    def __init__(self, cache_size=4096, rules=None):
+        """
+        初始化分類器
+        
+        Args:
+            cache_size: LRU 快取上限（(source, medium) 組合數）
+            rules: 規則表（預設使用 config.traffic_rules.TRAFFIC_RULES）
+        """
+        rules = rules or TRAFFIC_RULES
+        self.rules = _compile_rules(rules)
+        self.default_label = rules[-1]['label']
+        self._cached_classify = lru_cache(maxsize=cache_size)(self._classify)
     
-    # 3. 付費廣告
-    if re.search(r'/ (ads|cpc|paid|ppc|cpm|pmax|ad|fb-SiteLink)$', source_medium, re.IGNORECASE):
-        return '3. 付費廣告'
+    def _classify(self, source, medium):
+        # 組合 source/medium（模擬 GA4 的格式）
+        source_medium = f"{source} / {medium}" if source and medium else f"{source or ''} / {medium or ''}"
+        
+        # 依序比對預先編譯的規則
+        for label, rule_source, medium_in, pattern in self.rules:
+            if rule_source is not None:
+                if source == rule_source and medium in medium_in:
+                    return label
+            elif pattern.search(source_medium):
+                return label
+        
+        return self.default_label
     
-    # 4. 會員經營
-    if re.search(r'(edm|line|push|sms|cdp|crm)', source_medium, re.IGNORECASE):
-        return '4. 會員經營'
+    def classify(self, source, medium):
+        """
+        分類單一 source/medium
+        
+        Args:
+            source: GA4 的 traffic_source.source
+            medium: GA4 的 traffic_source.medium
+        
+        Returns:
+            str: 流量來源分類（1-8）
+        """
+        try:
+            return self._cached_classify(source, medium)
+        except TypeError:
+            # 無法雜湊的輸入不進快取
+            return self._classify(source, medium)
     
-    # 5. AI 助理
-    if re.search(r'^(chatgpt|perplexity|copilot|bard|gemini)', source_medium_lower):
-        return '5. AI 助理'
+    def classify_many(self, sources, mediums):
+        """
+        批次分類（先去除重複的 source/medium 組合，每個組合只分類一次）
+        
+        Args:
+            sources: source 序列
+            mediums: medium 序列（長度需與 sources 相同）
+        
+        Returns:
+            list: 與輸入順序相同的分類結果
+        """
+        pairs = list(zip(sources, mediums))
+        labels = {pair: self.classify(*pair) for pair in dict.fromkeys(pairs)}
+        return [labels[pair] for pair in pairs]
     
-    # 6. 社群媒體
-    if re.search(r'(facebook|threads|instagram|t\.co|line|linktr\.ee|pinterest|linkedin)', source_medium, re.IGNORECASE):
-        return '6. 社群媒體'
+    def cache_info(self):
+        """取得 LRU 快取統計（hits、misses、maxsize、currsize）"""
+        return self._cached_classify.cache_info()
+
+
+_default_classifier = TrafficClassifier()
+
+
+def classify_traffic_source(source, medium):
+    """
+    根據 source 和 medium 分類流量來源
     
-    # 7. 參照連結
-    if re.search(r'/ referral$', source_medium, re.IGNORECASE):
-        return '7. 參照連結'
+    Args:
+        source: GA4 的 traffic_source.source
+        medium: GA4 的 traffic_source.medium
     
-    # 8. 其他
-    return '8. 其他'
+    Returns:
+        str: 流量來源分類（1-8）
+    """
+    return _default_classifier.classify(source, medium)
+
+
+def _sql_string(value):
+    """將字串轉為 BigQuery 字串常值"""
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
 
 
-def classify_traffic_source_sql(source_col='source', medium_col='medium'):
+def classify_traffic_source_sql(source_col='source', medium_col='medium', rules=None):
     """
-    生成 SQL CASE WHEN 語句用於流量分類
+    生成 SQL CASE WHEN 語句用於流量分類（由規則表產生，正規表達式以 (?i) 不分大小寫，與 Python 分類器一致）
     
     Args:
         source_col: source 欄位名稱
         medium_col: medium 欄位名稱
-        
+        rules: 規則表（預設使用 config.traffic_rules.TRAFFIC_RULES）
+    
     Returns:
         str: SQL CASE WHEN 語句
     """
+    rules = rules or TRAFFIC_RULES
     source_medium_expr = f"CONCAT(COALESCE({source_col}, ''), ' / ', COALESCE({medium_col}, ''))"
     
+    whens = []
+    for rule in rules:
+        label = _sql_string(rule['label'])
+        if 'source' in rule:
+            mediums = ', '.join(_sql_string(m) for m in rule.get('medium_in', ()))
+            whens.append(f"WHEN {source_col} = {_sql_string(rule['source'])} AND {medium_col} IN ({mediums}) THEN {label}")
+        elif rule.get('pattern') is not None:
+            pattern = _sql_string('(?i)' + rule['pattern'])
+            whens.append(f"WHEN REGEXP_CONTAINS({source_medium_expr}, {pattern}) THEN {label}")
+    
+    when_lines = '\n        '.join(whens)
     return f"""
     CASE
-        WHEN {source_col} = '(direct)' AND ({medium_col} = '(none)' OR {medium_col} = '(not set)') THEN '1. 直接流量'
-        WHEN REGEXP_CONTAINS(LOWER({source_medium_expr}), r'/ organic$|.*search.*') THEN '2. 自然搜尋'
-        WHEN REGEXP_CONTAINS({source_medium_expr}, r'/ (ads|cpc|paid|ppc|cpm|pmax|ad|fb-SiteLink)$') THEN '3. 付費廣告'
-        WHEN REGEXP_CONTAINS({source_medium_expr}, r'(edm|line|push|sms|cdp|crm)') THEN '4. 會員經營'
-        WHEN REGEXP_CONTAINS(LOWER({source_medium_expr}), r'^(chatgpt|perplexity|copilot|bard|gemini)') THEN '5. AI 助理'
-        WHEN REGEXP_CONTAINS({source_medium_expr}, r'(facebook|threads|instagram|t\\.co|line|linktr\\.ee|pinterest|linkedin)') THEN '6. 社群媒體'
-        WHEN REGEXP_CONTAINS({source_medium_expr}, r'/ referral$') THEN '7. 參照連結'
-        ELSE '8. 其他'
+        {when_lines}
+        ELSE {_sql_string(rules[-1]['label'])}
     END
     """
-
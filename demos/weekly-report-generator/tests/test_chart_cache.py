@@ -0,0 +1,75 @@
+"""
+測試圖表片段快取
+確認快取鍵的正規化、命中與依大小 / 時間清理（只使用暫存目錄，不產生圖表）
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.charts.cache import ChartCache
+
+
+SETTINGS = '{"theme": "macarons"}'
+
+
+def test_key_canonicalization():
+    """字典鍵順序不影響快取鍵；資料、圖表或設定改變時產生新的鍵"""
+    data = {'changes': {'revenue': 5.26, 'orders': 2.56}, 'period': date(2025, 1, 6)}
+    reordered = {'period': date(2025, 1, 6), 'changes': {'orders': 2.56, 'revenue': 5.26}}
+    key = ChartCache.make_key('generate_weekly_comparison_chart', data, SETTINGS)
+
+    assert ChartCache.make_key('generate_weekly_comparison_chart', reordered, SETTINGS) == key
+    assert ChartCache.make_key('generate_conversion_funnel_chart', data, SETTINGS) != key
+    assert ChartCache.make_key('generate_weekly_comparison_chart', data, '{"theme": "wonderland"}') != key
+    changed = {'changes': {'revenue': 5.27, 'orders': 2.56}, 'period': date(2025, 1, 6)}
+    assert ChartCache.make_key('generate_weekly_comparison_chart', changed, SETTINGS) != key
+    print("   ✅ 快取鍵正規化正確")
+
+
+def test_get_put():
+    """寫入後命中（字串與 dict 片段皆可），未寫入的鍵未命中"""
+    cache = ChartCache(tempfile.mkdtemp())
+    cache.put('a', '<div id="chart-a"></div>')
+    cache.put('b', {'pie': '<div>pie</div>', 'bar': '<div>bar</div>'})
+
+    assert cache.get('a') == '<div id="chart-a"></div>'
+    assert cache.get('b')['bar'] == '<div>bar</div>'
+    assert cache.get('missing') is None
+    assert cache.stats() == {'hits': 2, 'misses': 1}
+    print("   ✅ 片段讀寫正確")
+
+
+def test_eviction():
+    """超過保留時間的片段失效並被刪除；超過大小上限時由最久未使用的片段開始刪除"""
+    cache = ChartCache(tempfile.mkdtemp(), max_bytes=10 ** 6, max_age_seconds=3600)
+    now = time.time()
+    idle = {'old': 7200, 'middle': 1800, 'new': 600}
+    for key in idle:
+        cache.put(key, 'x' * 1000)
+    for key, idle_seconds in idle.items():
+        os.utime(os.path.join(cache.cache_dir, f'{key}.json'), (now - idle_seconds, now - idle_seconds))
+
+    # old 已超過 1 小時未使用
+    assert cache.get('old') is None
+    assert cache.evict() == 1
+    assert sorted(os.listdir(cache.cache_dir)) == ['middle.json', 'new.json']
+
+    # 大小上限只容得下一個片段：保留最近使用的
+    cache.get('middle')
+    cache.max_bytes = 1500
+    assert cache.evict() == 1
+    assert os.listdir(cache.cache_dir) == ['middle.json']
+    print("   ✅ 依時間與大小清理正確")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("測試圖表片段快取")
+    print("=" * 60)
+    test_key_canonicalization()
+    test_get_put()
+    test_eviction()
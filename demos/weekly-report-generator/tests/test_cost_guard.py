@@ -0,0 +1,87 @@
+"""
+測試查詢成本守門
+以模擬的預估 / 實際掃描量確認預算預留、超出預算時中止與實際值修正（不連線 BigQuery）
+"""
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.cost_guard import BytesBudget, BytesBudgetExceeded, QueryCostTracker, parse_bytes
+
+
+def make_job(total_bytes):
+    """建立只含成本欄位的模擬 QueryJob"""
+    return SimpleNamespace(job_id='job-1', total_bytes_processed=total_bytes, total_bytes_billed=total_bytes, slot_millis=500)
+
+
+def test_parse_bytes():
+    """掃描量設定可使用 KB / MB / GB / TB 單位"""
+    assert parse_bytes('1024') == 1024
+    assert parse_bytes('500MB') == 500 * 1024 ** 2
+    assert parse_bytes('2g') == 2 * 1024 ** 3
+    assert parse_bytes('') is None
+    print("   ✅ 掃描量設定解析正確")
+
+
+def test_budget_abort():
+    """超出預算時拋出例外且不預留，實際掃描量修正已預留的值"""
+    budget = BytesBudget('報告', 1000)
+    tracker = QueryCostTracker([budget])
+    
+    record = tracker.check('fetch_report_plan', 600)
+    tracker.record_job('fetch_report_plan', make_job(400), record)
+    assert budget.used == 400
+    
+    try:
+        tracker.check('fetch_traffic_analysis', 700)
+        raise AssertionError("應該超出預算")
+    except BytesBudgetExceeded:
+        pass
+    assert budget.used == 400
+    print("   ✅ 超出預算時中止，預算以實際掃描量計算")
+
+
+def test_budget_warn():
+    """warn 模式超出預算仍繼續，並依查詢標籤彙總"""
+    budget = BytesBudget('報告', 100)
+    tracker = QueryCostTracker([budget], action='warn')
+    
+    record = tracker.check('fetch_conversion_funnel', 300)
+    tracker.record_job('fetch_conversion_funnel', make_job(300), record)
+    tracker.record_cache_hit('fetch_conversion_funnel')
+    
+    summary = {row['label']: row for row in tracker.summary()}
+    assert summary['fetch_conversion_funnel']['queries'] == 2
+    assert summary['fetch_conversion_funnel']['cache_hits'] == 1
+    assert summary['fetch_conversion_funnel']['actual_bytes'] == 300
+    assert budget.used == 300
+    print("   ✅ warn 模式照常執行並記錄成本")
+
+
+def test_budget_cache_fallback():
+    """超出預算改用快取結果時，被拒絕的查詢只記錄一次並標記為快取命中"""
+    tracker = QueryCostTracker([BytesBudget('報告', 100)])
+    
+    try:
+        tracker.check('fetch_report_plan', 700)
+        raise AssertionError("應該超出預算")
+    except BytesBudgetExceeded as e:
+        tracker.record_cache_hit('fetch_report_plan', e.record)
+    
+    summary = {row['label']: row for row in tracker.summary()}
+    assert summary['fetch_report_plan']['queries'] == 1
+    assert summary['fetch_report_plan']['cache_hits'] == 1
+    assert summary['fetch_report_plan']['actual_bytes'] == 0
+    print("   ✅ 改用快取結果時只記錄一次")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("測試查詢成本守門")
+    print("=" * 60)
+    test_parse_bytes()
+    test_budget_abort()
+    test_budget_warn()
+    test_budget_cache_fallback()
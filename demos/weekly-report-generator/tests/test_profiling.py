@@ -0,0 +1,63 @@
+"""
+測試執行階段計時
+確認 span 的巢狀關係、跨執行緒延續與查詢統計彙總（不連線 BigQuery）
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.profiling import Profiler, record_query, submit
+
+
+def test_nested_spans_across_threads():
+    """執行緒池中的子階段延續呼叫端的 span 與欄位，查詢統計記在所屬階段"""
+    profiler = Profiler()
+
+    def fetch(name, rows, cache_hit):
+        with profiler.span(name):
+            record_query(job_id=None if cache_hit else f'job-{name}', cache_hit=cache_hit, rows=rows)
+    
+    with profiler.span('weekly_report', client_id='client_A'):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                submit(executor, fetch, 'fetch_traffic_analysis', 8, False),
+                submit(executor, fetch, 'fetch_conversion_funnel', 1, True),
+            ]
+            for future in futures:
+                future.result()
+    
+    records = {record['span']: record for record in profiler.records}
+    traffic = records['fetch_traffic_analysis']
+    assert traffic['parent'] == 'weekly_report'
+    assert traffic['client_id'] == 'client_A'
+    assert traffic['job_ids'] == ['job-fetch_traffic_analysis']
+    assert traffic['rows'] == 8
+    assert records['fetch_conversion_funnel']['cache_hits'] == 1
+    assert records['weekly_report']['queries'] == 0
+    print("   ✅ 巢狀階段與查詢統計正確")
+
+
+def test_error_span():
+    """階段內發生例外時記錄錯誤並照常拋出"""
+    profiler = Profiler()
+    try:
+        with profiler.span('build_report'):
+            raise ValueError('template missing')
+    except ValueError:
+        pass
+    
+    summary = profiler.summary()
+    assert summary[0]['span'] == 'build_report'
+    assert summary[0]['errors'] == 1
+    assert profiler.records[0]['error'] == 'ValueError: template missing'
+    print("   ✅ 例外階段記錄正確")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("測試執行階段計時")
+    print("=" * 60)
+    test_nested_spans_across_threads()
+    test_error_span()
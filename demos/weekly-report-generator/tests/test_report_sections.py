@@ -0,0 +1,68 @@
+"""
+測試報告區塊快取
+確認區塊資料的讀寫（含 DataFrame）、有效時間與查詢範圍，以及區塊對應的資料查詢（只使用暫存目錄，不查詢 BigQuery）
+"""
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.reports.sections import SectionCache, section_parts
+
+
+SCOPE = {'brand_name': '豆油伯', 'start_date': date(2025, 1, 6), 'end_date': date(2025, 1, 12)}
+METADATA = {'distinct_count_mode': 'exact', 'distinct_counts': {'unique_users': 'exact'}}
+
+
+def test_data_round_trip():
+    """區塊資料寫入後可讀回，DataFrame 保留欄位順序與數值"""
+    cache = SectionCache(tempfile.mkdtemp())
+    traffic_df = pd.DataFrame({
+        'traffic_source': ['Google 廣告', '直接流量'],
+        'sessions': [1000, 500],
+        'revenue': [50000.0, 20000.0],
+    })
+    cache.put_data('traffic', SCOPE, {'traffic_df': traffic_df}, METADATA)
+    cache.put_data('gmv', SCOPE, {'gmv_metrics': {'net_revenue': 1000000, 'completed_orders': 800}}, METADATA)
+
+    entry = cache.get_data('traffic', SCOPE)
+    assert list(entry['data']['traffic_df'].columns) == ['traffic_source', 'sessions', 'revenue']
+    assert entry['data']['traffic_df'].to_dict('records') == traffic_df.to_dict('records')
+    assert entry['metadata'] == METADATA
+    assert cache.get_data('gmv', SCOPE)['data']['gmv_metrics']['net_revenue'] == 1000000
+    print("   ✅ 區塊資料讀寫正確")
+
+
+def test_scope_and_ttl():
+    """不同查詢範圍不共用資料；超過有效時間的資料視為過期"""
+    cache = SectionCache(tempfile.mkdtemp(), data_ttl_seconds=3600)
+    cache.put_data('funnel', SCOPE, {'funnel_data': {'overall': {'steps': []}}}, METADATA)
+
+    assert cache.get_data('funnel', SCOPE) is not None
+    assert cache.get_data('funnel', dict(SCOPE, start_date=date(2025, 1, 13))) is None
+    assert cache.get_data('aov', SCOPE) is None
+
+    cache.data_ttl_seconds = -1
+    assert cache.get_data('funnel', SCOPE) is None
+    print("   ✅ 查詢範圍與有效時間正確")
+
+
+def test_section_parts():
+    """共用報告計畫查詢的區塊只查詢一次"""
+    assert section_parts(['gmv', 'aov']) == ['report_plan']
+    assert section_parts(['funnel', 'comparison', 'traffic']) == ['report_plan', 'traffic_df', 'funnel_data']
+    assert section_parts([]) == []
+    print("   ✅ 區塊對應的查詢正確")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("測試報告區塊快取")
+    print("=" * 60)
+    test_data_round_trip()
+    test_scope_and_ttl()
+    test_section_parts()
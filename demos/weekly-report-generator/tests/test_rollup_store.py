@@ -0,0 +1,131 @@
+"""
+測試每日彙總儲存
+寫入幾天的模擬彙總後，確認跨日加總、平均值重算與缺少日期的判斷（只使用暫存的 SQLite 檔案，不連線 BigQuery）
+"""
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.data.rollup_store import RollupStore, ORDER_COLUMNS, DISTINCT_ORDER_COLUMNS
+
+
+SCOPE = 'test-project.datalake_stpl'
+
+
+def make_store(days):
+    """
+    建立暫存儲存並寫入每天相同的模擬彙總
+    
+    Args:
+        days: 要寫入的日期
+    
+    Returns:
+        RollupStore: 儲存實例
+    """
+    path = os.path.join(tempfile.mkdtemp(), 'rollups.db')
+    store = RollupStore(path)
+    values = {column: 0 for column in ORDER_COLUMNS}
+    values.update({
+        'net_revenue': 1000,
+        'completed_orders': 4,
+        'low_band_orders': 2,
+        'low_band_revenue': 600,
+        'low_band_amount_count': 2,
+    })
+    store.write(
+        SCOPE,
+        {day: values for day in days},
+        [(day.isoformat(), '1件', 3, 900, 3) for day in days],
+    )
+    return store
+
+
+def test_sums_and_averages():
+    """跨日加總訂單指標，平均金額以合計 / 筆數重算；每日不重複訂單數不加總"""
+    start = date(2025, 1, 6)
+    days = [start + timedelta(days=i) for i in range(7)]
+    store = make_store(days)
+    
+    orders = store.sum_orders(SCOPE, start, days[-1])
+    assert orders['net_revenue'] == 7000
+    assert not set(DISTINCT_ORDER_COLUMNS) & set(orders)
+    assert orders['low_band_revenue'] / orders['low_band_amount_count'] == 300
+    
+    order_count, total_amount, amount_count = store.sum_items(SCOPE, start, days[-1])['1件']
+    assert order_count == 21
+    assert total_amount / amount_count == 300
+    print("   ✅ 7 天彙總加總與平均值重算正確")
+
+
+def test_missing_days():
+    """只回報尚未寫入的日期"""
+    start = date(2025, 1, 6)
+    store = make_store([start, start + timedelta(days=2)])
+    
+    missing = store.missing_days(SCOPE, start, start + timedelta(days=3))
+    assert missing == [start + timedelta(days=1), start + timedelta(days=3)]
+    # 其他範圍鍵的資料互不影響
+    assert len(store.missing_days('other.dataset', start, start + timedelta(days=3))) == 4
+    print("   ✅ 缺少日期判斷正確")
+
+
+def test_settle_days():
+    """寫入時該日結束未滿 settle_days 天的資料視為尚未穩定，需要重新彙總"""
+    recent = date.today() - timedelta(days=3)
+    store = make_store([recent])
+    
+    assert store.missing_days(SCOPE, recent, recent) == []
+    assert store.missing_days(SCOPE, recent, recent, settle_days=7) == [recent]
+    print("   ✅ 資料穩定天數判斷正確")
+
+
+
+def test_user_sketches():
+    """交易會員草稿依日期讀取，有訂單但沒有草稿的日期會被回報"""
+    start = date(2025, 1, 6)
+    days = [start, start + timedelta(days=1)]
+    store = make_store(days)
+    assert store.missing_sketch_days(SCOPE, start, days[-1]) == days
+    
+    store.write(SCOPE, {}, [], {start: b'sketch-1'})
+    assert store.load_sketches(SCOPE, start, days[-1]) == [b'sketch-1']
+    assert store.missing_sketch_days(SCOPE, start, days[-1]) == [days[-1]]
+    print("   ✅ 交易會員草稿讀寫正確")
+
+
+def test_refresh_from_rows():
+    """refresh 以查詢函式返回的資料列（query_rows 格式）寫入，沒有訂單的日期補 0"""
+    start = date(2025, 1, 6)
+    store = make_store([])
+    bq_config = SimpleNamespace(
+        project_id='test-project',
+        dataset_id='datalake_stpl',
+        get_table_ref=lambda table: f'test-project.datalake_stpl.{table}',
+    )
+    
+    def query(sql, params):
+        if 'item_bucket' in sql:
+            return [{'day': start, 'item_bucket': '2件', 'order_count': 1, 'total_amount': Decimal('800'), 'amount_count': 1}]
+        return [{'day': start, 'net_revenue': Decimal('1200.5'), 'completed_orders': 3, 'user_sketch': None}]
+    
+    assert store.refresh(bq_config, start, start + timedelta(days=1), query=query) == 2
+    assert store.missing_days(SCOPE, start, start + timedelta(days=1)) == []
+    assert store.sum_orders(SCOPE, start, start + timedelta(days=1))['net_revenue'] == 1200.5
+    assert store.sum_items(SCOPE, start, start)['2件'][1] == 800
+    print("   ✅ 由資料列寫入每日彙總正確")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("測試每日彙總儲存")
+    print("=" * 60)
+    test_sums_and_averages()
+    test_missing_days()
+    test_settle_days()
+    test_user_sketches()
+    test_refresh_from_rows()
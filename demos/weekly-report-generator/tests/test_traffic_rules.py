@@ -0,0 +1,129 @@
+"""
+測試流量分類規則的 Python / BigQuery 一致性
+將抽樣的 source/medium 分別送入 Python 分類器與 BigQuery SQL CASE 語句，確認分類結果完全相同
+（沒有 Google Cloud 認證時只執行 Python 端檢查，略過 BigQuery 比對）
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.traffic_rules import TRAFFIC_RULES, traffic_source_colors, traffic_channel_mapping
+from src.utils.traffic_classifier import TrafficClassifier, classify_traffic_source_sql
+
+
+# 固定樣本：涵蓋每一條規則、大小寫差異、NULL 與規則優先順序
+FIXED_SAMPLES = [
+    ('(direct)', '(none)'), ('(direct)', '(not set)'), ('(direct)', 'referral'),
+    ('google', 'organic'), ('Google', 'Organic'), ('yahoo', 'search'), ('bing', 'SEARCH'),
+    ('google', 'cpc'), ('facebook', 'PAID'), ('fb', 'fb-sitelink'), ('google', 'pmax'), ('meta', 'ad'),
+    ('line', 'edm'), ('LINE', 'message'), ('app', 'Push'), ('crm', 'email'), ('shop', 'SMS'),
+    ('chatgpt.com', 'referral'), ('ChatGPT', 'referral'), ('perplexity.ai', 'referral'), ('gemini', '(none)'),
+    ('facebook.com', 'referral'), ('Instagram', 'social'), ('t.co', 'referral'), ('tXco', 'referral'),
+    ('linktr.ee', 'referral'), ('pinterest', 'social'), ('linkedin.com', 'referral'),
+    ('blog.example.com', 'referral'), ('partner', 'Referral'), ('partner', 'affiliate'),
+    (None, None), ('', ''), ('newsletter', None), (None, 'organic'), ('(not set)', '(not set)'),
+]
+
+# 隨機樣本的組成元素
+_SOURCE_TOKENS = ['google', 'Facebook', 'line', 'chatgpt', 'news', 'shop', '(direct)', 'T.co', 'edm', 'ig', 'Search']
+_MEDIUM_TOKENS = ['organic', 'CPC', 'referral', 'social', '(none)', 'email', 'ads', 'push', 'display', '']
+
+
+def sample_pairs(count=300, seed=42):
+    """
+    產生抽樣的 source/medium（固定樣本 + 隨機組合）
+    
+    Args:
+        count: 隨機組合數
+        seed: 亂數種子
+    
+    Returns:
+        list: [(source, medium)]
+    """
+    rng = random.Random(seed)
+    pairs = list(FIXED_SAMPLES)
+    for _ in range(count):
+        source = ''.join(rng.sample(_SOURCE_TOKENS, rng.randint(1, 2)))
+        medium = rng.choice(_MEDIUM_TOKENS)
+        pairs.append((source, medium))
+    return pairs
+
+
+def has_bigquery_credentials():
+    """檢查是否有可用的 Google Cloud 認證"""
+    try:
+        import google.auth
+        google.auth.default()
+        return True
+    except Exception:
+        return False
+
+
+def classify_with_bigquery(pairs):
+    """
+    以 BigQuery 執行規則表產生的 SQL CASE 語句
+    
+    Args:
+        pairs: [(source, medium)]
+    
+    Returns:
+        list: 與輸入順序相同的分類結果
+    """
+    from config.bigquery import BigQueryConfig
+
+    def literal(value):
+        if value is None:
+            return 'CAST(NULL AS STRING)'
+        return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+    
+    rows = ',\n'.join(
+        f"STRUCT({i} AS idx, {literal(source)} AS source, {literal(medium)} AS medium)"
+        for i, (source, medium) in enumerate(pairs)
+    )
+    query = f"""
+    SELECT idx, {classify_traffic_source_sql('t.source', 't.medium')} AS label
+    FROM UNNEST([{rows}]) AS t
+    ORDER BY idx
+    """
+    df = BigQueryConfig().query(query, use_cache=False).to_dataframe()
+    return df['label'].tolist()
+
+
+def test_rule_table():
+    """規則表產生的顏色、last_touch_channel 對應與分類標籤一致"""
+    labels = [rule['label'] for rule in TRAFFIC_RULES]
+    assert len(labels) == len(set(labels)) == 8
+    assert set(traffic_source_colors()) == set(labels)
+    assert set(traffic_channel_mapping().values()) <= set(labels)
+    print(f"   ✅ 規則表：{len(labels)} 種分類，顏色與 last_touch_channel 對應皆使用相同標籤")
+
+
+def test_python_bigquery_parity():
+    """Python 分類器與 BigQuery SQL CASE 語句的分類結果相同"""
+    pairs = sample_pairs()
+    expected = TrafficClassifier().classify_many([s for s, _ in pairs], [m for _, m in pairs])
+    
+    if not has_bigquery_credentials():
+        print(f"   ⚠️  沒有 Google Cloud 認證，略過 BigQuery 比對（Python 端已分類 {len(pairs)} 筆樣本）")
+        return
+    
+    actual = classify_with_bigquery(pairs)
+    mismatches = [
+        (pair, py_label, sql_label)
+        for pair, py_label, sql_label in zip(pairs, expected, actual)
+        if py_label != sql_label
+    ]
+    for pair, py_label, sql_label in mismatches[:10]:
+        print(f"   ❌ {pair}: Python={py_label} / SQL={sql_label}")
+    assert not mismatches, f"{len(mismatches)} 筆樣本分類不一致"
+    print(f"   ✅ {len(pairs)} 筆樣本的 Python 與 BigQuery 分類結果一致")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("測試流量分類規則一致性")
+    print("=" * 60)
+    test_rule_table()
+    test_python_bigquery_parity()